@@ -1,23 +1,83 @@
+import os
+import sqlite3
 import requests
 import json
 import logging
 import re
-from typing import Dict, Any, Optional
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple
+
+from cache_ia import CacheDecisoesIA
 
 # --- CONFIGURAÇÃO ---
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Sem basicConfig no import: quem executa (pipeline, app, benchmarks) configura os handlers do log
 logger = logging.getLogger(__name__)
 
 MODELO_PERMITIDO = "llama3.2"
-URL_OLLAMA = "http://localhost:11434/api/generate"
+MODELO_EMBEDDING_PERMITIDO = "nomic-embed-text"  # Só para a recuperação de candidatos (recuperacao.py)
+# OLLAMA_URL permite apontar para outro host ou para o servidor simulado (ollama_simulado.py)
+URL_BASE_OLLAMA = os.environ.get("OLLAMA_URL", "http://localhost:11434").rstrip('/')
+URL_OLLAMA = f"{URL_BASE_OLLAMA}/api/generate"
+URL_TAGS = f"{URL_BASE_OLLAMA}/api/tags"
+URL_EMBED = f"{URL_BASE_OLLAMA}/api/embed"
 TIMEOUT_SEGUNDOS = 30
 MAX_CARACTERES_PROMPT = 1000
 
 BLACKLIST_KEYWORDS = ["IGNORE ALL", "SYSTEM OVERRIDE", "DELETE", "DROP TABLE"]
 
+# --- CLIENTE HTTP / CIRCUIT BREAKER ---
+TTL_DISPONIBILIDADE_SEGUNDOS = 300  # Revalida /api/tags no máximo a cada 5 min
+LIMITE_FALHAS_CONSECUTIVAS = 3      # Falhas de rede (ou HTTP 5xx) seguidas que abrem o circuito
+TEMPO_CIRCUITO_ABERTO_SEGUNDOS = 60 # Após esse tempo, uma chamada de teste é permitida
+TAMANHO_POOL_CONEXOES = 16
+
+# --- MODO LOTE ---
+TAMANHO_LOTE_PADRAO = 10  # Pares por requisição em consultar_lote
+TAMANHO_LOTE_EMBEDDINGS = 64  # Textos por requisição em gerar_embeddings
+
+# --- CACHE DE DECISÕES ---
+# Alterar o texto do prompt exige incrementar VERSAO_PROMPT (invalida o cache antigo)
+VERSAO_PROMPT = "v1"
+VERSAO_PROMPT_LOTE = "lote-v1"
+USAR_CACHE = True
+CAMINHO_CACHE = "data/cache_decisoes_ia.sqlite"
+CACHE_TTL_DIAS = 90
+CACHE_MAX_ENTRADAS = 50_000
+
+_cache_decisoes: Optional[CacheDecisoesIA] = None
+
+def obter_cache() -> Optional[CacheDecisoesIA]:
+    """Abre (uma única vez) o cache persistente de decisões, se habilitado."""
+    global _cache_decisoes
+    if USAR_CACHE and _cache_decisoes is None:
+        try:
+            _cache_decisoes = CacheDecisoesIA(CAMINHO_CACHE, CACHE_TTL_DIAS, CACHE_MAX_ENTRADAS)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache de decisões indisponível, consultando sem cache: {e}")
+    return _cache_decisoes
+
+# O cache é só atalho: uma falha dele (ex.: "database is locked") não pode custar a decisão do modelo.
+# Decisões lidas do cache voltam marcadas com 'do_cache': não são evidência nova (ver regras_aprendidas).
+def ler_cache(cache: Optional[CacheDecisoesIA], chave: str) -> Optional[Dict]:
+    if cache is None:
+        return None
+    try:
+        dados = cache.obter(chave)
+    except (sqlite3.Error, ValueError) as e:
+        logger.warning(f"Falha ao ler o cache de decisões (seguindo para o modelo): {e}")
+        return None
+    return dict(dados, do_cache=True) if dados is not None else None
+
+def gravar_cache(cache: Optional[CacheDecisoesIA], chave: str, dados: Dict):
+    if cache is None:
+        return
+    try:
+        cache.salvar(chave, dados)
+    except sqlite3.Error as e:
+        logger.warning(f"Falha ao gravar no cache de decisões (decisão mantida): {e}")
+
 def sanitizar_entrada(texto: str) -> str:
     if not texto:
         raise ValueError("Entrada vazia não permitida.")
@@ -31,17 +91,17 @@ def sanitizar_entrada(texto: str) -> str:
     return texto.strip()
 
 # [AJUSTE 1] Adicionado retorno explícito -> bool
-def validar_disponibilidade_modelo() -> bool:
+def validar_disponibilidade_modelo(sessao: Optional[requests.Session] = None, modelo: str = MODELO_PERMITIDO) -> bool:
     try:
-        resp = requests.get("http://localhost:11434/api/tags", timeout=5)
+        resp = (sessao or requests).get(URL_TAGS, timeout=5)
         if resp.status_code == 200:
             modelos = [m['name'] for m in resp.json()['models']]
-            if not any(MODELO_PERMITIDO in m for m in modelos):
-                logger.critical(f"Modelo '{MODELO_PERMITIDO}' não encontrado!")
+            if not any(modelo in m for m in modelos):
+                logger.critical(f"Modelo '{modelo}' não encontrado!")
                 return False
             return True
         return False
-    except requests.exceptions.ConnectionError:
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         logger.critical("OLLAMA NÃO DETECTADO. Verifique se o app está rodando.")
         return False
 
@@ -79,14 +139,7 @@ def extrair_validar_json(texto_bruto: str) -> Dict[str, Any]:
         json_str = texto_bruto[inicio:fim]
         dados = json.loads(json_str)
         
-        # Validação Estrutural (Campos existem?)
-        campos_obrigatorios = ["match", "confianca", "justificativa"]
-        if not all(campo in dados for campo in campos_obrigatorios):
-            raise ValueError(f"JSON incompleto. Campos esperados: {campos_obrigatorios}")
-        
-        # Validação Semântica (Os dados fazem sentido?)
-        validar_conteudo_negocio(dados)
-            
+        validar_elemento(dados)
         return dados
         
     except (json.JSONDecodeError, ValueError) as e:
@@ -94,15 +147,68 @@ def extrair_validar_json(texto_bruto: str) -> Dict[str, Any]:
         logger.debug(f"Payload recusado: {texto_bruto}")
         raise
 
-def consultar_agente_blindado(transacao_a: str, transacao_b: str) -> Optional[Dict]:
-    if not validar_disponibilidade_modelo():
-        return None
+def validar_elemento(dados: Any):
+    """Validação estrutural + semântica de uma decisão (resposta simples ou item de lote)."""
+    if not isinstance(dados, dict):
+        raise ValueError(f"Decisão inválida. Esperado objeto JSON, recebido: {type(dados)}")
+
+    # Validação Estrutural (Campos existem?)
+    campos_obrigatorios = ["match", "confianca", "justificativa"]
+    if not all(campo in dados for campo in campos_obrigatorios):
+        raise ValueError(f"JSON incompleto. Campos esperados: {campos_obrigatorios}")
+
+    if not isinstance(dados.get('confianca'), str):
+        raise ValueError(f"Campo 'confianca' inválido. Esperado texto, recebido: {type(dados.get('confianca'))}")
+
+    # Validação Semântica (Os dados fazem sentido?)
+    validar_conteudo_negocio(dados)
 
+def extrair_validar_json_lote(texto_bruto: str, ids_esperados: List[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Extrai a resposta de um prompt em lote (array JSON, ou objeto com a chave
+    "resultados") e valida cada elemento separadamente.
+
+    Retorna apenas os elementos válidos, indexados pelo id; ids ausentes,
+    repetidos ou inválidos ficam de fora para o chamador refazer individualmente.
+    Erros de estrutura do lote inteiro levantam ValueError/JSONDecodeError.
+    """
     try:
-        t_a_clean = sanitizar_entrada(transacao_a)
-        t_b_clean = sanitizar_entrada(transacao_b)
+        if not texto_bruto or not texto_bruto.strip():
+            raise ValueError("A IA retornou uma resposta vazia.")
+
+        inicio = min((i for i in (texto_bruto.find('['), texto_bruto.find('{')) if i != -1), default=-1)
+        fim = max(texto_bruto.rfind(']'), texto_bruto.rfind('}')) + 1
+        if inicio == -1 or fim == 0:
+            raise ValueError("Nenhum JSON encontrado na resposta.")
+
+        dados = json.loads(texto_bruto[inicio:fim])
+        itens = dados.get('resultados') if isinstance(dados, dict) else dados
+        if not isinstance(itens, list):
+            raise ValueError("Resposta em lote sem lista de resultados.")
 
-        prompt = f"""
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error(f"Falha na validação da resposta em lote: {e}")
+        logger.debug(f"Payload recusado: {texto_bruto}")
+        raise
+
+    validos = {}
+    esperados = set(ids_esperados)
+    for item in itens:
+        id_item = item.get('id') if isinstance(item, dict) else None
+        if id_item not in esperados or id_item in validos:
+            logger.warning(f"Item de lote ignorado (id inesperado ou repetido): {id_item}")
+            continue
+        decisao = {k: item.get(k) for k in ("match", "confianca", "justificativa") if k in item}
+        try:
+            validar_elemento(decisao)
+        except ValueError as e:
+            logger.warning(f"Item {id_item} do lote inválido: {e}")
+            continue
+        validos[id_item] = decisao
+    return validos
+
+def montar_prompt(t_a_clean: str, t_b_clean: str) -> str:
+    return f"""
         Analise estas transações.
         A: {t_a_clean}
         B: {t_b_clean}
@@ -111,6 +217,103 @@ def consultar_agente_blindado(transacao_a: str, transacao_b: str) -> Optional[Di
         {{ "match": boolean, "confianca": "alta/media/baixa", "justificativa": "string" }}
         """
 
+def montar_prompt_lote(pares_limpos: List[Tuple[str, str]]) -> str:
+    linhas = "\n".join(
+        f"        {i}) A: {' '.join(a.split())} | B: {' '.join(b.split())}"
+        for i, (a, b) in enumerate(pares_limpos)
+    )
+    return f"""
+        Analise cada par de transações abaixo, de forma independente.
+{linhas}
+        
+        Responda APENAS JSON, com exatamente um item por id:
+        {{ "resultados": [ {{ "id": number, "match": boolean, "confianca": "alta/media/baixa", "justificativa": "string" }} ] }}
+        """
+
+class ClienteAgenteIA:
+    """
+    Cliente de longa duração para o Ollama.
+
+    - Reaproveita conexões (requests.Session com pool keep-alive).
+    - Verifica /api/tags uma vez por execução (ou a cada TTL), não a cada par.
+    - Circuit breaker: após LIMITE_FALHAS_CONSECUTIVAS falhas de rede ou
+      respostas HTTP 5xx seguidas (ou com o modelo indisponível), recusa as
+      chamadas seguintes na hora, sem esperar timeout, e os pares seguem para
+      Revisão Humana.
+    """
+
+    def __init__(self, ttl_disponibilidade: float = TTL_DISPONIBILIDADE_SEGUNDOS,
+                 limite_falhas: int = LIMITE_FALHAS_CONSECUTIVAS,
+                 tempo_aberto: float = TEMPO_CIRCUITO_ABERTO_SEGUNDOS):
+        self.ttl_disponibilidade = ttl_disponibilidade
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=TAMANHO_POOL_CONEXOES)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+
+        self._lock = threading.Lock()
+        self.nova_execucao()
+
+    def nova_execucao(self):
+        """Zera o estado por execução: disponibilidade, circuito e contadores."""
+        with self._lock:
+            self._disponibilidade: Dict[str, Tuple[bool, float]] = {}  # modelo -> (disponível, verificado em)
+            self._falhas_consecutivas = 0
+            self._aberto_ate = 0.0
+            self.chamadas = 0
+            self.recusadas_circuito = 0
+            self.respostas_invalidas = 0
+            self.latencias: List[float] = []  # Segundos por chamada ao modelo (métricas p50/p95)
+
+    @property
+    def circuito_aberto(self) -> bool:
+        return time.monotonic() < self._aberto_ate
+
+    def _abrir_circuito(self, motivo: str):
+        self._aberto_ate = time.monotonic() + self.tempo_aberto
+        self._disponibilidade.clear()
+        logger.critical(f"Circuit breaker ABERTO ({motivo}). Pares seguintes vão para Revisão Humana "
+                        f"por {self.tempo_aberto:.0f}s.")
+
+    def modelo_disponivel(self, modelo: str = MODELO_PERMITIDO) -> bool:
+        """
+        O modelo está instalado no Ollama (consulta /api/tags, com cache de
+        ttl_disponibilidade)? Só a falta do modelo de decisão abre o circuito:
+        sem o de embeddings a recuperação cai no hashing e a IA segue.
+        """
+        with self._lock:
+            if self.circuito_aberto:
+                return False
+            verificado = self._disponibilidade.get(modelo)
+            if verificado is not None and time.monotonic() - verificado[1] < self.ttl_disponibilidade:
+                return verificado[0]
+            disponivel = validar_disponibilidade_modelo(self.sessao, modelo)
+            self._disponibilidade[modelo] = (disponivel, time.monotonic())
+            if not disponivel and modelo == MODELO_PERMITIDO:
+                self._abrir_circuito("modelo indisponível")
+            return disponivel
+
+    def _registrar_resultado(self, falha_rede: bool):
+        with self._lock:
+            if not falha_rede:
+                self._falhas_consecutivas = 0
+                return
+            self._falhas_consecutivas += 1
+            if self._falhas_consecutivas >= self.limite_falhas and not self.circuito_aberto:
+                self._abrir_circuito(f"{self._falhas_consecutivas} falhas de rede ou HTTP 5xx seguidas")
+
+    def _verificar_resposta(self, response: requests.Response):
+        """raise_for_status; um 5xx (servidor caído ou sobrecarregado) conta no circuito como falha de rede."""
+        if response.status_code >= 500:
+            self._registrar_resultado(falha_rede=True)
+        response.raise_for_status()
+        self._registrar_resultado(falha_rede=False)
+
+    def _gerar(self, prompt: str) -> str:
+        """POST /api/generate pela sessão compartilhada; devolve o texto bruto da resposta."""
         payload = {
             "model": MODELO_PERMITIDO,
             "prompt": prompt,
@@ -121,24 +324,186 @@ def consultar_agente_blindado(transacao_a: str, transacao_b: str) -> Optional[Di
                 "seed": 123 # <--- ADICIONE ISSO: Semente fixa para repetibilidade
             }
         }
+        with self._lock:
+            self.chamadas += 1
+        inicio = time.perf_counter()
+        try:
+            response = self.sessao.post(URL_OLLAMA, json=payload, timeout=TIMEOUT_SEGUNDOS)
+        finally:
+            with self._lock:
+                self.latencias.append(time.perf_counter() - inicio)
+        self._verificar_resposta(response)
+        return response.json().get('response', '')
 
-        logger.info("Enviando requisição ao Agente IA...")
-        response = requests.post(URL_OLLAMA, json=payload, timeout=TIMEOUT_SEGUNDOS)
-        response.raise_for_status()
+    def consultar(self, transacao_a: str, transacao_b: str) -> Optional[Dict]:
+        try:
+            t_a_clean = sanitizar_entrada(transacao_a)
+            t_b_clean = sanitizar_entrada(transacao_b)
+        except Exception as e:
+            logger.error(f"Erro no pipeline: {e}")
+            return None
 
-        resposta_ia = response.json().get('response', '')
-        
-        # Chama a nova função de extração blindada
-        dados_validados = extrair_validar_json(resposta_ia)
-        
-        logger.info(f"Análise concluída. Match: {dados_validados['match']}")
-        return dados_validados
+        # Decisões são determinísticas (temperature=0, seed fixa): consulta o cache antes do modelo
+        cache = obter_cache()
+        chave = CacheDecisoesIA.gerar_chave(t_a_clean, t_b_clean, MODELO_PERMITIDO, VERSAO_PROMPT)
+        dados_cache = ler_cache(cache, chave)
+        if dados_cache is not None:
+            logger.info(f"Decisão recuperada do cache. Match: {dados_cache['match']}")
+            return dados_cache
 
-    except Exception as e:
-        logger.error(f"Erro no pipeline: {e}")
-        return None
+        if self.circuito_aberto or not self.modelo_disponivel():
+            with self._lock:
+                self.recusadas_circuito += 1
+            logger.debug("Circuito aberto: par encaminhado para Revisão Humana sem chamar a IA.")
+            return None
+
+        try:
+            logger.info("Enviando requisição ao Agente IA...")
+            resposta_ia = self._gerar(montar_prompt(t_a_clean, t_b_clean))
+            
+            # Chama a nova função de extração blindada
+            dados_validados = extrair_validar_json(resposta_ia)
+            
+            logger.info(f"Análise concluída. Match: {dados_validados['match']}")
+            gravar_cache(cache, chave, dados_validados)
+            return dados_validados
+
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._registrar_resultado(falha_rede=True)
+            logger.error(f"Erro de comunicação com a IA: {e}")
+            return None
+        except ValueError as e:
+            # JSON malformado ou decisão fora do contrato (extrair_validar_json)
+            with self._lock:
+                self.respostas_invalidas += 1
+            logger.error(f"Erro no pipeline: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Erro no pipeline: {e}")
+            return None
+
+    def consultar_lote(self, pares: List[Tuple[str, str]], tamanho_lote: int = TAMANHO_LOTE_PADRAO) -> List[Optional[Dict]]:
+        """
+        Consulta vários pares empacotando até `tamanho_lote` por requisição.
+
+        Cada elemento da resposta é validado isoladamente; só os que faltarem
+        ou vierem inválidos são refeitos com `consultar` (um par por chamada).
+        Retorna uma decisão (ou None) por par, na mesma ordem da entrada.
+        """
+        resultados: List[Optional[Dict]] = [None] * len(pares)
+        cache = obter_cache()
+        pendentes = []  # (índice, texto_a, texto_b, a_limpo, b_limpo, chave)
+
+        for i, (transacao_a, transacao_b) in enumerate(pares):
+            try:
+                a_limpo = sanitizar_entrada(transacao_a)
+                b_limpo = sanitizar_entrada(transacao_b)
+            except Exception as e:
+                logger.error(f"Erro no pipeline: {e}")
+                continue
+            chave = CacheDecisoesIA.gerar_chave(a_limpo, b_limpo, MODELO_PERMITIDO, VERSAO_PROMPT_LOTE)
+            dados_cache = ler_cache(cache, chave)
+            if dados_cache is not None:
+                resultados[i] = dados_cache
+                continue
+            pendentes.append((i, transacao_a, transacao_b, a_limpo, b_limpo, chave))
+
+        for inicio in range(0, len(pendentes), max(1, tamanho_lote)):
+            lote = pendentes[inicio:inicio + max(1, tamanho_lote)]
+            validos = {}
+            if not self.circuito_aberto and self.modelo_disponivel():
+                try:
+                    logger.info(f"Enviando lote de {len(lote)} pares ao Agente IA...")
+                    resposta_ia = self._gerar(montar_prompt_lote([(p[3], p[4]) for p in lote]))
+                    validos = extrair_validar_json_lote(resposta_ia, list(range(len(lote))))
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    self._registrar_resultado(falha_rede=True)
+                    logger.error(f"Erro de comunicação com a IA (lote): {e}")
+                except ValueError as e:
+                    with self._lock:
+                        self.respostas_invalidas += 1
+                    logger.error(f"Falha no lote, refazendo par a par: {e}")
+                except Exception as e:
+                    logger.error(f"Falha no lote, refazendo par a par: {e}")
+
+            for posicao, (i, transacao_a, transacao_b, _, _, chave) in enumerate(lote):
+                if posicao in validos:
+                    resultados[i] = validos[posicao]
+                    gravar_cache(cache, chave, validos[posicao])
+                else:
+                    resultados[i] = self.consultar(transacao_a, transacao_b)
+
+        return resultados
+
+    def gerar_embeddings(self, textos: List[str]) -> Optional[List[List[float]]]:
+        """
+        Vetores de MODELO_EMBEDDING_PERMITIDO (POST /api/embed) para os textos,
+        sanitizados como os prompts e enviados em lotes de TAMANHO_LOTE_EMBEDDINGS.
+        Tudo ou nada: qualquer falha (rede, circuito aberto, resposta fora do
+        contrato) devolve None e quem chamou decide o fallback.
+        """
+        try:
+            limpos = [sanitizar_entrada(t) for t in textos]
+        except ValueError as e:
+            logger.error(f"Erro no pipeline (embeddings): {e}")
+            return None
+        if self.circuito_aberto or not self.modelo_disponivel(MODELO_EMBEDDING_PERMITIDO):
+            return None
+
+        vetores: List[List[float]] = []
+        try:
+            for inicio in range(0, len(limpos), TAMANHO_LOTE_EMBEDDINGS):
+                lote = limpos[inicio:inicio + TAMANHO_LOTE_EMBEDDINGS]
+                with self._lock:
+                    self.chamadas += 1
+                response = self.sessao.post(URL_EMBED, json={"model": MODELO_EMBEDDING_PERMITIDO, "input": lote},
+                                            timeout=TIMEOUT_SEGUNDOS)
+                self._verificar_resposta(response)
+                recebidos = response.json().get('embeddings')
+                if not isinstance(recebidos, list) or len(recebidos) != len(lote):
+                    raise ValueError(f"Resposta de embeddings com {len(recebidos or [])} vetores para {len(lote)} textos.")
+                vetores.extend(recebidos)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            self._registrar_resultado(falha_rede=True)
+            logger.error(f"Erro de comunicação com a IA (embeddings): {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Falha ao gerar embeddings: {e}")
+            return None
+        return vetores
+
+_cliente_padrao: Optional[ClienteAgenteIA] = None
+_lock_cliente = threading.Lock()
+
+def configurar_url_ollama(url_base: str):
+    """Troca o endereço do Ollama em tempo de execução (testes, benchmarks, servidor simulado)."""
+    global URL_BASE_OLLAMA, URL_OLLAMA, URL_TAGS, URL_EMBED
+    URL_BASE_OLLAMA = url_base.rstrip('/')
+    URL_OLLAMA = f"{URL_BASE_OLLAMA}/api/generate"
+    URL_TAGS = f"{URL_BASE_OLLAMA}/api/tags"
+    URL_EMBED = f"{URL_BASE_OLLAMA}/api/embed"
+    if _cliente_padrao is not None:
+        _cliente_padrao.nova_execucao()
+
+def obter_cliente() -> ClienteAgenteIA:
+    """Cliente compartilhado pelo processo (uma sessão HTTP e um circuito)."""
+    global _cliente_padrao
+    with _lock_cliente:
+        if _cliente_padrao is None:
+            _cliente_padrao = ClienteAgenteIA()
+        return _cliente_padrao
+
+def consultar_agente_blindado(transacao_a: str, transacao_b: str) -> Optional[Dict]:
+    return obter_cliente().consultar(transacao_a, transacao_b)
+
+def consultar_agente_lote(pares: List[Tuple[str, str]], tamanho_lote: int = TAMANHO_LOTE_PADRAO) -> List[Optional[Dict]]:
+    return obter_cliente().consultar_lote(pares, tamanho_lote)
+
+def gerar_embeddings(textos: List[str]) -> Optional[List[List[float]]]:
+    return obter_cliente().gerar_embeddings(textos)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     # Teste de robustez
     print("--- Teste de Validação de Tipos ---")
     t1 = "PGTO FORNECEDOR 123"
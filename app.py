@@ -1,19 +1,36 @@
 import streamlit as st
 import pandas as pd
 import os
-import time
 import shutil
+import json
 import logging
 from datetime import datetime
 from utils import normalizar_coluna
+from carregadores import cabecalho_xlsx
 
 # --- IMPORTAÇÃO DO BACKEND ---
-from conciliador_enterprise_v2 import pipeline_enterprise, PASTA_LOGS, PASTA_OUTPUT, PASTA_INPUT
+from conciliador_enterprise_v2 import PASTA_LOGS, PASTA_OUTPUT, PASTA_INPUT
+from jobs_conciliacao import obter_gerenciador, STATUS_CONCLUIDO, STATUS_FINAIS
 
 # --- CONFIGURAÇÃO DE SEGURANÇA ---
 MAX_FILE_SIZE_MB = 50
 MAX_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
+# --- EXIBIÇÃO ---
+LINHAS_POR_PAGINA = 1_000  # Tabelas grandes são enviadas ao navegador uma página por vez
+INTERVALO_ATUALIZACAO_S = 1.0  # Frequência de atualização do progresso de uma execução em andamento
+ETAPAS_PROGRESSO = {
+    'carregamento': "Carregando e validando arquivos...",
+    'match_exato': "ETAPA 1: Match exato...",
+    'matching_particionado': "ETAPAS 1 e 2: Matching particionado...",
+    'match_tolerancia': "ETAPA 2: Match por tolerância...",
+    'match_agrupado': "ETAPA 2B: Pagamentos agrupados (soma)...",
+    'recuperacao': "Selecionando candidatos para a IA...",
+    'ia': "ETAPA 3: Adjudicação por IA...",
+    'pendencias': "Justificando pendências...",
+    'relatorio': "Gravando relatório...",
+}
+
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
     page_title="Conciliador Enterprise AI",
@@ -62,8 +79,8 @@ def validar_integridade_basica(uploaded_file):
         return False
     
     try:
-        # Tenta ler apenas o cabeçalho para ver se não está corrompido
-        pd.read_excel(uploaded_file, nrows=0)
+        # Lê apenas o cabeçalho (zip + primeira linha) para ver se não está corrompido
+        cabecalho_xlsx(uploaded_file.getvalue())
         return True
     except Exception:
         st.error(f"❌ O arquivo '{uploaded_file.name}' está corrompido ou não é um Excel válido.")
@@ -75,9 +92,8 @@ def validar_assinatura_arquivo(uploaded_file, tipo_esperado):
     Impede que o usuário coloque o arquivo do Banco no lugar do Protheus.
     """
     try:
-        # Lê apenas o cabeçalho
-        df = pd.read_excel(uploaded_file, nrows=0)
-        colunas = [normalizar_coluna(c) for c in df.columns]
+        # Cabeçalho já lido por validar_integridade_basica (cache por hash do conteúdo)
+        colunas = [normalizar_coluna(c) for c in cabecalho_xlsx(uploaded_file.getvalue()) if c is not None]
         # Regras para PROTHEUS
         if tipo_esperado == "Protheus":
             # Deve ter 'natureza' (para saber D/C) ou 'historico'
@@ -101,21 +117,130 @@ def validar_assinatura_arquivo(uploaded_file, tipo_esperado):
     except Exception as e:
         return False, f"Erro ao validar colunas: {e}"
 
-def salvar_upload_seguro(uploaded_file, nome_destino):
-    """Salva com tratamento de erro de IO."""
-    try:
-        caminho_completo = os.path.join(PASTA_INPUT, nome_destino)
-        # O 'wb' garante que o arquivo antigo seja sobrescrito completamente
-        with open(caminho_completo, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return True
-    except Exception as e:
-        st.error(f"Erro ao salvar arquivo em disco: {e}")
-        return False
+def exibir_metricas(metricas, caminho_metricas):
+    """Quebra por etapa (tempo, CPU, memória, linhas) e indicadores da IA da execução."""
+    with st.expander(f"⏱️ Desempenho da execução ({metricas['tempo_total_s']:.2f}s)", expanded=False):
+        df_etapas = pd.DataFrame(metricas['etapas'])
+        colunas = ['etapa', 'tempo_s', 'cpu_s', 'memoria_pico_mb', 'linhas_entrada', 'linhas_saida']
+        df_etapas = df_etapas.reindex(columns=colunas)
+        df_etapas['% do tempo'] = (100 * df_etapas['tempo_s'] / max(metricas['tempo_total_s'], 1e-9)).round(1)
+        st.bar_chart(df_etapas.set_index('etapa')['tempo_s'])
+        st.dataframe(df_etapas, use_container_width=True, hide_index=True)
+
+        ia = metricas.get('ia', {})
+        if ia:
+            i1, i2, i3, i4, i5 = st.columns(5)
+            i1.metric("Chamadas ao Modelo", ia.get('chamadas_modelo', 0))
+            i2.metric("Latência p50 / p95", f"{ia.get('p50_ms') or 0:.0f} / {ia.get('p95_ms') or 0:.0f} ms")
+            i3.metric("Cache (hits / misses)", f"{ia.get('cache_hits') or 0} / {ia.get('cache_misses') or 0}")
+            i4.metric("Rejeitados (IA / léxico)", f"{ia.get('rejeitados_ia', 0)} / {ia.get('lexico_rejeitados', 0)}")
+            i5.metric("Inválidas / Circuito", f"{ia.get('respostas_invalidas', 0)} / {ia.get('recusadas_circuito', 0)}")
+        st.caption(f"Métricas completas: {caminho_metricas}")
+
+def exibir_tabela_paginada(df, chave):
+    """Mostra o DataFrame em páginas de LINHAS_POR_PAGINA (a página escolhida sobrevive aos reruns)."""
+    total_paginas = max(1, -(-len(df) // LINHAS_POR_PAGINA))
+    pagina = 1
+    if total_paginas > 1:
+        pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas,
+                                 value=1, step=1, key=f"pagina_{chave}")
+    inicio = (pagina - 1) * LINHAS_POR_PAGINA
+    fim = min(inicio + LINHAS_POR_PAGINA, len(df))
+    st.dataframe(df.iloc[inicio:fim], use_container_width=True, hide_index=True)
+    if total_paginas > 1:
+        st.caption(f"Linhas {inicio + 1}–{fim} de {len(df)}")
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def carregar_abas_job(id_job):
+    """Abas de um job concluído (imutáveis): lidas do Parquet uma vez e reaproveitadas nos reruns."""
+    return obter_gerenciador().carregar_abas(id_job)
+
+def exibir_resultado(job):
+    """KPIs e tabelas a partir das abas do job (Parquet), sem reler o Excel."""
+    st.divider()
+    abas = carregar_abas_job(job['id'])
+    df_conciliados = abas['Conciliados']
+    df_pend_prot = abas['Pendencia Protheus']
+    df_pend_banco = abas['Pendencia Banco']
+    resumo = job['resumo']
+
+    # Dashboard de KPIs
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Volume Conciliado", f"R$ {df_conciliados['Valor_Real'].sum():,.2f}")
+    k2.metric("Itens Conciliados", len(df_conciliados))
+    # Etapa de IA inteira: decididos pelo modelo, por similaridade textual e por regra aprendida
+    k3.metric("Recuperados por IA", resumo['conciliados_ia'])
+    k4.metric("Pendências Totais", len(df_pend_prot) + len(df_pend_banco), delta_color="inverse")
+
+    # Tabelas
+    t1, t2, t3 = st.tabs(["✅ Conciliados", "⚠️ Pend. Protheus", "⚠️ Pend. Banco"])
+    with t1: exibir_tabela_paginada(df_conciliados, 'conciliados')
+    with t2: exibir_tabela_paginada(df_pend_prot, 'pend_protheus')
+    with t3: exibir_tabela_paginada(df_pend_banco, 'pend_banco')
+
+    if os.path.exists(resumo['caminho_metricas']):
+        with open(resumo['caminho_metricas'], 'r', encoding='utf-8') as f:
+            exibir_metricas(json.load(f), resumo['caminho_metricas'])
+
+    # Download
+    timestamp_safe = datetime.now().strftime('%Y%m%d_%H%M%S')
+    with open(resumo['caminho_saida'], "rb") as f:
+        st.download_button(
+            label="📥 BAIXAR RELATÓRIO OFICIAL",
+            data=f,
+            file_name=f"Auditoria_{timestamp_safe}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+@st.fragment(run_every=INTERVALO_ATUALIZACAO_S)
+def acompanhar_job(id_job):
+    """Progresso ao vivo do job (só este trecho é reexecutado); ao terminar, recarrega a página."""
+    job = obter_gerenciador().status(id_job)
+    if job['status'] in STATUS_FINAIS:
+        st.rerun()
+
+    progresso = job['progresso']
+    concluidas = progresso.get('etapas_concluidas', [])
+    # Sete etapas; o matching particionado faz as etapas 1 e 2 de uma vez
+    fracao = (len(concluidas) + ('matching_particionado' in concluidas)) / 7
+    if progresso.get('etapa') == 'ia' and progresso.get('consultas_total'):
+        fracao += progresso['consultas_concluidas'] / progresso['consultas_total'] / 7
+    etapa = ETAPAS_PROGRESSO.get(progresso.get('etapa'), "Aguardando na fila...")
+    st.progress(min(fracao, 1.0), text=f"🔄 {etapa}")
+
+    p1, p2, p3 = st.columns(3)
+    linhas = (progresso.get('linhas_protheus') or 0) + (progresso.get('linhas_banco') or 0)
+    p1.metric("Linhas Carregadas", linhas)
+    p2.metric("Pares Conciliados", progresso.get('conciliados', 0))
+    p3.metric("Consultas IA", f"{progresso.get('consultas_concluidas', 0)} / {progresso.get('consultas_total', 0)}")
+    st.caption(f"Job {id_job} — pode fechar a página e voltar depois pelo painel lateral.")
+
+def exibir_job(id_job):
+    job = obter_gerenciador().status(id_job)
+    if job is None:
+        st.warning(f"Execução '{id_job}' não encontrada.")
+        return
+    if job['status'] not in STATUS_FINAIS:
+        acompanhar_job(id_job)
+        return
+    if job['status'] == STATUS_CONCLUIDO:
+        st.success(f"✅ Execução {id_job} concluída em {job['concluido_em'] - job['criado_em']:.2f}s")
+        exibir_resultado(job)
+    else:
+        st.error(f"❌ Execução {id_job} terminou com status '{job['status']}': {job['erro']}")
+
+    if st.button("🔄 Novo Processamento"):
+        st.session_state['job_id'] = None
+        st.query_params.clear()
+        st.rerun()
 
 # --- INICIALIZAÇÃO DE ESTADO ---
-if 'processando' not in st.session_state:
-    st.session_state['processando'] = False
+# A execução vive no gerenciador de jobs; a sessão (e a URL, para reconectar) guarda só o id
+if 'job_id' not in st.session_state:
+    st.session_state['job_id'] = st.query_params.get('job')
+
+job_atual = obter_gerenciador().status(st.session_state['job_id']) if st.session_state['job_id'] else None
+processando = job_atual is not None and job_atual['status'] not in STATUS_FINAIS
 
 # --- BARRA LATERAL ---
 with st.sidebar:
@@ -126,8 +251,22 @@ with st.sidebar:
     validar_permissoes()
 
     st.subheader("1. Carregar Dados")
-    uploaded_protheus = st.file_uploader("Relatório Protheus (.xlsx)", type="xlsx", disabled=st.session_state['processando'])
-    uploaded_banco = st.file_uploader("Extrato Bancário (.xlsx)", type="xlsx", disabled=st.session_state['processando'])
+    uploaded_protheus = st.file_uploader("Relatório Protheus (.xlsx)", type="xlsx", disabled=processando)
+    uploaded_banco = st.file_uploader("Extrato Bancário (.xlsx)", type="xlsx", disabled=processando)
+
+    # Reconexão: qualquer execução recente (inclusive de outra aba ou analista) pode ser reaberta
+    st.subheader("2. Execuções Recentes")
+    jobs_recentes = obter_gerenciador().listar()
+    if jobs_recentes:
+        rotulos = {j['id']: f"{j['id']} · {j['status']} · {j['descricao'] or ''}" for j in jobs_recentes}
+        escolhido = st.selectbox("Reabrir execução", [None] + list(rotulos),
+                                 format_func=lambda i: "—" if i is None else rotulos[i])
+        if escolhido and escolhido != st.session_state['job_id'] and st.button("📂 Abrir"):
+            st.session_state['job_id'] = escolhido
+            st.query_params['job'] = escolhido
+            st.rerun()
+    else:
+        st.caption("Nenhuma execução registrada.")
     
     st.markdown("---")
     st.caption("v4.0.0 - Enterprise Secure")
@@ -135,7 +274,7 @@ with st.sidebar:
 # --- ÁREA PRINCIPAL ---
 st.title("Conciliação Bancária com IA Generativa")
 
-if uploaded_protheus and uploaded_banco:
+if uploaded_protheus and uploaded_banco and not processando:
     
     # 1. Validação Básica (Tamanho/Corrupção)
     if not validar_integridade_basica(uploaded_protheus) or not validar_integridade_basica(uploaded_banco):
@@ -164,87 +303,28 @@ if uploaded_protheus and uploaded_banco:
         st.success("✅ Arquivos validados e assinaturas conferidas.")
         
     with col_btn:
-        iniciar = st.button(
-            "🚀 INICIAR AUDITORIA", 
-            type="primary", 
-            disabled=st.session_state['processando']
-        )
+        iniciar = st.button("🚀 INICIAR AUDITORIA", type="primary")
 
     if iniciar:
-        st.session_state['processando'] = True
-        
+        rotacionar_logs()
+        for chave in [c for c in st.session_state.keys() if str(c).startswith('pagina_')]:
+            del st.session_state[chave]
         try:
-            # Preparação e Backup
-            rotacionar_logs()
-            
-            if salvar_upload_seguro(uploaded_protheus, "sistema_protheus.xlsx") and \
-               salvar_upload_seguro(uploaded_banco, "extrato_banco.xlsx"):
-
-                # Execução do Motor
-                with st.status("🔄 Executando Motor de Conciliação...", expanded=True) as status:
-                    st.write("⚙️ Inicializando pipelines seguros...")
-                    st.write("📂 Validando schema dos dados...")
-                    time.sleep(0.5)
-                    
-                    st.write("🤖 Acionando Agente IA (Llama 3.2)...")
-                    
-                    start_time = time.time()
-                    try:
-                        # Chama o Backend
-                        pipeline_enterprise()
-                        
-                        tempo = time.time() - start_time
-                        status.update(label=f"✅ Concluído em {tempo:.2f}s", state="complete", expanded=False)
-                        
-                    except Exception as e:
-                        status.update(label="❌ Erro na Execução", state="error")
-                        st.error(f"Falha no Backend: {e}")
-                        st.session_state['processando'] = False
-                        st.stop()
-
-                # Exibição de Resultados
-                arquivo_final = os.path.join(PASTA_OUTPUT, 'RELATORIO_ENTERPRISE_V2.xlsx')
-                if os.path.exists(arquivo_final):
-                    st.divider()
-                    
-                    try:
-                        df_conciliados = pd.read_excel(arquivo_final, sheet_name='Conciliados')
-                        df_pend_prot = pd.read_excel(arquivo_final, sheet_name='Pendencia Protheus')
-                        df_pend_banco = pd.read_excel(arquivo_final, sheet_name='Pendencia Banco')
-
-                        # Dashboard de KPIs
-                        k1, k2, k3, k4 = st.columns(4)
-                        k1.metric("Volume Conciliado", f"R$ {df_conciliados['Valor_Real'].sum():,.2f}")
-                        k2.metric("Itens Conciliados", len(df_conciliados))
-                        
-                        qtd_ia = 0
-                        if 'Metodo' in df_conciliados.columns:
-                            qtd_ia = len(df_conciliados[df_conciliados['Metodo'] == 'Inteligência Artificial'])
-                        k3.metric("Recuperados por IA", qtd_ia)
-                        k4.metric("Pendências Totais", len(df_pend_prot) + len(df_pend_banco), delta_color="inverse")
-
-                        # Tabelas
-                        t1, t2, t3 = st.tabs(["✅ Conciliados", "⚠️ Pend. Protheus", "⚠️ Pend. Banco"])
-                        with t1: st.dataframe(df_conciliados, use_container_width=True, hide_index=True)
-                        with t2: st.dataframe(df_pend_prot, use_container_width=True, hide_index=True)
-                        with t3: st.dataframe(df_pend_banco, use_container_width=True, hide_index=True)
-
-                        # Download
-                        timestamp_safe = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        with open(arquivo_final, "rb") as f:
-                            st.download_button(
-                                label="📥 BAIXAR RELATÓRIO OFICIAL",
-                                data=f,
-                                file_name=f"Auditoria_{timestamp_safe}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
-                    except Exception as e:
-                        st.error(f"Erro ao ler relatório final: {e}")
-
-        finally:
-            st.session_state['processando'] = False
-            if st.button("🔄 Novo Processamento"):
-                st.rerun()
-
-else:
-    st.info("👈 Faça upload dos arquivos para começar.")
\ No newline at end of file
+            # Cada execução ganha pasta própria (entrada, saída, logs): analistas não sobrescrevem uns aos outros
+            id_job = obter_gerenciador().submeter(
+                uploaded_protheus.getvalue(), uploaded_banco.getvalue(),
+                descricao=f"{uploaded_protheus.name} x {uploaded_banco.name}",
+            )
+        except Exception as e:
+            st.error(f"Erro ao iniciar a execução: {e}")
+            st.stop()
+        st.session_state['job_id'] = id_job
+        st.query_params['job'] = id_job
+        st.rerun()
+
+elif not st.session_state['job_id']:
+    st.info("👈 Faça upload dos arquivos para começar.")
+
+# Execução atual (em andamento ou concluída), também após recarregar a página
+if st.session_state['job_id']:
+    exibir_job(st.session_state['job_id'])
@@ -0,0 +1,730 @@
+"""
+Benchmarks do motor de conciliação.
+
+Uso:
+    python benchmarks.py                 # roda todos
+    python benchmarks.py atribuicao      # roda apenas o benchmark escolhido
+
+O benchmark 'etapas' grava os tempos por etapa em data/benchmarks/*.json e
+compara com o resultado anterior, para acompanhar regressões entre versões.
+"""
+import io
+import os
+import sys
+import logging
+import json
+import time
+import glob
+import subprocess
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+import agente_seguro_v2
+from motor_matching import match_exato, match_tolerancia, COLUNAS_MATCH, MODO_GULOSO, MODO_OTIMO
+from motor_paralelo import conciliar_particionado
+from motor_agrupamento import match_agrupado, METODO_AGRUPADO_PROTHEUS
+from etapa_ia import consultar_pares_concorrente
+from carregadores import (gerar_intermediario, ler_em_blocos, sanear_bloco, ler_intermediario, cabecalho_xlsx,
+                          SCHEMAS_INTERMEDIARIOS, SUFIXO_REF)
+from gerar_cenarios import gerar_cenario_sintetico, salvar_cenario
+from etapa_ia import adjudicar_pares_ia
+from ollama_simulado import ServidorOllamaSimulado, decidir
+from recuperacao import selecionar_candidatos, BACKEND_HASHING, BACKEND_OLLAMA
+from metricas import pico_memoria_mb, zerar_pico_memoria
+from relatorio import escrever_excel, gravar_auxiliares, juntar_aba
+from utils import para_centavos, centavos_para_reais
+from conciliador_enterprise_v2 import (justificar_pendencias, validar_regras_negocio, gravar_relatorio,
+                                       montar_abas, LARGURAS_RELATORIO, LIMITE_VALOR_MAXIMO, MOTIVO_VALOR_ENCONTRADO, MOTIVO_VALOR_UNICO,
+                                       TOLERANCIA_DIAS, JANELA_IA_DIAS, LIMIAR_ACEITE_LEXICO, LIMIAR_REJEICAO_LEXICO)
+
+DATA_BASE = np.datetime64('2025-01-01')
+PASTA_RESULTADOS = 'data/benchmarks'
+TAMANHOS_ETAPAS = [10_000, 100_000, 1_000_000]
+FORMATO_ETAPAS = 'parquet'
+
+
+def _cronometrar(func, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = func(*args, **kwargs)
+    return resultado, time.perf_counter() - inicio
+
+
+def _sobras_duplicadas(n_linhas: int, n_valores: int, dias_mes: int = 30, seed: int = 42):
+    """Sobras com poucos valores distintos (ex.: folha, boletos recorrentes) e datas deslocadas."""
+    rng = np.random.default_rng(seed)
+    valores = rng.integers(5_000, 500_000, n_valores)
+    datas = DATA_BASE + rng.integers(0, dias_mes, n_linhas).astype('timedelta64[D]')
+    sobra_p = pd.DataFrame({
+        'Data': pd.to_datetime(datas),
+        'Historico': 'PGTO FORNECEDOR',
+        'Valor_Centavos': valores[rng.integers(0, n_valores, n_linhas)],
+        'Ref. Auditoria': [f"{i}_PROTHEUS" for i in range(n_linhas)],
+    })
+    deslocamento = rng.integers(-5, 6, n_linhas).astype('timedelta64[D]')
+    sobra_b = pd.DataFrame({
+        'Data': pd.to_datetime(datas + deslocamento),
+        'Descricao': 'DEBITO PAGAMENTO',
+        'Valor_Centavos': sobra_p['Valor_Centavos'].values,
+        'Ref. Auditoria': [f"{i}_BANCO" for i in range(n_linhas)],
+    }).sample(frac=1, random_state=seed).reset_index(drop=True)
+    return sobra_p, sobra_b
+
+
+def benchmark_atribuicao():
+    """Guloso (primeiro match) x atribuição ótima em grupos com muitos valores repetidos."""
+    print("\n=== Atribuição: guloso x ótimo (grupos duplicados) ===")
+    print(f"{'linhas':>8} {'valores':>8} {'modo':>7} {'tempo(s)':>9} {'matches':>8} {'pares IA':>9} {'soma dias':>10}")
+    for n_linhas, n_valores in [(10_000, 100), (20_000, 20), (100_000, 1_000)]:
+        sobra_p, sobra_b = _sobras_duplicadas(n_linhas, n_valores)
+        for modo in [MODO_GULOSO, MODO_OTIMO]:
+            (df_tol, pares_ia), tempo = _cronometrar(match_tolerancia, sobra_p, sobra_b, 3, 5, modo)
+            soma_dias = (df_tol['Data_Protheus'] - df_tol['Data_Banco']).abs().dt.days.sum()
+            print(f"{n_linhas:>8} {n_valores:>8} {modo:>7} {tempo:>9.3f} {len(df_tol):>8} {len(pares_ia):>9} {soma_dias:>10}")
+
+
+def _preparar_agente(servidor: ServidorOllamaSimulado):
+    agente_seguro_v2.configurar_url_ollama(servidor.url_base)
+    agente_seguro_v2.USAR_CACHE = False
+    cliente = agente_seguro_v2.obter_cliente()
+    cliente.nova_execucao()
+    return cliente
+
+
+def benchmark_lote_ia():
+    """Pares/s do caminho par-a-par x prompts em lote, contra o Ollama simulado (5% de JSON truncado)."""
+    pares = [(f"PGTO FORNECEDOR {i}", f"DEBITO PAGAMENTO {i}") for i in range(200)]
+    print("\n=== IA: par-a-par x lote (Ollama simulado, concorrência 4) ===")
+    print(f"{'lote':>6} {'tempo(s)':>9} {'pares/s':>9} {'req. modelo':>12} {'sem decisão':>12}")
+    with ServidorOllamaSimulado(latencia_requisicao=0.08, latencia_par=0.01, taxa_json_invalido=0.05) as servidor:
+        for tamanho_lote in [1, 5, 10, 20]:
+            cliente = _preparar_agente(servidor)
+            respostas, tempo = _cronometrar(consultar_pares_concorrente, pares, 4, tamanho_lote=tamanho_lote)
+            sem_decisao = sum(r is None for r in respostas.values())
+            print(f"{tamanho_lote:>6} {tempo:>9.3f} {len(pares) / tempo:>9.1f} {cliente.chamadas:>12} {sem_decisao:>12}")
+
+
+def benchmark_agente():
+    """Carga no agente: concorrência x falhas do modelo (HTTP 500 e JSON truncado), com resultado reprodutível."""
+    pares = [(f"PGTO FORNECEDOR {i % 40}", f"{'DOC ELET FORNECEDOR' if i % 3 else 'TARIFA'} {i % 40}") for i in range(300)]
+    pares = list(dict.fromkeys(pares))
+    print("\n=== Agente IA: concorrência x falhas (Ollama simulado, 50ms/req) ===")
+    print(f"{'erro':>6} {'json inv.':>10} {'conc.':>6} {'tempo(s)':>9} {'pares/s':>9} {'req.':>6} "
+          f"{'500':>5} {'truncados':>10} {'matches':>8} {'sem decisão':>12}")
+    for taxa_erro, taxa_json in [(0.0, 0.0), (0.02, 0.05), (0.10, 0.10)]:
+        for concorrencia in [1, 4, 8, 16]:
+            with ServidorOllamaSimulado(latencia_requisicao=0.05, taxa_erro=taxa_erro,
+                                        taxa_json_invalido=taxa_json, seed=7) as servidor:
+                _preparar_agente(servidor)
+                respostas, tempo = _cronometrar(consultar_pares_concorrente, pares, concorrencia)
+                matches = sum(bool(r and r['match']) for r in respostas.values())
+                sem_decisao = sum(r is None for r in respostas.values())
+                print(f"{taxa_erro:>6.2f} {taxa_json:>10.2f} {concorrencia:>6} {tempo:>9.3f} {len(pares) / tempo:>9.1f} "
+                      f"{servidor.requisicoes:>6} {servidor.erros:>5} {servidor.json_invalidos:>10} {matches:>8} {sem_decisao:>12}")
+
+
+def _sobras_agrupadas(n_grupos: int, n_avulsos: int, dias_mes: int = 30, seed: int = 42):
+    """Sobras com n_grupos pagamentos divididos/agregados (2 a 4 itens) no meio de lançamentos avulsos."""
+    rng = np.random.default_rng(seed)
+    linhas_p, linhas_b = [], []
+    for g in range(n_grupos):
+        dia = int(rng.integers(0, dias_mes))
+        itens = -rng.integers(1_000, 5_000_000, int(rng.integers(2, 5)))
+        agregado, divididos = (linhas_b, linhas_p) if g % 2 else (linhas_p, linhas_b)
+        agregado.append((dia, int(itens.sum()), f"GRUPO {g}"))
+        divididos.extend((dia + int(rng.integers(0, 3)), int(v), f"GRUPO {g}") for v in itens)
+    for lado in (linhas_p, linhas_b):
+        lado.extend((int(d), int(v), 'AVULSO') for d, v in zip(rng.integers(0, dias_mes, n_avulsos),
+                                                                -rng.integers(1_000, 5_000_000, n_avulsos)))
+
+    def montar(linhas, coluna, origem):
+        dias, valores, textos = zip(*linhas)
+        return pd.DataFrame({'Data': pd.to_datetime(DATA_BASE + np.array(dias).astype('timedelta64[D]')),
+                             coluna: textos, 'Valor_Centavos': np.array(valores, dtype=np.int64),
+                             'Ref. Auditoria': [f"{i}_{origem}" for i in range(len(linhas))]})
+    return montar(linhas_p, 'Historico', 'PROTHEUS'), montar(linhas_b, 'Descricao', 'BANCO')
+
+
+def benchmark_agrupamento():
+    """Match por agrupamento (soma N:1 / 1:N) nas sobras: tempo, recall dos grupos plantados e falsos positivos."""
+    print("\n=== Agrupamento: subset-sum por janela (até 4 itens, ±3 dias, 50 ms por janela) ===")
+    print(f"{'grupos':>7} {'avulsos':>8} {'tempo(s)':>9} {'achados':>8} {'certos':>7} {'recall':>7} {'falsos':>7} "
+          f"{'revisão':>8} {'janelas':>8} {'ambíguas':>9} {'estouradas':>11} {'máx(ms)':>8}")
+    # Com milhares de avulsos a ±3 dias, somas exatas de 3-4 itens saem por coincidência: esses grupos vão para
+    # Revisão Humana (coluna 'revisão') em vez de conciliados
+    for n_grupos, n_avulsos in [(100, 0), (100, 200), (1_000, 2_000), (2_000, 10_000)]:
+        sobra_p, sobra_b = _sobras_agrupadas(n_grupos, n_avulsos)
+        (df_agr, _, stats), tempo = _cronometrar(match_agrupado, sobra_p, sobra_b, 3, 4, 0.05)
+        # Um grupo está certo quando todas as suas linhas ligam itens do mesmo grupo plantado
+        linha_certa = (df_agr['Historico'] == df_agr['Descricao']) & (df_agr['Historico'] != 'AVULSO')
+        lado_alvo = np.where(df_agr['Metodo'] == METODO_AGRUPADO_PROTHEUS, 'b', 'p')
+        alvo = np.char.add(lado_alvo.astype(str), np.where(lado_alvo == 'b', df_agr['pos_b'], df_agr['pos_p']).astype(str))
+        certos = int(linha_certa.groupby(alvo).all().sum())
+        falsos = stats['grupos'] - certos
+        recall = certos / n_grupos
+        print(f"{n_grupos:>7} {n_avulsos:>8} {tempo:>9.3f} {stats['grupos']:>8} {certos:>7} {recall:>7.1%} {falsos:>7} "
+              f"{stats['grupos_revisao']:>8} {stats['janelas']:>8} {stats['janelas_ambiguas']:>9} {stats['janelas_estouradas']:>11} "
+              f"{stats['tempo_max_janela_ms']:>8}")
+
+
+def _sobras_faixa_ia(n_valores: int, tamanho_grupo: int, seed: int = 42):
+    """
+    Grupos de `tamanho_grupo` pagamentos de mesmo valor a fornecedores diferentes,
+    todos caindo na faixa da IA (D+4/D+5): o banco abrevia o nome do fornecedor.
+    """
+    rng = np.random.default_rng(seed)
+    n_linhas = n_valores * tamanho_grupo
+    fornecedores = [f"{a} {b}" for a in ['ALFA', 'BETA', 'GAMA', 'DELTA', 'OMEGA', 'SIGMA', 'KAPPA', 'ZETA']
+                    for b in ['SERVICOS', 'COMERCIO', 'LOGISTICA', 'TECNOLOGIA', 'ENGENHARIA', 'ALIMENTOS']]
+    escolhidos = np.array([rng.choice(len(fornecedores), tamanho_grupo, replace=False) for _ in range(n_valores)]).ravel()
+    datas = DATA_BASE + np.repeat(rng.integers(0, 25, n_valores), tamanho_grupo).astype('timedelta64[D]')
+    valores = np.repeat(-rng.integers(5_000, 500_000, n_valores), tamanho_grupo)
+    sobra_p = pd.DataFrame({
+        'Data': pd.to_datetime(datas),
+        'Historico': [f"PAGTO NF {rng.integers(1000, 9999)} {fornecedores[f]} LTDA" for f in escolhidos],
+        'Valor_Centavos': valores,
+        'Ref. Auditoria': [f"{i}_PROTHEUS" for i in range(n_linhas)],
+    })
+    sobra_b = pd.DataFrame({
+        'Data': pd.to_datetime(datas + rng.integers(4, 6, n_linhas).astype('timedelta64[D]')),
+        'Descricao': [f"PIX ENV {fornecedores[f].split()[0]} {fornecedores[f].split()[1][:4]}" for f in escolhidos],
+        'Valor_Centavos': valores,
+        'Ref. Auditoria': [f"{i}_BANCO" for i in range(n_linhas)],
+    })
+    return sobra_p, sobra_b
+
+
+def benchmark_recuperacao():
+    """Consultas à IA com e sem a recuperação top-k por embeddings, em grupos grandes de mesmo valor."""
+    print("\n=== Recuperação: todos os pares x top-k por embeddings (faixa D+4/D+5) ===")
+    print(f"{'valores':>8} {'grupo':>6} {'backend':>8} {'top-k':>6} {'pares':>8} {'consultas':>10} {'tempo(s)':>9} "
+          f"{'certos':>7} {'errados':>8}")
+
+    def consultar(historico, descricao):
+        # Modelo simulado mais exigente que 'decidir': o fornecedor inteiro tem que aparecer abreviado
+        nome = historico.split()[3:5]
+        return decidir(historico, descricao) if f"{nome[0]} {nome[1][:4]}" in descricao else \
+            {'match': False, 'confianca': 'baixa', 'justificativa': 'Fornecedor diferente.'}
+
+    with ServidorOllamaSimulado() as servidor:
+        _preparar_agente(servidor)
+        for n_valores, tamanho_grupo in [(200, 10), (50, 40)]:
+            sobra_p, sobra_b = _sobras_faixa_ia(n_valores, tamanho_grupo)
+            _, pares_ia = match_tolerancia(sobra_p, sobra_b, TOLERANCIA_DIAS, JANELA_IA_DIAS)
+            for backend, top_k in [(None, None), (BACKEND_HASHING, 1), (BACKEND_HASHING, 3), (BACKEND_OLLAMA, 3)]:
+                inicio = time.perf_counter()
+                pares = pares_ia if backend is None else selecionar_candidatos(sobra_p, sobra_b, pares_ia, top_k, backend)[0]
+                df_ia, _, stats = adjudicar_pares_ia(sobra_p, sobra_b, pares, ['alta'], 4, consultar=consultar)
+                tempo = time.perf_counter() - inicio
+                certos = int((df_ia['pos_p'].values == df_ia['pos_b'].values).sum())
+                print(f"{n_valores:>8} {tamanho_grupo:>6} {backend or '-':>8} {top_k or '-':>6} {len(pares):>8} "
+                      f"{stats['consultas']:>10} {tempo:>9.3f} {certos:>7} {len(df_ia) - certos:>8}")
+
+
+def _carga_excel_atual(caminho: str):
+    return pd.read_excel(caminho)
+
+
+def _carga_intermediario(caminho: str):
+    destino = os.path.join(os.path.dirname(caminho), 'intermediario.parquet')
+    gerar_intermediario(caminho, 'Banco', destino, validar=lambda bloco: True)
+    return pd.read_parquet(destino)
+
+
+def _executar_medido(func, caminho: str, fila):
+    inicio = time.perf_counter()
+    df = func(caminho)
+    tempo = time.perf_counter() - inicio
+    fila.put((tempo, pico_memoria_mb(), len(df)))
+
+
+def _medir_em_processo(func, caminho: str):
+    """Roda a carga em um processo novo para que o pico de memória (RSS) seja só dela."""
+    ctx = multiprocessing.get_context('spawn')
+    fila = ctx.Queue()
+    processo = ctx.Process(target=_executar_medido, args=(func, caminho, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def benchmark_carregamento():
+    """Carga atual (pd.read_excel) x leitura em blocos para o Parquet intermediário, por formato."""
+    print("\n=== Carregamento: read_excel x blocos -> Parquet ===")
+    print(f"{'linhas':>8} {'formato':>8} {'caminho':>14} {'tempo(s)':>9} {'pico RSS(MB)':>13} {'linhas ok':>10}")
+    rng = np.random.default_rng(42)
+    for n_linhas in [50_000, 200_000]:
+        df = pd.DataFrame({
+            'Data': pd.to_datetime(DATA_BASE + rng.integers(0, 365, n_linhas).astype('timedelta64[D]')),
+            'Descricao': [f"PAGAMENTO FORNECEDOR {i % 5000}" for i in range(n_linhas)],
+            'Valor': np.round(rng.uniform(-5000, 5000, n_linhas), 2),
+        })
+        with tempfile.TemporaryDirectory() as pasta:
+            base = os.path.join(pasta, 'extrato_banco')
+            df.to_excel(base + '.xlsx', index=False)
+            df.to_csv(base + '.csv', index=False)
+            df.to_parquet(base + '.parquet', index=False)
+            casos = [('xlsx', 'read_excel', _carga_excel_atual), ('xlsx', 'blocos', _carga_intermediario),
+                     ('csv', 'blocos', _carga_intermediario), ('parquet', 'blocos', _carga_intermediario)]
+            for formato, nome, func in casos:
+                tempo, pico, linhas = _medir_em_processo(func, f"{base}.{formato}")
+                print(f"{n_linhas:>8} {formato:>8} {nome:>14} {tempo:>9.3f} {pico:>13.1f} {linhas:>10}")
+
+
+def _carga_texto(caminho: str, origem: str) -> pd.DataFrame:
+    """Layout anterior do extrato saneado: textos como str (object) e Ref. Auditoria '<linha>_<ORIGEM>'."""
+    df = pd.read_parquet(caminho)
+    df['Ref. Auditoria'] = df['Ref. Auditoria'].astype(str) + SUFIXO_REF[origem]
+    return df
+
+
+def benchmark_memoria():
+    """Bytes por linha do extrato saneado: textos/refs como str x categorias/ids inteiros (e o match exato em cada um)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    print("\n=== Memória do extrato saneado: str x representação compacta ===")
+    print(f"{'linhas':>9} {'textos':>8} {'layout':>9} {'bytes/linha':>12} {'total(MB)':>10} {'carga(s)':>9} {'exato(s)':>9}")
+    rng = np.random.default_rng(42)
+    for n_linhas in [1_000_000, 3_000_000]:
+        n_textos = n_linhas // 20
+        fornecedores = np.array([f"FORNECEDOR {i:05d} LTDA" for i in range(n_textos // 10)], dtype=object)
+        textos_p = np.char.add(np.char.add('PGTO NF ', rng.integers(0, 10, n_textos).astype(str)), ' ').astype(object) + \
+            fornecedores[rng.integers(0, len(fornecedores), n_textos)]
+        bruto_p = pd.DataFrame({
+            'Data': pd.to_datetime(DATA_BASE + rng.integers(0, 365, n_linhas).astype('timedelta64[D]')),
+            'Historico': textos_p[rng.integers(0, n_textos, n_linhas)],
+            'Valor': np.round(rng.uniform(0, 50_000, n_linhas), 2),
+            'Natureza': np.where(rng.random(n_linhas) < 0.6, 'D', 'C'),
+        })
+        bruto_b = pd.DataFrame({
+            'Data': bruto_p['Data'].values + rng.integers(0, 3, n_linhas).astype('timedelta64[D]'),
+            'Descricao': np.char.add('PIX ', rng.integers(0, n_textos, n_linhas).astype(str)).astype(object),
+            'Valor': np.where(bruto_p['Natureza'].values == 'D', -1, 1) * bruto_p['Valor'].values,
+        })
+        with tempfile.TemporaryDirectory() as pasta:
+            caminhos = {}
+            for origem, bruto in [('Protheus', bruto_p), ('Banco', bruto_b)]:
+                caminhos[origem] = os.path.join(pasta, f"{origem}.parquet")
+                saneado, _, _ = sanear_bloco(bruto, origem)
+                pq.write_table(pa.Table.from_pandas(saneado, schema=SCHEMAS_INTERMEDIARIOS[origem], preserve_index=False),
+                               caminhos[origem])
+            del bruto_p, bruto_b, saneado
+            for layout, carregar in [('str', _carga_texto), ('compacto', ler_intermediario)]:
+                (df_p, df_b), tempo_carga = _cronometrar(lambda: (carregar(caminhos['Protheus'], 'Protheus'),
+                                                                  carregar(caminhos['Banco'], 'Banco')))
+                total = df_p.memory_usage(deep=True, index=False).sum() + df_b.memory_usage(deep=True, index=False).sum()
+                (conciliados, sobra_p, sobra_b), tempo_exato = _cronometrar(match_exato, df_p, df_b)
+                print(f"{n_linhas:>9} {n_textos:>8} {layout:>9} {total / (2 * n_linhas):>12.1f} {total / 2**20:>10.1f} "
+                      f"{tempo_carga:>9.3f} {tempo_exato:>9.3f}")
+                del df_p, df_b, conciliados, sobra_p, sobra_b
+
+
+def benchmark_cabecalho():
+    """Validação do upload: pd.read_excel(nrows=0) nos dois validadores x leitura do cabeçalho no zip (com cache por hash)."""
+    import xlsxwriter
+    print("\n=== Cabeçalho do .xlsx: read_excel(nrows=0) x zip + primeira linha ===")
+    print(f"{'linhas':>8} {'MB':>6} {'read_excel x2(s)':>17} {'zip frio(s)':>12} {'cache(s)':>9}")
+    rng = np.random.default_rng(42)
+    for n_linhas in [100_000, 500_000]:
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, 'extrato_banco.xlsx')
+            with xlsxwriter.Workbook(caminho) as workbook:
+                planilha = workbook.add_worksheet()
+                planilha.write_row(0, 0, ['Data', 'Descrição', 'Valor'])
+                for linha, (dia, valor) in enumerate(zip(rng.integers(45_000, 46_000, n_linhas).tolist(),
+                                                         np.round(rng.uniform(-5000, 5000, n_linhas), 2).tolist()), start=1):
+                    planilha.write_row(linha, 0, [dia, f"PIX ENVIADO DOC {linha:08d}", valor])
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+
+            def read_excel_duas_vezes():
+                # Como os dois validadores faziam: cada um relia o cabeçalho pelo openpyxl
+                return [list(pd.read_excel(io.BytesIO(conteudo), nrows=0).columns) for _ in range(2)][0]
+            _, tempo_pandas = _cronometrar(read_excel_duas_vezes)
+            _, tempo_frio = _cronometrar(cabecalho_xlsx, conteudo)
+            _, tempo_cache = _cronometrar(cabecalho_xlsx, conteudo)
+            print(f"{n_linhas:>8} {len(conteudo) / 2**20:>6.1f} {tempo_pandas:>17.3f} {tempo_frio:>12.4f} {tempo_cache:>9.4f}")
+
+
+def _extratos_brutos(n_linhas: int, seed: int = 42):
+    """
+    Extratos como chegam do arquivo (Valor em reais, Natureza no Protheus), com
+    nulos, datas vazias e valores zerados. ~60% do Banco bate exato, ~20% tem o
+    mesmo valor em outra data e o resto é valor que só existe no Banco. As
+    chaves (Data, valor) não se repetem em um mesmo lado: o match exato por
+    ocorrência e o merge direto da versão original casam as mesmas linhas.
+    """
+    rng = np.random.default_rng(seed)
+    centavos = rng.choice(np.arange(1, 50_000_000), 2 * n_linhas, replace=False)
+    valores, extras = centavos[:n_linhas] / 100, centavos[n_linhas:] / 100
+    valores[rng.integers(0, n_linhas, n_linhas // 100)] = 0.0
+    datas = DATA_BASE + rng.integers(0, 365, n_linhas).astype('timedelta64[D]')
+    natureza = np.where(rng.random(n_linhas) < 0.6, 'D', 'C')
+    bruto_p = pd.DataFrame({'Data': pd.to_datetime(datas), 'Historico': 'PGTO FORNECEDOR', 'Valor': valores,
+                            'Natureza': natureza})
+
+    sorteio = rng.random(n_linhas)
+    sinal = np.where(natureza == 'D', -1, 1)
+    bruto_b = pd.DataFrame({
+        'Data': pd.to_datetime(np.where(sorteio < 0.8, datas + np.where(sorteio < 0.6, 0, 7).astype('timedelta64[D]'),
+                                        DATA_BASE + rng.integers(0, 365, n_linhas).astype('timedelta64[D]'))),
+        'Descricao': 'DEBITO PAGAMENTO',
+        'Valor': np.where(sorteio < 0.8, sinal * valores, extras * rng.choice([-1, 1], n_linhas)),
+    }).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    for bruto, texto in [(bruto_p, 'Historico'), (bruto_b, 'Descricao')]:
+        nulos = rng.integers(0, n_linhas, n_linhas // 200)
+        bruto.loc[nulos[0::3], 'Valor'] = np.nan
+        bruto.loc[nulos[1::3], texto] = None
+        bruto.loc[nulos[2::3], 'Data'] = pd.NaT
+    return bruto_p, bruto_b
+
+
+def _saneamento_por_linha(bruto_p: pd.DataFrame, bruto_b: pd.DataFrame) -> dict:
+    """
+    Implementação original (apply por linha, merge direto, busca linear dos
+    motivos), mantida como referência: devolve as três abas do relatório.
+    """
+    df_p, df_b = bruto_p.copy(), bruto_b.copy()
+    df_p.dropna(subset=['Valor', 'Historico'], inplace=True)
+    df_b.dropna(subset=['Valor', 'Descricao'], inplace=True)
+    df_p['Valor_Real'] = df_p.apply(lambda x: x['Valor'] * -1 if x['Natureza'] == 'D' else x['Valor'], axis=1)
+    df_b['Valor_Real'] = df_b['Valor']
+    df_p['Valor_Real'] = df_p['Valor_Real'].astype(float).round(2)
+    df_b['Valor_Real'] = df_b['Valor_Real'].astype(float).round(2)
+    df_p['Data'] = pd.to_datetime(df_p['Data'], errors='coerce')
+    df_b['Data'] = pd.to_datetime(df_b['Data'], errors='coerce')
+    df_p.dropna(subset=['Data'], inplace=True)
+    df_b.dropna(subset=['Data'], inplace=True)
+    df_p['Ref. Auditoria'] = df_p.index.astype(str) + "_PROTHEUS"
+    df_b['Ref. Auditoria'] = df_b.index.astype(str) + "_BANCO"
+    for df in (df_p, df_b):
+        outliers = df[(df['Valor_Real'] == 0) | (df['Valor_Real'].abs() > LIMITE_VALOR_MAXIMO)]
+        df.drop(outliers.index, inplace=True)
+
+    match = pd.merge(df_p, df_b, on=['Data', 'Valor_Real'], how='outer', indicator=True, suffixes=('_Protheus', '_Banco'))
+    conciliados = match[match['_merge'] == 'both'].copy()
+    conciliados['Metodo'] = 'Exato'
+    conciliados['Justificativa_Auditoria'] = 'Valores e Datas coincidem perfeitamente.'
+    sobra_p = match[match['_merge'] == 'left_only'][['Data', 'Historico', 'Valor_Real', 'Ref. Auditoria_Protheus']].rename(
+        columns={'Ref. Auditoria_Protheus': 'Ref. Auditoria'})
+    sobra_b = match[match['_merge'] == 'right_only'][['Data', 'Descricao', 'Valor_Real', 'Ref. Auditoria_Banco']].rename(
+        columns={'Ref. Auditoria_Banco': 'Ref. Auditoria'})
+
+    def justificar_pendencia(row, df_comparacao):
+        if row['Valor_Real'] in df_comparacao['Valor_Real'].values:
+            return MOTIVO_VALOR_ENCONTRADO
+        return MOTIVO_VALOR_UNICO
+    sobra_p['Motivo da Pendência'] = sobra_p.apply(lambda row: justificar_pendencia(row, df_b), axis=1)
+    sobra_b['Motivo da Pendência'] = sobra_b.apply(lambda row: justificar_pendencia(row, df_p), axis=1)
+    cols_conciliados = ['Data', 'Historico', 'Descricao', 'Valor_Real', 'Metodo', 'Justificativa_Auditoria']
+    return {'Conciliados': conciliados.reindex(columns=cols_conciliados),
+            'Pendencia Protheus': sobra_p, 'Pendencia Banco': sobra_b}
+
+
+def _saneamento_colunar(bruto_p: pd.DataFrame, bruto_b: pd.DataFrame) -> dict:
+    df_p = validar_regras_negocio(sanear_bloco(bruto_p, 'Protheus')[0], 'Protheus')
+    df_b = validar_regras_negocio(sanear_bloco(bruto_b, 'Banco')[0], 'Banco')
+    conciliados, sobra_p, sobra_b = match_exato(df_p, df_b)
+    sobra_p = sobra_p.assign(**{'Motivo da Pendência': justificar_pendencias(sobra_p, df_b, np.zeros(len(sobra_p), dtype=bool))})
+    sobra_b = sobra_b.assign(**{'Motivo da Pendência': justificar_pendencias(sobra_b, df_p, np.zeros(len(sobra_b), dtype=bool))})
+    abas = montar_abas(conciliados, pd.DataFrame(), sobra_p, sobra_b)
+    return {nome_aba: juntar_aba(partes) for nome_aba, partes in abas.items()}
+
+
+def benchmark_saneamento():
+    """
+    Saneamento (sinal pela Natureza, nulos, datas, outliers) + match exato +
+    motivos de pendência: implementação original por linha x colunar.
+    """
+    print("\n=== Saneamento: por linha x colunar (abas Conciliados e Pendências completas) ===")
+    print(f"{'linhas':>9} {'por linha(s)':>13} {'colunar(s)':>11} {'conciliados':>12} {'pendências':>11}")
+    for n_linhas in [20_000, 1_000_000]:
+        bruto_p, bruto_b = _extratos_brutos(n_linhas)
+        novo, tempo_novo = _cronometrar(_saneamento_colunar, bruto_p, bruto_b)
+        pendencias = len(novo['Pendencia Protheus']) + len(novo['Pendencia Banco'])
+        # A referência é O(n·m): só roda no tamanho pequeno
+        if n_linhas <= 20_000:
+            _, tempo_antigo = _cronometrar(_saneamento_por_linha, bruto_p, bruto_b)
+            print(f"{n_linhas:>9} {tempo_antigo:>13.3f} {tempo_novo:>11.3f} {len(novo['Conciliados']):>12} {pendencias:>11}")
+        else:
+            print(f"{n_linhas:>9} {'-':>13} {tempo_novo:>11.3f} {len(novo['Conciliados']):>12} {pendencias:>11}")
+
+
+def benchmark_centavos():
+    """Match exato (merge outer) e agrupamento com chave float (reais) x int64 (centavos)."""
+    print("\n=== Chave de valor: float x centavos int64 ===")
+    print(f"{'linhas':>9} {'chave':>9} {'merge(s)':>9} {'groupby(s)':>11} {'memória(MB)':>12}")
+    rng = np.random.default_rng(42)
+    for n_linhas in [1_000_000]:
+        datas = pd.to_datetime(DATA_BASE + rng.integers(0, 30, n_linhas).astype('timedelta64[D]'))
+        reais_p = np.round(rng.uniform(-5000, 5000, n_linhas), 2)
+        reais_b = np.where(rng.random(n_linhas) < 0.7, reais_p, np.round(rng.uniform(-5000, 5000, n_linhas), 2))
+        for chave, conv in [('Valor_Real', lambda v: v), ('Valor_Centavos', para_centavos)]:
+            df_p = pd.DataFrame({'Data': datas, chave: conv(reais_p)})
+            df_b = pd.DataFrame({'Data': datas, chave: conv(reais_b)}).sample(frac=1, random_state=1)
+            _, tempo_merge = _cronometrar(pd.merge, df_p, df_b, on=['Data', chave], how='outer', indicator=True)
+            _, tempo_grupo = _cronometrar(lambda: df_p.groupby(chave).size())
+            memoria = df_p[chave].memory_usage(deep=True, index=False) / 1e6
+            print(f"{n_linhas:>9} {'int64' if chave == 'Valor_Centavos' else 'float':>9} {tempo_merge:>9.3f} {tempo_grupo:>11.3f} {memoria:>12.1f}")
+
+
+def _extratos_duplicados(n_linhas: int, n_chaves: int, seed: int = 42):
+    """Extratos saneados onde poucas chaves (Data, valor) se repetem muito (folha, boletos), com lados desbalanceados."""
+    rng = np.random.default_rng(seed)
+    datas = pd.to_datetime(DATA_BASE + rng.integers(0, 5, n_chaves).astype('timedelta64[D]'))
+    valores = rng.integers(5_000, 500_000, n_chaves)
+    chave_p = rng.integers(0, n_chaves, n_linhas)
+    chave_b = rng.integers(0, n_chaves, int(n_linhas * 0.9))
+    df_p = pd.DataFrame({'Data': datas[chave_p], 'Historico': 'FOLHA PAGAMENTO', 'Valor_Centavos': valores[chave_p],
+                         'Ref. Auditoria': [f"{i}_PROTHEUS" for i in range(len(chave_p))]})
+    df_b = pd.DataFrame({'Data': datas[chave_b], 'Descricao': 'PAGTO SALARIO', 'Valor_Centavos': valores[chave_b],
+                         'Ref. Auditoria': [f"{i}_BANCO" for i in range(len(chave_b))]})
+    return df_p, df_b
+
+
+def benchmark_match_exato():
+    """Merge direto (muitos-para-muitos) x pareamento por ocorrência com duplicatas."""
+    print("\n=== Match exato: merge direto x pareamento por ocorrência (duplicatas) ===")
+    print(f"{'linhas':>8} {'chaves':>7} {'linhas merge':>13} {'conciliados':>12} {'esperado':>9} {'tempo(s)':>9}")
+    for n_linhas, n_chaves in [(10_000, 50), (200_000, 500), (1_000_000, 2_000)]:
+        df_p, df_b = _extratos_duplicados(n_linhas, n_chaves)
+        qtd_p = df_p.groupby(['Data', 'Valor_Centavos']).size()
+        qtd_b = df_b.groupby(['Data', 'Valor_Centavos']).size()
+        qtd_p, qtd_b = qtd_p.align(qtd_b, fill_value=0)
+        # Linhas que o merge direto geraria (sum kp*kb) x o máximo um-para-um possível (sum min(kp, kb))
+        linhas_merge = int((qtd_p * qtd_b).sum())
+        esperado = int(np.minimum(qtd_p, qtd_b).sum())
+
+        (conciliados, _, _), tempo = _cronometrar(match_exato, df_p, df_b)
+        print(f"{n_linhas:>8} {n_chaves:>7} {linhas_merge:>13} {len(conciliados):>12} {esperado:>9} {tempo:>9.3f}")
+
+
+def _extratos_sinteticos(n_linhas: int, seed: int = 42):
+    """Extratos saneados: ~60% batem exato, ~30% com a data deslocada em até 5 dias, ~10% sem par."""
+    rng = np.random.default_rng(seed)
+    datas = DATA_BASE + rng.integers(0, 30, n_linhas).astype('timedelta64[D]')
+    valores = rng.integers(1_000, 5_000_000, n_linhas)
+    df_p = pd.DataFrame({'Data': pd.to_datetime(datas), 'Historico': 'PGTO FORNECEDOR', 'Valor_Centavos': valores,
+                         'Ref. Auditoria': np.arange(n_linhas).astype(str).astype(object) + '_PROTHEUS'})
+    sorteio = rng.random(n_linhas)
+    deslocamento = np.where(sorteio < 0.6, 0, rng.integers(-5, 6, n_linhas)).astype('timedelta64[D]')
+    valores_b = np.where(sorteio < 0.9, valores, rng.integers(1_000, 5_000_000, n_linhas))
+    df_b = pd.DataFrame({'Data': pd.to_datetime(datas + deslocamento), 'Descricao': 'DEBITO PAGAMENTO', 'Valor_Centavos': valores_b,
+                         'Ref. Auditoria': np.arange(n_linhas).astype(str).astype(object) + '_BANCO'})
+    return df_p, df_b.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _conciliar_serial(df_p, df_b, tolerancia_dias, janela_ia_dias, modo):
+    conciliados, sobra_p, sobra_b = match_exato(df_p, df_b)
+    df_tol, pares_ia = match_tolerancia(sobra_p, sobra_b, tolerancia_dias, janela_ia_dias, modo)
+    return conciliados, sobra_p, sobra_b, df_tol, pares_ia
+
+
+def benchmark_particionado():
+    """Match exato + tolerância: 1 processo x fatias por valor em 2/4/8 processos."""
+    print(f"\n=== Matching particionado (CPUs disponíveis: {os.cpu_count()}) ===")
+    print(f"{'linhas':>9} {'workers':>8} {'tempo(s)':>9} {'speedup':>8} {'exatos':>8} {'tolerância':>11}")
+    for n_linhas in [1_000_000, 2_000_000]:
+        df_p, df_b = _extratos_sinteticos(n_linhas)
+        base, tempo_base = _cronometrar(_conciliar_serial, df_p, df_b, 3, 5, MODO_GULOSO)
+        print(f"{n_linhas:>9} {1:>8} {tempo_base:>9.3f} {1.0:>8.2f} {len(base[0]):>8} {len(base[3]):>11}")
+        for workers in [2, 4, 8]:
+            res, tempo = _cronometrar(conciliar_particionado, df_p, df_b, 3, 5, MODO_GULOSO, workers)
+            print(f"{n_linhas:>9} {workers:>8} {tempo:>9.3f} {tempo_base / tempo:>8.2f} {len(res[0]):>8} {len(res[3]):>11}")
+
+
+def _consulta_local(historico: str, descricao: str) -> dict:
+    """Decisão fixa, sem rede: mede só o custo da orquestração da etapa de IA."""
+    return {'match': True, 'confianca': 'alta', 'justificativa': 'Benchmark local.'}
+
+
+def _versao_codigo() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconhecida'
+
+
+def _medir_etapas(caminho_p: str, caminho_b: str, pasta: str) -> tuple:
+    tempos = {}
+
+    def etapa(nome, func, *args, **kwargs):
+        resultado, tempos[nome] = _cronometrar(func, *args, **kwargs)
+        return resultado
+
+    ler = lambda caminho: pd.concat(list(ler_em_blocos(caminho)))
+    bruto_p = etapa('carga', ler, caminho_p)
+    bruto_b, tempo_b = _cronometrar(ler, caminho_b)
+    tempos['carga'] += tempo_b
+
+    def sanear(bruto, origem):
+        return validar_regras_negocio(sanear_bloco(bruto, origem)[0], origem)
+    df_p = etapa('saneamento', sanear, bruto_p, 'Protheus')
+    df_b, tempo_b = _cronometrar(sanear, bruto_b, 'Banco')
+    tempos['saneamento'] += tempo_b
+
+    conciliados, sobra_p, sobra_b = etapa('exato', match_exato, df_p, df_b)
+    df_tol, pares_ia = etapa('tolerancia', match_tolerancia, sobra_p, sobra_b, TOLERANCIA_DIAS, JANELA_IA_DIAS)
+    df_ia, _, stats_ia = etapa('ia', adjudicar_pares_ia, sobra_p, sobra_b, pares_ia, ['alta'],
+                               consultar=_consulta_local, limiar_aceite=LIMIAR_ACEITE_LEXICO,
+                               limiar_rejeicao=LIMIAR_REJEICAO_LEXICO)
+
+    def relatorio():
+        livres_p = np.ones(len(sobra_p), dtype=bool)
+        livres_b = np.ones(len(sobra_b), dtype=bool)
+        livres_p[np.concatenate([df_tol['pos_p'].values, df_ia['pos_p'].values])] = False
+        livres_b[np.concatenate([df_tol['pos_b'].values, df_ia['pos_b'].values])] = False
+        final_p, final_b = sobra_p[livres_p].copy(), sobra_b[livres_b].copy()
+        final_p['Motivo da Pendência'] = justificar_pendencias(final_p, df_b, np.zeros(len(final_p), dtype=bool))
+        final_b['Motivo da Pendência'] = justificar_pendencias(final_b, df_p, np.zeros(len(final_b), dtype=bool))
+        novos = pd.concat([df_tol, df_ia], ignore_index=True).sort_values('pos_p', kind='stable')
+        gravar_relatorio(os.path.join(pasta, 'relatorio.xlsx'), conciliados, novos.reindex(columns=COLUNAS_MATCH),
+                         final_p, final_b)
+    etapa('relatorio', relatorio)
+
+    contagens = {'linhas_protheus': len(df_p), 'linhas_banco': len(df_b), 'exatos': len(conciliados),
+                 'tolerancia': len(df_tol), 'pares_ia': len(pares_ia), 'ia_aprovados': len(df_ia),
+                 'consultas_ia': stats_ia['consultas']}
+    return {k: round(v, 4) for k, v in tempos.items()}, contagens
+
+
+def benchmark_etapas(tamanhos=None):
+    """Tempo de cada etapa do pipeline em dados sintéticos; grava JSON e compara com a execução anterior."""
+    tamanhos = tamanhos or TAMANHOS_ETAPAS
+    anteriores = sorted(glob.glob(os.path.join(PASTA_RESULTADOS, 'etapas_*.json')))
+    anterior = {}
+    if anteriores:
+        with open(anteriores[-1], 'r', encoding='utf-8') as f:
+            anterior = {r['linhas']: r['tempos_s'] for r in json.load(f)['resultados']}
+
+    print(f"\n=== Etapas do pipeline (entrada {FORMATO_ETAPAS}; IA com decisão local) ===")
+    nomes = ['carga', 'saneamento', 'exato', 'tolerancia', 'ia', 'relatorio']
+    print(f"{'linhas':>9} " + " ".join(f"{n:>11}" for n in nomes) + f" {'total':>9}")
+    resultados = []
+    for n_linhas in tamanhos:
+        df_protheus, df_banco = gerar_cenario_sintetico(n_linhas)
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho_p, caminho_b = salvar_cenario(df_protheus, df_banco, pasta, [FORMATO_ETAPAS])[FORMATO_ETAPAS]
+            tempos, contagens = _medir_etapas(caminho_p, caminho_b, pasta)
+        total = sum(tempos.values())
+        print(f"{n_linhas:>9} " + " ".join(f"{tempos[n]:>11.3f}" for n in nomes) + f" {total:>9.3f}")
+        if n_linhas in anterior:
+            variacao = [f"{(tempos[n] / anterior[n_linhas][n] - 1) * 100:+.0f}%" if anterior[n_linhas].get(n) else '-'
+                        for n in nomes]
+            print(f"{'vs ant.':>9} " + " ".join(f"{v:>11}" for v in variacao))
+        resultados.append({'linhas': n_linhas, 'tempos_s': tempos, 'total_s': round(total, 4), 'contagens': contagens})
+
+    os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+    timestamp = time.strftime('%Y-%m-%d_%H-%M-%S')
+    caminho = os.path.join(PASTA_RESULTADOS, f"etapas_{timestamp}.json")
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump({'versao': _versao_codigo(), 'data': timestamp, 'formato': FORMATO_ETAPAS,
+                   'cpus': os.cpu_count(), 'python': sys.version.split()[0], 'pandas': pd.__version__,
+                   'resultados': resultados}, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {caminho}")
+
+
+def _abas_sinteticas(n_linhas: int, seed: int = 42) -> dict:
+    """Abas do relatório (partes em centavos, como saem de montar_abas) com n_linhas no total."""
+    rng = np.random.default_rng(seed)
+    n_exatos, n_novos, n_pend = n_linhas // 2, n_linhas // 10, n_linhas // 5
+    datas = lambda n: pd.to_datetime(DATA_BASE + rng.integers(0, 365, n).astype('timedelta64[D]'))
+    valores = lambda n: pd.array(rng.integers(-500_000, 500_000, n), dtype='Int64')
+    conciliados = pd.DataFrame({
+        'Data': datas(n_exatos), 'Historico': [f"PGTO FORNECEDOR {i % 5000}" for i in range(n_exatos)],
+        'Descricao': [f"DEBITO PAGAMENTO {i % 5000}" for i in range(n_exatos)], 'Valor_Centavos': valores(n_exatos),
+        'Metodo': 'Exato (Valor+Data)', 'Justificativa_Auditoria': 'Match Exato',
+    })
+    novos = pd.DataFrame({
+        'Data_Protheus': datas(n_novos), 'Historico': 'TARIFA', 'Data_Banco': datas(n_novos), 'Descricao': 'TAR BANC',
+        'Valor_Centavos': valores(n_novos), 'Metodo': 'Tolerância (Data)', 'Justificativa_Auditoria': 'Diferença de 2 dia(s)',
+    }).reindex(columns=COLUNAS_MATCH)
+
+    def pendencias(n, texto, origem):
+        return pd.DataFrame({'Data': datas(n), texto: 'LANCAMENTO SEM PAR', 'Valor_Centavos': valores(n),
+                             'Ref. Auditoria': [f"{i}_{origem}" for i in range(n)],
+                             'Motivo da Pendência': MOTIVO_VALOR_UNICO})
+    return montar_abas(conciliados, novos, pendencias(n_pend, 'Historico', 'PROTHEUS'),
+                       pendencias(n_linhas - n_exatos - n_novos - n_pend, 'Descricao', 'BANCO'))
+
+
+def _relatorio_pandas(caminho: str, abas: dict):
+    """Gravação anterior (referência): pd.concat das partes, cópia em reais e to_excel."""
+    with pd.ExcelWriter(caminho, engine='xlsxwriter') as writer:
+        for nome_aba, partes in abas.items():
+            centavos_para_reais(pd.concat(partes)).to_excel(writer, sheet_name=nome_aba, index=False)
+        fmt_text = writer.book.add_format({'text_wrap': True})
+        writer.sheets['Conciliados'].set_column('F:F', 50, fmt_text)
+        writer.sheets['Pendencia Protheus'].set_column('E:E', 60, fmt_text)
+        writer.sheets['Pendencia Banco'].set_column('E:E', 60, fmt_text)
+
+
+def _relatorio_streaming(caminho: str, abas: dict):
+    escrever_excel(caminho, abas, LARGURAS_RELATORIO)
+
+
+def _relatorio_parquet(caminho: str, abas: dict):
+    gravar_auxiliares(os.path.splitext(caminho)[0], abas, ['parquet'])
+
+
+def _gravar_medido(func, n_linhas: int, caminho: str, fila):
+    abas = _abas_sinteticas(n_linhas)
+    base = pico_memoria_mb()
+    zerar_pico_memoria()
+    inicio = time.perf_counter()
+    func(caminho, abas)
+    tempo = time.perf_counter() - inicio
+    fila.put((tempo, pico_memoria_mb() - base))
+
+
+def _medir_gravacao(func, n_linhas: int, caminho: str):
+    """Gera as abas e grava em um processo novo; o pico é o acréscimo de RSS durante a gravação."""
+    ctx = multiprocessing.get_context('spawn')
+    fila = ctx.Queue()
+    processo = ctx.Process(target=_gravar_medido, args=(func, n_linhas, caminho, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def benchmark_relatorio():
+    """Gravação do relatório: to_excel (anterior) x streaming constant_memory x Parquet auxiliar."""
+    print("\n=== Relatório: to_excel x streaming (constant_memory) x Parquet ===")
+    print(f"{'linhas':>9} {'gravação':>10} {'tempo(s)':>9} {'pico RSS(MB)':>13} {'arquivo(MB)':>12}")
+    casos = [('to_excel', _relatorio_pandas, 'xlsx'), ('streaming', _relatorio_streaming, 'xlsx'),
+             ('parquet', _relatorio_parquet, 'parquet')]
+    for n_linhas in [50_000, 200_000]:
+        for nome, func, extensao in casos:
+            with tempfile.TemporaryDirectory() as pasta:
+                tempo, pico = _medir_gravacao(func, n_linhas, os.path.join(pasta, f"relatorio.{extensao}"))
+                tamanho = sum(os.path.getsize(c) for c in glob.glob(os.path.join(pasta, '*'))) / 2**20
+            print(f"{n_linhas:>9} {nome:>10} {tempo:>9.3f} {pico:>13.1f} {tamanho:>12.1f}")
+
+
+BENCHMARKS = {
+    'atribuicao': benchmark_atribuicao,
+    'agrupamento': benchmark_agrupamento,
+    'recuperacao': benchmark_recuperacao,
+    'lote_ia': benchmark_lote_ia,
+    'agente': benchmark_agente,
+    'carregamento': benchmark_carregamento,
+    'cabecalho': benchmark_cabecalho,
+    'saneamento': benchmark_saneamento,
+    'memoria': benchmark_memoria,
+    'centavos': benchmark_centavos,
+    'match_exato': benchmark_match_exato,
+    'particionado': benchmark_particionado,
+    'etapas': benchmark_etapas,
+    'relatorio': benchmark_relatorio,
+}
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.WARNING)
+    escolhidos = sys.argv[1:] or list(BENCHMARKS)
+    for nome in escolhidos:
+        BENCHMARKS[nome]()
@@ -0,0 +1,120 @@
+import sqlite3
+import json
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+LOTE_LRU = 500  # A poda LRU roda a cada N inserções, não em toda escrita
+TIMEOUT_SQLITE_SEGUNDOS = 30  # Espera pelo lock de escrita (várias contas/jobs gravam no mesmo cache)
+
+
+class CacheDecisoesIA:
+    """
+    Cache persistente (SQLite) das decisões do Agente IA.
+
+    Como o modelo roda com temperature=0 e seed fixa, a mesma dupla de
+    descrições sempre gera a mesma resposta. A chave combina o par
+    sanitizado, o modelo e a versão do prompt: trocar qualquer um deles
+    invalida naturalmente as entradas antigas.
+
+    Eviction:
+        - TTL: entradas mais velhas que `ttl_dias` são descartadas na leitura.
+        - LRU: acima de `max_entradas`, remove as menos acessadas recentemente
+          (verificado a cada LOTE_LRU inserções).
+    """
+
+    def __init__(self, caminho: str, ttl_dias: int = 90, max_entradas: int = 50_000):
+        self.caminho = caminho
+        self.ttl_segundos = ttl_dias * 86_400
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self._insercoes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        # WAL: leitores não bloqueiam o escritor; processos concorrentes esperam o lock em vez de falhar na hora
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, timeout=TIMEOUT_SQLITE_SEGUNDOS)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS decisoes (
+                chave TEXT PRIMARY KEY,
+                resposta TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acesso ON decisoes (ultimo_acesso)")
+        self._conn.commit()
+        self.expirar()
+
+    @staticmethod
+    def gerar_chave(texto_a: str, texto_b: str, modelo: str, versao_prompt: str) -> str:
+        bruto = json.dumps([modelo, versao_prompt, texto_a, texto_b], ensure_ascii=False)
+        return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resposta, criado_em FROM decisoes WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None or agora - linha[1] > self.ttl_segundos:
+                if linha is not None:
+                    self._conn.execute("DELETE FROM decisoes WHERE chave = ?", (chave,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE decisoes SET ultimo_acesso = ? WHERE chave = ?", (agora, chave))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(linha[0])
+
+    def salvar(self, chave: str, resposta: Dict[str, Any]):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO decisoes (chave, resposta, criado_em, ultimo_acesso) VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(resposta, ensure_ascii=False), agora, agora)
+            )
+            self._conn.commit()
+            self._insercoes += 1
+            if self._insercoes >= LOTE_LRU:
+                self._aplicar_lru()
+
+    def _aplicar_lru(self):
+        """Mantém apenas as `max_entradas` acessadas mais recentemente (chamar com o lock)."""
+        removidas = self._conn.execute("""
+            DELETE FROM decisoes WHERE chave IN (
+                SELECT chave FROM decisoes ORDER BY ultimo_acesso DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entradas,)).rowcount
+        self._conn.commit()
+        self._insercoes = 0
+        if removidas:
+            logger.info(f"Cache IA: {removidas} decisões removidas por LRU.")
+
+    def expirar(self):
+        """Remove entradas vencidas pelo TTL e aplica o limite de tamanho."""
+        with self._lock:
+            removidas = self._conn.execute(
+                "DELETE FROM decisoes WHERE criado_em < ?", (time.time() - self.ttl_segundos,)
+            ).rowcount
+            self._conn.commit()
+            self._aplicar_lru()
+        if removidas:
+            logger.info(f"Cache IA: {removidas} decisões expiradas removidas.")
+
+    def estatisticas(self) -> Dict[str, int]:
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM decisoes").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entradas': total}
+
+    def zerar_contadores(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,459 @@
+import io
+import os
+import re
+import csv
+import hashlib
+import logging
+import threading
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+from utils import normalizar_coluna, para_centavos
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURAÇÃO ---
+TAMANHO_BLOCO_PADRAO = 50_000
+# Desempate quando há mais de um formato do mesmo arquivo com a mesma data de modificação
+EXTENSOES_SUPORTADAS = ['.parquet', '.csv', '.ofx', '.xlsx']
+
+SCHEMAS_INTERMEDIARIOS = {
+    'Protheus': pa.schema([
+        ('Data', pa.timestamp('ns')),
+        ('Historico', pa.string()),
+        ('Natureza', pa.string()),
+        ('Valor_Centavos', pa.int64()),
+        ('Ref. Auditoria', pa.int64()),
+    ]),
+    'Banco': pa.schema([
+        ('Data', pa.timestamp('ns')),
+        ('Descricao', pa.string()),
+        ('Valor_Centavos', pa.int64()),
+        ('Ref. Auditoria', pa.int64()),
+    ]),
+}
+COLUNAS_TEXTO = {'Protheus': ['Historico', 'Natureza'], 'Banco': ['Descricao']}
+SUFIXO_REF = {'Protheus': "_PROTHEUS", 'Banco': "_BANCO"}  # A origem da Ref. Auditoria (o id é a linha do arquivo)
+MAX_CABECALHOS_CACHE = 32  # Cabeçalhos de .xlsx guardados por hash do conteúdo (validação de upload/schema)
+# Formatos de data em texto (CSV), em ordem de preferência: o dia vem antes do mês
+FORMATOS_DATA = ['%d/%m/%Y', '%Y-%m-%d', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%d-%m-%Y', '%d.%m.%Y']
+
+
+def localizar_arquivo(pasta: str, nome_base: str) -> Optional[str]:
+    """
+    Procura `nome_base` com qualquer extensão suportada (ex.: extrato_banco.csv).
+    Se houver mais de um formato, usa o modificado por último (um .parquet
+    velho não ganha de um .xlsx novo) e avisa no log.
+    """
+    encontrados = [os.path.join(pasta, nome_base + ext) for ext in EXTENSOES_SUPORTADAS]
+    encontrados = [c for c in encontrados if os.path.exists(c)]
+    if len(encontrados) <= 1:
+        return encontrados[0] if encontrados else None
+    # max() mantém o primeiro entre datas iguais: desempate pela ordem de EXTENSOES_SUPORTADAS
+    escolhido = max(encontrados, key=os.path.getmtime)
+    logger.warning(f"'{nome_base}' existe em {len(encontrados)} formatos ({', '.join(map(os.path.basename, encontrados))}): "
+                   f"usando o mais recente, '{os.path.basename(escolhido)}'.")
+    return escolhido
+
+
+def _normalizar_colunas(colunas) -> list:
+    return [normalizar_coluna(c if c is not None else f"Unnamed: {i}", True) for i, c in enumerate(colunas)]
+
+
+# --- LEITORES (geram blocos com colunas normalizadas e índice global contínuo) ---
+
+def ler_excel_em_blocos(caminho: str, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    """Lê a primeira planilha em modo streaming (openpyxl read_only), sem carregar o arquivo todo."""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = _normalizar_colunas(cabecalho)
+        largura = len(colunas)
+
+        bloco, inicio, vazias_pendentes = [], 0, 0
+        for linha in linhas:
+            linha = tuple(linha[:largura]) + (None,) * (largura - len(linha))
+            # Linhas vazias no fim da planilha são ignoradas (como no pd.read_excel)
+            if all(v is None for v in linha):
+                vazias_pendentes += 1
+                continue
+            bloco.extend([(None,) * largura] * vazias_pendentes)
+            vazias_pendentes = 0
+            bloco.append(linha)
+            if len(bloco) >= tamanho_bloco:
+                yield pd.DataFrame(bloco, columns=colunas, index=pd.RangeIndex(inicio, inicio + len(bloco)))
+                inicio += len(bloco)
+                bloco = []
+        if bloco or inicio == 0:
+            yield pd.DataFrame(bloco, columns=colunas, index=pd.RangeIndex(inicio, inicio + len(bloco)))
+    finally:
+        wb.close()
+
+
+# --- CABEÇALHO DE .XLSX SEM ABRIR A PASTA DE TRABALHO ---
+
+_RE_REF_CELULA = re.compile(r'([A-Z]+)(\d+)')
+_TIPO_SHARED_STRINGS = '/sharedStrings'
+
+
+def _local(tag: str) -> str:
+    # Nome do elemento sem namespace (o .xlsx "strict" usa outro namespace para as mesmas tags)
+    return tag.rsplit('}', 1)[-1]
+
+
+def _coluna_celula(ref: str) -> int:
+    letras = _RE_REF_CELULA.match(ref).group(1)
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - ord('A') + 1
+    return indice - 1
+
+
+def _alvos_pasta(zf: zipfile.ZipFile) -> Tuple[str, Optional[str]]:
+    """Caminhos (no zip) da primeira planilha e das shared strings, pelo workbook.xml e seus rels."""
+    rels = {}
+    if 'xl/_rels/workbook.xml.rels' in zf.namelist():
+        for rel in ET.fromstring(zf.read('xl/_rels/workbook.xml.rels')):
+            alvo = rel.get('Target', '')
+            alvo = alvo.lstrip('/') if alvo.startswith('/') else posixpath.normpath(posixpath.join('xl', alvo))
+            rels[rel.get('Id')] = (rel.get('Type', ''), alvo)
+
+    planilha = None
+    for elem in ET.fromstring(zf.read('xl/workbook.xml')).iter():
+        if _local(elem.tag) == 'sheet':
+            id_rel = next((v for k, v in elem.attrib.items() if _local(k) == 'id'), None)
+            planilha = rels.get(id_rel, (None, None))[1]
+            break
+    compartilhadas = next((alvo for tipo, alvo in rels.values() if tipo.endswith(_TIPO_SHARED_STRINGS)), None)
+    if compartilhadas is None and 'xl/sharedStrings.xml' in zf.namelist():
+        compartilhadas = 'xl/sharedStrings.xml'
+    return planilha or 'xl/worksheets/sheet1.xml', compartilhadas
+
+
+def _shared_strings(zf: zipfile.ZipFile, caminho: str, indices: set) -> Dict[int, str]:
+    """Só as shared strings pedidas: o XML é lido em streaming até o maior índice necessário."""
+    textos, ultimo = {}, max(indices)
+    with zf.open(caminho) as f:
+        posicao = 0
+        for _, elem in ET.iterparse(f, events=('end',)):
+            if _local(elem.tag) != 'si':
+                continue
+            if posicao in indices:
+                # Texto simples (<t>) ou rich text (runs <r><t>); a leitura fonética (<rPh>) fica de fora
+                textos[posicao] = ''.join(t.text or '' for filho in elem if _local(filho.tag) in ('t', 'r')
+                                          for t in filho.iter() if _local(t.tag) == 't')
+            elem.clear()
+            if posicao >= ultimo:
+                break
+            posicao += 1
+    return textos
+
+
+def _valor_celula(tipo: Optional[str], valor: Optional[str], inline: Optional[str]):
+    if tipo == 'inlineStr':
+        return inline
+    if valor is None:
+        return None
+    if tipo in ('str', 'e'):
+        return valor
+    if tipo == 'b':
+        return valor == '1'
+    numero = float(valor)
+    return int(numero) if numero.is_integer() else numero
+
+
+def ler_cabecalho_xlsx(origem: Union[str, io.BufferedIOBase]) -> Tuple:
+    """
+    Primeira linha da primeira planilha de um .xlsx, sem carregar a pasta de
+    trabalho: abre o zip, lê o XML da planilha em streaming só até o fim da
+    primeira linha e resolve apenas as shared strings que ela usa. Os valores
+    vêm na posição da coluna (None nos buracos), como o openpyxl os entrega.
+    Arquivo que não é um .xlsx legível levanta exceção (zipfile/XML/KeyError).
+    """
+    with zipfile.ZipFile(origem) as zf:
+        planilha, compartilhadas = _alvos_pasta(zf)
+        celulas = []
+        with zf.open(planilha) as f:
+            for evento, elem in ET.iterparse(f, events=('start', 'end')):
+                nome = _local(elem.tag)
+                if evento == 'start' and nome == 'row' and elem.get('r', '1') != '1':
+                    break  # A primeira linha está vazia: cabeçalho sem colunas
+                if evento != 'end':
+                    continue
+                if nome == 'c':
+                    valor = next((v.text for v in elem if _local(v.tag) == 'v'), None)
+                    inline = ''.join(t.text or '' for t in elem.iter() if _local(t.tag) == 't')
+                    celulas.append((elem.get('r'), elem.get('t'), valor, inline))
+                    elem.clear()
+                elif nome == 'row':
+                    break
+
+        indices = {int(valor) for _, tipo, valor, _ in celulas if tipo == 's' and valor is not None}
+        textos = _shared_strings(zf, compartilhadas, indices) if indices and compartilhadas else {}
+
+    cabecalho = []
+    for posicao, (ref, tipo, valor, inline) in enumerate(celulas):
+        coluna = _coluna_celula(ref) if ref else posicao
+        cabecalho.extend([None] * (coluna - len(cabecalho)))
+        cabecalho.append(textos.get(int(valor)) if tipo == 's' and valor is not None else _valor_celula(tipo, valor, inline))
+    while cabecalho and cabecalho[-1] is None:
+        cabecalho.pop()
+    return tuple(cabecalho)
+
+
+_cabecalhos: 'OrderedDict[str, Tuple]' = OrderedDict()
+_lock_cabecalhos = threading.Lock()
+
+
+def cabecalho_xlsx(conteudo: Union[bytes, str]) -> Tuple:
+    """
+    Cabeçalho do .xlsx (conteúdo em bytes ou caminho), com cache LRU por hash
+    do conteúdo: a validação do upload no app e a do schema no pipeline leem
+    o mesmo arquivo uma vez só por processo.
+    """
+    if isinstance(conteudo, str):
+        hash_conteudo = hashlib.sha256()
+        with open(conteudo, 'rb') as f:
+            for pedaco in iter(lambda: f.read(1 << 20), b''):
+                hash_conteudo.update(pedaco)
+        chave = hash_conteudo.hexdigest()
+    else:
+        chave = hashlib.sha256(conteudo).hexdigest()
+    with _lock_cabecalhos:
+        if chave in _cabecalhos:
+            _cabecalhos.move_to_end(chave)
+            return _cabecalhos[chave]
+    cabecalho = ler_cabecalho_xlsx(conteudo if isinstance(conteudo, str) else io.BytesIO(conteudo))
+    with _lock_cabecalhos:
+        _cabecalhos[chave] = cabecalho
+        while len(_cabecalhos) > MAX_CABECALHOS_CACHE:
+            _cabecalhos.popitem(last=False)
+    return cabecalho
+
+
+def colunas_cabecalho(caminho: str) -> Optional[list]:
+    """Colunas normalizadas do arquivo, como os leitores em blocos as entregam (só .xlsx; None nos demais)."""
+    if os.path.splitext(caminho)[1].lower() != '.xlsx':
+        return None
+    return _normalizar_colunas(cabecalho_xlsx(caminho))
+
+
+def detectar_formato_data(datas: pd.Series) -> Optional[str]:
+    """
+    O formato de FORMATOS_DATA que converte mais datas da amostra (no empate,
+    o primeiro da lista), ou None se nenhum converte nenhuma.
+    """
+    datas = datas.dropna().astype(str)
+    melhor, convertidas = None, 0
+    for formato in FORMATOS_DATA:
+        qtd = int(pd.to_datetime(datas, format=formato, errors='coerce').notna().sum())
+        if qtd > convertidas:
+            melhor, convertidas = formato, qtd
+    return melhor
+
+
+def converter_datas(datas: pd.Series, formato: Optional[str] = None) -> pd.Series:
+    """Datas em texto com formato explícito (sem formato: dia antes do mês); inválidas viram NaT."""
+    if pd.api.types.is_datetime64_any_dtype(datas):
+        return datas
+    if formato is None:
+        return pd.to_datetime(datas, dayfirst=True, errors='coerce')
+    return pd.to_datetime(datas, format=formato, errors='coerce')
+
+
+def ler_csv_em_blocos(caminho: str, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    """
+    CSV em blocos; detecta o separador e assume vírgula decimal (e ponto de
+    milhar) quando o separador é ';'. O formato das datas é detectado no
+    primeiro bloco e vale para o arquivo todo: a mesma data em texto não muda
+    de dia/mês conforme o bloco em que cai.
+    """
+    with open(caminho, 'r', encoding='utf-8-sig', errors='replace') as f:
+        amostra = f.read(4096)
+    try:
+        separador = csv.Sniffer().sniff(amostra, delimiters=',;\t|').delimiter
+    except csv.Error:
+        separador = ','
+    decimal, milhar = (',', '.') if separador == ';' else ('.', None)
+
+    formato, detectado = None, False
+    for bloco in pd.read_csv(caminho, sep=separador, decimal=decimal, thousands=milhar, chunksize=tamanho_bloco,
+                             encoding='utf-8-sig'):
+        bloco.columns = _normalizar_colunas(bloco.columns)
+        if 'Data' in bloco.columns:
+            if not detectado:
+                formato, detectado = detectar_formato_data(bloco['Data']), True
+            bloco['Data'] = converter_datas(bloco['Data'], formato)
+        yield bloco
+
+
+def ler_parquet_em_blocos(caminho: str, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    arquivo = pq.ParquetFile(caminho)
+    colunas = _normalizar_colunas(arquivo.schema_arrow.names)
+    inicio = 0
+    for lote in arquivo.iter_batches(batch_size=tamanho_bloco):
+        bloco = lote.to_pandas()
+        bloco.columns = colunas
+        bloco.index = pd.RangeIndex(inicio, inicio + len(bloco))
+        inicio += len(bloco)
+        yield bloco
+    if inicio == 0:
+        yield pd.DataFrame(columns=colunas)
+
+
+_RE_TRANSACAO = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.IGNORECASE | re.DOTALL)
+_RE_CAMPO = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def _bloco_ofx(linhas: list, inicio: int) -> pd.DataFrame:
+    df = pd.DataFrame(linhas, columns=['Data', 'Descricao', 'Valor'], index=pd.RangeIndex(inicio, inicio + len(linhas)))
+    df['Data'] = pd.to_datetime(df['Data'], format='%Y%m%d', errors='coerce')
+    df['Valor'] = pd.to_numeric(df['Valor'].str.replace(',', '.', regex=False), errors='coerce')
+    return df
+
+
+def ler_ofx_em_blocos(caminho: str, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    """
+    Extrato OFX (SGML ou XML): cada <STMTTRN> vira uma linha Data/Descricao/Valor.
+    O arquivo é lido em pedaços, então o tamanho do extrato não afeta a memória.
+    """
+    with open(caminho, 'rb') as f:
+        cabecalho = f.read(1024).decode('ascii', errors='ignore').upper()
+    encoding = 'utf-8' if 'UTF-8' in cabecalho else 'cp1252'
+
+    bloco, inicio, resto = [], 0, ''
+    with open(caminho, 'r', encoding=encoding, errors='replace') as f:
+        while True:
+            pedaco = f.read(1 << 20)
+            texto = resto + pedaco
+            ultimo_fim = 0
+            for m in _RE_TRANSACAO.finditer(texto):
+                campos = {k.upper(): v.strip() for k, v in _RE_CAMPO.findall(m.group(1))}
+                bloco.append((campos.get('DTPOSTED', '')[:8], campos.get('MEMO') or campos.get('NAME'), campos.get('TRNAMT', '')))
+                ultimo_fim = m.end()
+                if len(bloco) >= tamanho_bloco:
+                    yield _bloco_ofx(bloco, inicio)
+                    inicio += len(bloco)
+                    bloco = []
+            resto = texto[ultimo_fim:]
+            if not pedaco:
+                break
+    if bloco or inicio == 0:
+        yield _bloco_ofx(bloco, inicio)
+
+
+LEITORES: Dict[str, Callable[[str, int], Iterator[pd.DataFrame]]] = {
+    '.xlsx': ler_excel_em_blocos,
+    '.csv': ler_csv_em_blocos,
+    '.parquet': ler_parquet_em_blocos,
+    '.ofx': ler_ofx_em_blocos,
+}
+
+
+def ler_em_blocos(caminho: str, tamanho_bloco: int = TAMANHO_BLOCO_PADRAO) -> Iterator[pd.DataFrame]:
+    ext = os.path.splitext(caminho)[1].lower()
+    if ext not in LEITORES:
+        raise ValueError(f"Formato não suportado: '{ext}'. Suportados: {list(LEITORES)}")
+    return LEITORES[ext](caminho, tamanho_bloco)
+
+
+# --- SANEAMENTO POR BLOCO ---
+
+def sanear_bloco(df: pd.DataFrame, origem: str) -> tuple:
+    """
+    Aplica ao bloco as mesmas regras do carregamento em memória: remove nulos,
+    calcula o valor com sinal (Natureza no Protheus) em centavos inteiros,
+    converte datas e usa o índice global (número da linha) como Ref. Auditoria.
+    Valores não numéricos contam como nulos. Retorna (bloco, nulos_removidos,
+    datas_invalidas): linhas sem data ou com data que não converte também saem.
+    """
+    cols_check = ['Valor', 'Historico'] if origem == 'Protheus' else ['Valor', 'Descricao']
+    df = df.copy()
+    df['Valor'] = pd.to_numeric(df['Valor'], errors='coerce')
+    df.loc[~np.isfinite(df['Valor'].astype(np.float64)), 'Valor'] = np.nan
+    nulos = int(df[cols_check].isnull().any(axis=1).sum())
+    df = df.dropna(subset=cols_check)
+
+    for col in COLUNAS_TEXTO[origem]:
+        df[col] = df[col].astype(str)
+
+    valores = df['Valor'].values.astype(np.float64)
+    if origem == 'Protheus':
+        valores = np.where(df['Natureza'].values == 'D', -valores, valores)
+    df['Valor_Centavos'] = para_centavos(valores)
+
+    df['Data'] = converter_datas(df['Data'])
+    datas_invalidas = int(df['Data'].isna().sum())
+    df = df.dropna(subset=['Data'])
+
+    df['Ref. Auditoria'] = df.index.values.astype(np.int64)
+    return df[SCHEMAS_INTERMEDIARIOS[origem].names], nulos, datas_invalidas
+
+
+def ler_intermediario(caminho: str, origem: str) -> pd.DataFrame:
+    """
+    Carrega o Parquet intermediário na representação compacta de trabalho:
+    textos como categorias (cada descrição distinta fica uma vez na memória,
+    e as linhas guardam só o código), Valor_Centavos int64 e a Ref. Auditoria
+    como o número da linha (int64), com a origem implícita no extrato. O texto
+    da ref só é montado na saída (formatar_refs).
+    """
+    return pq.read_table(caminho, read_dictionary=COLUNAS_TEXTO[origem]).to_pandas()
+
+
+def formatar_refs(refs, origem: str) -> np.ndarray:
+    """
+    Texto da Ref. Auditoria ('<linha>_PROTHEUS' / '<linha>_BANCO') a partir dos
+    ids inteiros. Refs que já são texto (estáveis, do livro incremental) passam direto.
+    """
+    refs = np.asarray(refs)
+    if refs.dtype.kind not in 'iu':
+        return refs
+    return np.char.add(refs.astype(str), SUFIXO_REF[origem]).astype(object)
+
+
+def gerar_intermediario(caminho: str, origem: str, destino: str, validar: Callable[[pd.DataFrame], bool],
+                        tamanho_bloco: int = TAMANHO_BLOCO_PADRAO) -> Optional[Dict[str, int]]:
+    """
+    Converte o arquivo de entrada em um Parquet tipado, bloco a bloco.
+    A memória de pico depende de `tamanho_bloco`, não do tamanho do arquivo.
+    Retorna estatísticas da leitura, ou None se o schema for inválido.
+    """
+    schema = SCHEMAS_INTERMEDIARIOS[origem]
+    os.makedirs(os.path.dirname(destino) or '.', exist_ok=True)
+    stats = {'linhas_lidas': 0, 'linhas_validas': 0, 'nulos_removidos': 0, 'datas_invalidas': 0, 'blocos': 0}
+
+    writer = None
+    try:
+        for bloco in ler_em_blocos(caminho, tamanho_bloco):
+            if stats['blocos'] == 0 and not validar(bloco):
+                return None
+            stats['blocos'] += 1
+            stats['linhas_lidas'] += len(bloco)
+            saneado, nulos, datas_invalidas = sanear_bloco(bloco, origem)
+            stats['nulos_removidos'] += nulos
+            stats['datas_invalidas'] += datas_invalidas
+            stats['linhas_validas'] += len(saneado)
+
+            if writer is None:
+                writer = pq.ParquetWriter(destino, schema)
+            writer.write_table(pa.Table.from_pandas(saneado, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        pq.write_table(schema.empty_table(), destino)
+    return stats
@@ -1,52 +1,100 @@
 import pandas as pd
+import numpy as np
 import time
 import logging
+import argparse
 import os
-from typing import Tuple, Optional
+from typing import Callable, Dict, List, Tuple, Optional
 from datetime import datetime
 
 # --- IMPORTAÇÃO DO AGENTE BLINDADO ---
-from agente_seguro_v2 import consultar_agente_blindado
-
-# --- IMPORTAÇÃO APP
-from utils import normalizar_coluna
+from agente_seguro_v2 import obter_cache, obter_cliente
+
+# --- MOTOR DE MATCHING VETORIZADO ---
+from motor_matching import match_exato, match_tolerancia, COLUNAS_MATCH
+from motor_paralelo import conciliar_particionado
+from motor_agrupamento import match_agrupado, MOTIVO_REVISAO_AGRUPAMENTO
+from etapa_ia import adjudicar_pares_ia, MOTIVO_REVISAO_HUMANA
+from regras_aprendidas import DicionarioRegras, CAMINHO_REGRAS
+from recuperacao import selecionar_candidatos, CacheEmbeddings, BACKEND_OLLAMA
+
+# --- CARREGADORES (Excel/CSV/Parquet/OFX em blocos)
+from carregadores import localizar_arquivo, gerar_intermediario, ler_intermediario, formatar_refs, colunas_cabecalho
+from livro_conciliacao import LivroConciliacao
+from relatorio import escrever_excel, gravar_auxiliares, caminhos_auxiliares
+from metricas import MetricasExecucao, caminho_metricas, percentis_ms
 
 # --- CONFIGURAÇÃO ---
 PASTA_INPUT = 'data/input'
 PASTA_OUTPUT = 'data/output'
 PASTA_LOGS = 'logs'
+PASTA_INTERMEDIARIA = 'data/intermediario'
 
 # Garante estrutura
 os.makedirs(PASTA_INPUT, exist_ok=True)
 os.makedirs(PASTA_OUTPUT, exist_ok=True)
 os.makedirs(PASTA_LOGS, exist_ok=True)
+os.makedirs(PASTA_INTERMEDIARIA, exist_ok=True)
 
 # Regras de Negócio
 TOLERANCIA_DIAS = 3
+JANELA_IA_DIAS = 5  # Entre TOLERANCIA_DIAS e este limite, a decisão vai para a IA
+MODO_ATRIBUICAO = 'guloso'  # 'guloso' (primeiro match) ou 'otimo' (atribuição de custo mínimo por valor)
+WORKERS_MATCHING = 1  # > 1: match exato + tolerância fatiados por valor em processos paralelos
+MAX_ITENS_AGRUPAMENTO = 4  # Pagamentos divididos/agregados: até N lançamentos somando um do outro lado (< 2 desliga)
+JANELA_AGRUPAMENTO_DIAS = 3
+ORCAMENTO_JANELA_AGRUPAMENTO_S = 0.05  # Tempo máximo de busca por janela (lançamento alvo)
 CONFIANCA_MINIMA = ['alta'] 
+MAX_CONCORRENCIA_IA = 4  # Chamadas simultâneas ao Ollama na ETAPA 3
+TAMANHO_LOTE_IA = 1      # Pares por prompt na ETAPA 3 (1 = um par por chamada)
+USAR_FILTRO_LEXICO = True
+LIMIAR_ACEITE_LEXICO = 0.85    # Similaridade >= limiar: conciliado sem IA
+LIMIAR_REJEICAO_LEXICO = 0.05  # Similaridade < limiar: descrições sem nada em comum, não vai à IA
+USAR_REGRAS_APRENDIDAS = True  # Padrões aprovados repetidamente pela IA viram regras locais (ver regras_aprendidas.py)
+USAR_RECUPERACAO_EMBEDDINGS = False  # Só as TOP_K descrições mais próximas de cada lançamento vão à IA (ver recuperacao.py)
+TOP_K_RECUPERACAO = 3
+BACKEND_RECUPERACAO = 'hashing'  # 'hashing' (local, offline) ou 'ollama' (/api/embed, com cache em disco)
 COLUNAS_PROTHEUS = ['Data', 'Historico', 'Valor', 'Natureza']
 COLUNAS_BANCO = ['Data', 'Descricao', 'Valor']
 LIMITE_VALOR_MAXIMO = 1_000_000_000.00 
+LIMITE_CENTAVOS_MAXIMO = int(round(LIMITE_VALOR_MAXIMO * 100))  # Valores circulam em centavos (int64) no pipeline
+TAMANHO_BLOCO_LEITURA = 50_000  # Linhas por bloco na ingestão (limita a memória de pico)
+FORMATOS_AUXILIARES = []  # 'parquet' e/ou 'csv': cópias das abas ao lado do Excel, para sistemas downstream
+LARGURAS_RELATORIO = {'Justificativa_Auditoria': 50, 'Motivo da Pendência': 60}  # Colunas de texto longo (com quebra)
+
+# Conciliação incremental: só linhas novas + itens em aberto de execuções anteriores
+MODO_INCREMENTAL = False
+CAMINHO_LIVRO = 'data/livro_conciliacao.sqlite'
+
+MOTIVO_VALOR_ENCONTRADO = "Valor encontrado no outro extrato, mas datas ou descrições não bateram (IA Rejeitou ou Fora da Tolerância)."
+MOTIVO_VALOR_UNICO = "Valor Único: Não foi encontrado nenhum lançamento com este valor no outro extrato."
 
 # --- FUNÇÃO DE LOG (CORREÇÃO DO BUG 0KB) ---
-def configurar_logger_dinamico():
+def configurar_logger_dinamico(pasta_logs: str = PASTA_LOGS, conta: Optional[str] = None):
     """
     Cria um arquivo de log EXCLUSIVO para esta execução, 
-    usando timestamp no nome para garantir histórico único.
+    usando timestamp (e a conta, em lotes) no nome para garantir histórico único.
+
+    Só remove os handlers instalados por execuções anteriores: handlers de quem
+    embute o pipeline (Streamlit, testes) continuam intactos. Execuções em
+    paralelo rodam em processos separados (ver executor_lotes.py).
     """
     logger = logging.getLogger()
     
-    # 1. Limpa handlers antigos (limpeza da memória)
+    # 1. Limpa handlers de execuções anteriores (limpeza da memória)
     for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
+        if getattr(handler, 'conciliador', False):
+            logger.removeHandler(handler)
+            handler.close()
     
     logger.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-    # 2. Gera nome único: "log_execucao_2025-01-07_15-30-00.txt"
+    # 2. Gera nome único: "log_execucao_2025-01-07_15-30-00.txt" (ou "log_execucao_<conta>_...")
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    nome_arquivo = f"log_execucao_{timestamp}.txt"
-    caminho_log = os.path.join(PASTA_LOGS, nome_arquivo)
+    nome_arquivo = f"log_execucao_{conta}_{timestamp}.txt" if conta else f"log_execucao_{timestamp}.txt"
+    os.makedirs(pasta_logs, exist_ok=True)
+    caminho_log = os.path.join(pasta_logs, nome_arquivo)
 
     # 3. Configura o FileHandler para este arquivo novo
     file_handler = logging.FileHandler(caminho_log, mode='w', encoding='utf-8') 
@@ -56,6 +104,8 @@ def configurar_logger_dinamico():
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
 
+    file_handler.conciliador = True
+    stream_handler.conciliador = True
     logger.addHandler(file_handler)
     logger.addHandler(stream_handler)
     
@@ -74,219 +124,420 @@ def validar_schema(df: pd.DataFrame, colunas_esperadas: list, nome_arq: str) ->
 
 def validar_regras_negocio(df: pd.DataFrame, origem: str) -> pd.DataFrame:
     # 1. Validação de Intervalo
-    outliers = df[(df['Valor_Real'] == 0) | (df['Valor_Real'].abs() > LIMITE_VALOR_MAXIMO)]
-    if not outliers.empty:
-        logger.warning(f"[{origem}] {len(outliers)} linhas removidas por valores suspeitos.")
-        df = df.drop(outliers.index)
+    centavos = df['Valor_Centavos'].values
+    outliers = (centavos == 0) | (np.abs(centavos) > LIMITE_CENTAVOS_MAXIMO)
+    if outliers.any():
+        logger.warning(f"[{origem}] {int(outliers.sum())} linhas removidas por valores suspeitos.")
+        df = df[~outliers]
 
     # 2. Detecção de Duplicatas
-    cols_dup = ['Data', 'Valor_Real', 'Historico'] if origem == 'Protheus' else ['Data', 'Valor_Real', 'Descricao']
+    cols_dup = ['Data', 'Valor_Centavos', 'Historico'] if origem == 'Protheus' else ['Data', 'Valor_Centavos', 'Descricao']
     duplicatas = df[df.duplicated(subset=cols_dup, keep=False)]
     if not duplicatas.empty:
         logger.warning(f"[{origem}] ATENÇÃO: {len(duplicatas)} lançamentos duplicados detectados!")
 
     return df
 
-def carregar_e_saneamento() -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+def justificar_pendencias(df: pd.DataFrame, df_comparacao: pd.DataFrame, revisao: np.ndarray,
+                          revisao_agrupamento: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Motivo da pendência de cada linha, de uma vez: o valor (em centavos) existe
+    no outro extrato? (np.isin ordena os dois lados uma vez, em vez de varrer o
+    outro extrato a cada linha). Pares sem decisão da IA e grupos de janelas
+    densas demais (ver match_agrupado) vão para Revisão Humana.
+    """
+    encontrado = np.isin(df['Valor_Centavos'].values, df_comparacao['Valor_Centavos'].values)
+    motivos = np.where(encontrado, MOTIVO_VALOR_ENCONTRADO, MOTIVO_VALOR_UNICO)
+    if revisao_agrupamento is not None:
+        motivos = np.where(revisao_agrupamento, MOTIVO_REVISAO_AGRUPAMENTO, motivos)
+    return np.where(revisao, MOTIVO_REVISAO_HUMANA, motivos)
+
+def _com_refs_texto(df: pd.DataFrame, origem: str) -> pd.DataFrame:
+    if 'Ref. Auditoria' not in df.columns or df['Ref. Auditoria'].dtype.kind not in 'iu':
+        return df
+    return df.assign(**{'Ref. Auditoria': formatar_refs(df['Ref. Auditoria'].values, origem)})
+
+def montar_abas(conciliados: pd.DataFrame, df_novos: pd.DataFrame,
+                sobra_p_final: pd.DataFrame, sobra_b_final: pd.DataFrame) -> Dict[str, List[pd.DataFrame]]:
+    """
+    As três abas do relatório final como listas de partes (em centavos), na
+    ordem de gravação: 'Conciliados' são os exatos seguidos dos novos, sem
+    pd.concat. A conversão para reais acontece bloco a bloco na gravação; a
+    Ref. Auditoria das pendências ganha aqui o texto '<linha>_<ORIGEM>'.
+    """
+    cols_conciliados = ['Data', 'Historico', 'Descricao', 'Valor_Centavos', 'Metodo', 'Justificativa_Auditoria']
+    partes_conciliados = [conciliados.reindex(columns=cols_conciliados)]
+    if not df_novos.empty:
+        partes_conciliados.append(df_novos)
+    return {
+        'Conciliados': partes_conciliados,
+        'Pendencia Protheus': [_com_refs_texto(sobra_p_final, 'Protheus')],
+        'Pendencia Banco': [_com_refs_texto(sobra_b_final, 'Banco')],
+    }
+
+def escrever_abas(caminho_saida: str, abas: Dict[str, List[pd.DataFrame]]) -> Dict[str, int]:
+    """Grava as abas montadas por montar_abas no Excel final (streaming; ver relatorio.py)."""
+    return escrever_excel(caminho_saida, abas, LARGURAS_RELATORIO)
+
+def gravar_relatorio(caminho_saida: str, conciliados: pd.DataFrame, df_novos: pd.DataFrame,
+                     sobra_p_final: pd.DataFrame, sobra_b_final: pd.DataFrame):
+    """Grava o Excel final (Conciliados + pendências), convertendo centavos para reais."""
+    escrever_abas(caminho_saida, montar_abas(conciliados, df_novos, sobra_p_final, sobra_b_final))
+
+class ResultadoConciliacao:
+    """
+    Resultado de pipeline_enterprise: `resumo` (contagens e caminhos, o mesmo
+    dicionário do resumo de lotes) e `metricas` (MetricasExecucao da execução).
+    As abas ficam no Excel e nas saídas auxiliares (a tela lê o Parquet).
+    """
+
+    def __init__(self, resumo: dict, metricas: MetricasExecucao):
+        self.resumo = resumo
+        self.metricas = metricas
+
+def carregar_arquivo(caminho: str, origem: str, colunas_esperadas: list,
+                     pasta_intermediaria: str = PASTA_INTERMEDIARIA) -> Optional[pd.DataFrame]:
+    """Lê o arquivo em blocos para um Parquet intermediário tipado e carrega o resultado (representação compacta)."""
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    destino = os.path.join(pasta_intermediaria, f"{nome}.parquet")
+    # .xlsx: schema conferido pelo cabeçalho (mesmo leitor e cache da validação do app), antes de abrir a planilha
+    colunas = colunas_cabecalho(caminho)
+    if colunas is not None and not validar_schema(pd.DataFrame(columns=colunas), colunas_esperadas, origem):
+        return None
+    stats = gerar_intermediario(
+        caminho, origem, destino,
+        validar=lambda bloco: validar_schema(bloco, colunas_esperadas, origem),
+        tamanho_bloco=TAMANHO_BLOCO_LEITURA,
+    )
+    if stats is None:
+        return None
+    if stats['nulos_removidos']:
+        logger.warning(f"[{origem}] {stats['nulos_removidos']} linhas com Valor ou Histórico NULOS foram removidas.")
+    if stats['datas_invalidas']:
+        logger.warning(f"[{origem}] {stats['datas_invalidas']} linhas com Data vazia ou inválida foram removidas.")
+    logger.info(f"[{origem}] {stats['linhas_lidas']} linhas lidas de '{caminho}' em {stats['blocos']} blocos.")
+    return ler_intermediario(destino, origem)
+
+def carregar_e_saneamento(caminho_p: Optional[str] = None, caminho_b: Optional[str] = None,
+                          pasta_intermediaria: str = PASTA_INTERMEDIARIA) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
     logger.info("📂 Iniciando carregamento e validação de arquivos...") # Agora usa o logger configurado
     try:
-        caminho_p = os.path.join(PASTA_INPUT, 'sistema_protheus.xlsx')
-        caminho_b = os.path.join(PASTA_INPUT, 'extrato_banco.xlsx')
+        # Sem caminhos explícitos (execução única), procura os nomes padrão em PASTA_INPUT
+        caminho_p = caminho_p or localizar_arquivo(PASTA_INPUT, 'sistema_protheus')
+        caminho_b = caminho_b or localizar_arquivo(PASTA_INPUT, 'extrato_banco')
 
-        if not os.path.exists(caminho_p) or not os.path.exists(caminho_b):
+        if caminho_p is None or caminho_b is None or not os.path.exists(caminho_p) or not os.path.exists(caminho_b):
             raise FileNotFoundError
 
-        df_p = pd.read_excel(caminho_p)
-        df_b = pd.read_excel(caminho_b)
-        # --- APLICA NA ESTRUTURA (Colunas) ---
-        df_p.columns = [normalizar_coluna(c, True) for c in df_p.columns]
-        df_b.columns = [normalizar_coluna(c,True) for c in df_b.columns]
-
-        if not validar_schema(df_p, COLUNAS_PROTHEUS, "Protheus") or \
-           not validar_schema(df_b, COLUNAS_BANCO, "Banco"):
+        df_p = carregar_arquivo(caminho_p, "Protheus", COLUNAS_PROTHEUS, pasta_intermediaria)
+        df_b = carregar_arquivo(caminho_b, "Banco", COLUNAS_BANCO, pasta_intermediaria)
+        if df_p is None or df_b is None:
             return None, None
 
-        cols_p_check = ['Valor', 'Historico']
-        cols_b_check = ['Valor', 'Descricao']
-        
-        if df_p[cols_p_check].isnull().any().any() or df_b[cols_b_check].isnull().any().any():
-            logger.warning("Linhas com Valor ou Histórico NULOS foram removidas.")
-            df_p.dropna(subset=cols_p_check, inplace=True)
-            df_b.dropna(subset=cols_b_check, inplace=True)
-
-        df_p['Valor_Real'] = df_p.apply(lambda x: x['Valor'] * -1 if x['Natureza'] == 'D' else x['Valor'], axis=1)
-        df_b['Valor_Real'] = df_b['Valor']
-
-        df_p['Valor_Real'] = df_p['Valor_Real'].astype(float).round(2)
-        df_b['Valor_Real'] = df_b['Valor_Real'].astype(float).round(2)
-        
-        df_p['Data'] = pd.to_datetime(df_p['Data'], errors='coerce')
-        df_b['Data'] = pd.to_datetime(df_b['Data'], errors='coerce')
-
-        df_p.dropna(subset=['Data'], inplace=True)
-        df_b.dropna(subset=['Data'], inplace=True)
-        # Ref Auditoria
-        df_p['Ref. Auditoria'] = df_p.index.astype(str) + "_PROTHEUS"
-        df_b['Ref. Auditoria'] = df_b.index.astype(str) + "_BANCO"
-
         df_p = validar_regras_negocio(df_p, "Protheus")
         df_b = validar_regras_negocio(df_b, "Banco")
 
         return df_p, df_b
 
     except FileNotFoundError:
-        logger.error(f"Arquivos não encontrados em '{PASTA_INPUT}'.")
+        logger.error(f"Arquivos não encontrados: {caminho_p or PASTA_INPUT}, {caminho_b or PASTA_INPUT}.")
         return None, None
     except Exception as e:
         logger.error(f"ERRO DESCONHECIDO NO CARREGAMENTO: {e}")
         return None, None
 
-def pipeline_enterprise():
+def pipeline_enterprise(incremental: Optional[bool] = None, workers: Optional[int] = None,
+                        caminho_protheus: Optional[str] = None, caminho_banco: Optional[str] = None,
+                        pasta_saida: str = PASTA_OUTPUT, pasta_logs: str = PASTA_LOGS,
+                        caminho_livro: str = CAMINHO_LIVRO, conta: Optional[str] = None,
+                        pasta_intermediaria: Optional[str] = None,
+                        ao_progresso: Optional[Callable[[Dict], None]] = None,
+                        formatos_auxiliares: Optional[List[str]] = None) -> Optional[ResultadoConciliacao]:
+    """
+    Executa a conciliação. Sem argumentos usa os arquivos padrão de PASTA_INPUT;
+    o executor de lotes passa caminhos, pastas e livro próprios de cada conta.
+    Retorna um ResultadoConciliacao (resumo e métricas), ou None se o
+    carregamento falhar. As métricas por etapa (tempo, CPU, memória, linhas,
+    IA) vão para um JSON ao lado do log.
+
+    `ao_progresso` recebe os eventos de início/fim de etapa (ver MetricasExecucao)
+    e o avanço das consultas à IA; é como os jobs em segundo plano (jobs_conciliacao.py)
+    acompanham a execução. `formatos_auxiliares` ('parquet', 'csv') grava cópias
+    das abas ao lado do Excel (padrão: FORMATOS_AUXILIARES).
+    """
     # Pega o logger e o nome do arquivo gerado
     global logger
-    logger, caminho_log_atual = configurar_logger_dinamico()
+    logger, caminho_log_atual = configurar_logger_dinamico(pasta_logs, conta)
+    incremental = MODO_INCREMENTAL if incremental is None else incremental
+    workers = WORKERS_MATCHING if workers is None else workers
+    formatos_auxiliares = FORMATOS_AUXILIARES if formatos_auxiliares is None else formatos_auxiliares
     
     logger.info(f">>> INICIANDO NOVA EXECUÇÃO (ID: {caminho_log_atual}) <<<")
+    metricas = MetricasExecucao(caminho_log_atual, conta, ao_atualizar=ao_progresso)
+    arquivo_metricas = caminho_metricas(caminho_log_atual)
     
-    df_p, df_b = carregar_e_saneamento()
+    metricas.iniciar_etapa('carregamento')
+    if pasta_intermediaria is None:
+        pasta_intermediaria = os.path.join(PASTA_INTERMEDIARIA, conta) if conta else PASTA_INTERMEDIARIA
+    df_p, df_b = carregar_e_saneamento(caminho_protheus, caminho_banco, pasta_intermediaria)
     if df_p is None: 
         logger.error("Falha no carregamento. Abortando pipeline.")
-        return
+        metricas.salvar(arquivo_metricas, status='falha_carregamento')
+        return None
+    linhas_p, linhas_b = len(df_p), len(df_b)
+    metricas.concluir_etapa(linhas_saida=linhas_p + linhas_b, linhas_protheus=linhas_p, linhas_banco=linhas_b)
+
+    livro = None
+    if incremental:
+        # Refs estáveis por conteúdo; entram só as linhas novas e o que ficou em aberto
+        metricas.iniciar_etapa('livro_delta', linhas_entrada=linhas_p + linhas_b)
+        livro = LivroConciliacao(caminho_livro)
+        df_p, stats_p = livro.separar_delta(df_p, "Protheus")
+        df_b, stats_b = livro.separar_delta(df_b, "Banco")
+        for origem, st in [("Protheus", stats_p), ("Banco", stats_b)]:
+            logger.info(f"[{origem}] Incremental: {st['linhas_arquivo']} linhas no arquivo, {st['novas']} novas, "
+                        f"{st['abertas_anteriores']} em aberto de execuções anteriores.")
+        print(f"\n📒 MODO INCREMENTAL: {stats_p['novas']} + {stats_b['novas']} linhas novas, "
+              f"{stats_p['abertas_anteriores']} + {stats_b['abertas_anteriores']} itens em aberto (Protheus + Banco).")
+        metricas.concluir_etapa(linhas_saida=len(df_p) + len(df_b), novas=stats_p['novas'] + stats_b['novas'],
+                                abertas_anteriores=stats_p['abertas_anteriores'] + stats_b['abertas_anteriores'])
 
     logger.info("⚡ ETAPA 1: Executando Match Exato (Matemático)...")
     print("\n⚡ ETAPA 1: MATCH EXATO (Matemático)...")
     
-    match_exato = pd.merge(
-        df_p, df_b, 
-        on=['Data', 'Valor_Real'], 
-        how='outer', indicator=True, suffixes=('_Protheus', '_Banco')
-    )
-    
-    conciliados = match_exato[match_exato['_merge'] == 'both'].copy()
-    conciliados['Metodo'] = 'Exato'
-    conciliados['Justificativa_Auditoria'] = 'Valores e Datas coincidem perfeitamente.'
-    
-    pendencias = match_exato[match_exato['_merge'] != 'both']
-    
-    sobra_p = pendencias[pendencias['_merge'] == 'left_only'][['Data', 'Historico', 'Valor_Real', 'Ref. Auditoria_Protheus']].rename(columns={'Ref. Auditoria_Protheus': 'Ref. Auditoria'})
-    sobra_b = pendencias[pendencias['_merge'] == 'right_only'][['Data', 'Descricao', 'Valor_Real', 'Ref. Auditoria_Banco']].rename(columns={'Ref. Auditoria_Banco': 'Ref. Auditoria'})
+    if workers > 1:
+        # Etapas 1 e 2 juntas, fatiadas por valor entre processos (resultado idêntico ao serial)
+        logger.info(f"Matching particionado em {workers} processos (modo {MODO_ATRIBUICAO}).")
+        metricas.iniciar_etapa('matching_particionado', linhas_entrada=len(df_p) + len(df_b))
+        conciliados, sobra_p, sobra_b, df_tol, pares_ia = conciliar_particionado(
+            df_p, df_b, TOLERANCIA_DIAS, JANELA_IA_DIAS, MODO_ATRIBUICAO, workers)
+        metricas.concluir_etapa(linhas_saida=len(sobra_p) + len(sobra_b) - 2 * len(df_tol), workers=workers,
+                                conciliados=len(conciliados) + len(df_tol), pares_ia=len(pares_ia))
+    else:
+        # Um-para-um: duplicatas da mesma chave são pareadas pela ordem de ocorrência
+        metricas.iniciar_etapa('match_exato', linhas_entrada=len(df_p) + len(df_b))
+        conciliados, sobra_p, sobra_b = match_exato(df_p, df_b)
+        metricas.concluir_etapa(linhas_saida=len(sobra_p) + len(sobra_b), conciliados=len(conciliados))
 
     logger.info(f"Conciliados Exatos: {len(conciliados)}")
     print(f"   -> {len(conciliados)} conciliados exatos.")
 
-    logger.info("⚡ ETAPA 2: Executando Match Inteligente (Fuzzy + IA)...")
-    print("\n⚡ ETAPA 2: MATCH INTELIGENTE (Otimizado + IA)...")
+    logger.info("⚡ ETAPA 2: Executando Match por Tolerância de Data...")
+    print("\n⚡ ETAPA 2: MATCH POR TOLERÂNCIA (Vetorizado)...")
     
-    novos_matches = []
-    ids_p_removidos = set()
-    ids_b_removidos = set()
-    
-    grupo_banco = sobra_b.groupby('Valor_Real')
-
-    for idx_p, row_p in sobra_p.iterrows():
-        val = row_p['Valor_Real']
-        
-        if val in grupo_banco.groups:
-            candidatos_b = grupo_banco.get_group(val)
-            
-            for idx_b, row_b in candidatos_b.iterrows():
-                if row_b['Ref. Auditoria'] in ids_b_removidos: continue
-                
-                dias_dif = abs((row_p['Data'] - row_b['Data']).days)
-                match_found = False
-                metodo = ""
-                justificativa = ""
-
-                if dias_dif <= TOLERANCIA_DIAS:
-                    match_found = True
-                    metodo = "Tolerancia Data"
-                    justificativa = f"Valor igual, compensado com {dias_dif} dias de diferença."
-                    logger.info(f"Match Fuzzy: {row_p['Ref. Auditoria']} <-> {row_b['Ref. Auditoria']} (Dias: {dias_dif})")
-                
-                elif dias_dif <= 5: 
-                    print(f"   🤖 IA Analisando: '{row_p['Historico']}' vs '{row_b['Descricao']}'")
-                    logger.info(f"Acionando IA para: '{row_p['Historico']}' vs '{row_b['Descricao']}'")
-                    try:
-                        res_ia = consultar_agente_blindado(row_p['Historico'], row_b['Descricao'])
-                        if res_ia and res_ia['match'] and res_ia['confianca'].lower() in CONFIANCA_MINIMA:
-                            match_found = True
-                            metodo = "Inteligência Artificial"
-                            justificativa = f"[IA Conf: {res_ia['confianca']}] {res_ia['justificativa']}"
-                            logger.info(f"IA MATCH CONFIRMADO: {justificativa}")
-                        else:
-                            logger.info("IA rejeitou a conciliação.")
-                    except Exception as e:
-                        logger.error(f"❌ Erro pontual na IA: {e}")
-                        continue 
-                
-                if match_found:
-                    novos_matches.append({
-                        'Data_Protheus': row_p['Data'],
-                        'Historico': row_p['Historico'],
-                        'Data_Banco': row_b['Data'],
-                        'Descricao': row_b['Descricao'],
-                        'Valor_Real': val,
-                        'Metodo': metodo,
-                        'Justificativa_Auditoria': justificativa
-                    })
-                    ids_p_removidos.add(row_p['Ref. Auditoria'])
-                    ids_b_removidos.add(row_b['Ref. Auditoria'])
-                    break 
-    
-    sobra_p_final = sobra_p[~sobra_p['Ref. Auditoria'].isin(ids_p_removidos)].copy()
-    sobra_b_final = sobra_b[~sobra_b['Ref. Auditoria'].isin(ids_b_removidos)].copy()
-    
-    # Justificativas de Pendência
-    def justificar_pendencia(row, df_comparacao):
-        val = row['Valor_Real']
-        if val in df_comparacao['Valor_Real'].values:
-            return "Valor encontrado no outro extrato, mas datas ou descrições não bateram (IA Rejeitou ou Fora da Tolerância)."
+    # Tolerância de Data: resolvida em lote pelo motor vetorizado
+    if workers <= 1:
+        logger.info(f"Modo de atribuição: {MODO_ATRIBUICAO}")
+        metricas.iniciar_etapa('match_tolerancia', linhas_entrada=len(sobra_p) + len(sobra_b))
+        df_tol, pares_ia = match_tolerancia(sobra_p, sobra_b, TOLERANCIA_DIAS, JANELA_IA_DIAS, MODO_ATRIBUICAO)
+        metricas.concluir_etapa(linhas_saida=len(sobra_p) + len(sobra_b) - 2 * len(df_tol),
+                                conciliados=len(df_tol), pares_ia=len(pares_ia))
+    refs_p = sobra_p['Ref. Auditoria'].values
+    refs_b = sobra_b['Ref. Auditoria'].values
+    for ref_p, ref_b, just in zip(formatar_refs(refs_p[df_tol['pos_p'].values], 'Protheus'),
+                                  formatar_refs(refs_b[df_tol['pos_b'].values], 'Banco'), df_tol['Justificativa_Auditoria'].tolist()):
+        logger.info(f"Match Fuzzy: {ref_p} <-> {ref_b} ({just})")
+
+    logger.info(f"Conciliados por Tolerância: {len(df_tol)}")
+    print(f"   -> {len(df_tol)} conciliados por tolerância de data.")
+
+    # ETAPA 2B: pagamentos divididos/agregados, só entre as sobras sem par de mesmo valor para a IA
+    logger.info(f"⚡ ETAPA 2B: Match por Agrupamento (até {MAX_ITENS_AGRUPAMENTO} itens, ±{JANELA_AGRUPAMENTO_DIAS} dias, "
+                f"orçamento de {ORCAMENTO_JANELA_AGRUPAMENTO_S * 1000:.0f} ms por janela)...")
+    print("\n⚡ ETAPA 2B: MATCH POR AGRUPAMENTO (Soma N:1)...")
+    cand_p = np.setdiff1d(np.arange(len(sobra_p)), np.concatenate([df_tol['pos_p'].values, pares_ia['pos_p'].values]))
+    cand_b = np.setdiff1d(np.arange(len(sobra_b)), np.concatenate([df_tol['pos_b'].values, pares_ia['pos_b'].values]))
+    metricas.iniciar_etapa('match_agrupado', linhas_entrada=len(cand_p) + len(cand_b))
+    df_agr, revisao_agr, stats_agr = match_agrupado(sobra_p.iloc[cand_p], sobra_b.iloc[cand_b], JANELA_AGRUPAMENTO_DIAS,
+                                       MAX_ITENS_AGRUPAMENTO, ORCAMENTO_JANELA_AGRUPAMENTO_S)
+    df_agr['pos_p'] = cand_p[df_agr['pos_p'].values]
+    df_agr['pos_b'] = cand_b[df_agr['pos_b'].values]
+    revisao_agr_p = np.zeros(len(sobra_p), dtype=bool)
+    revisao_agr_b = np.zeros(len(sobra_b), dtype=bool)
+    revisao_agr_p[cand_p[revisao_agr['pos_p'].values]] = True
+    revisao_agr_b[cand_b[revisao_agr['pos_b'].values]] = True
+    metricas.concluir_etapa(linhas_saida=len(cand_p) + len(cand_b) - stats_agr['linhas_protheus'] - stats_agr['linhas_banco'],
+                            conciliados=stats_agr['grupos'], **stats_agr)
+    for ref_p, ref_b, just in zip(formatar_refs(refs_p[df_agr['pos_p'].values], 'Protheus'),
+                                  formatar_refs(refs_b[df_agr['pos_b'].values], 'Banco'), df_agr['Justificativa_Auditoria'].tolist()):
+        logger.info(f"Match Agrupado: {ref_p} <-> {ref_b} ({just})")
+    if stats_agr['janelas_estouradas']:
+        logger.warning(f"Agrupamento: {stats_agr['janelas_estouradas']} de {stats_agr['janelas']} janelas estouraram o "
+                       f"orçamento de {ORCAMENTO_JANELA_AGRUPAMENTO_S}s (ficaram sem grupo).")
+    logger.info(f"Agrupamento: {stats_agr['grupos']} grupos ({stats_agr['linhas_protheus']} Protheus + "
+                f"{stats_agr['linhas_banco']} Banco) em {stats_agr['janelas']} janelas "
+                f"({stats_agr['janelas_ambiguas']} ambíguas: grupos exatos empatados ou combinações demais); "
+                f"janela mais lenta {stats_agr['tempo_max_janela_ms']} ms.")
+    if stats_agr['grupos_revisao']:
+        logger.warning(f"Agrupamento: {stats_agr['grupos_revisao']} grupos de soma exata em janelas densas "
+                       f"({stats_agr['linhas_revisao']} linhas) ficaram pendentes para Revisão Humana.")
+    print(f"   -> {stats_agr['grupos']} grupos conciliados por soma ({len(df_agr)} linhas).")
+
+    # Circuito e contadores do agente zerados antes da recuperação, que também usa o Ollama (/api/embed)
+    cliente_ia = obter_cliente()
+    cliente_ia.nova_execucao()
+
+    # Recuperação: em grupos grandes de mesmo valor, só os vizinhos mais próximos seguem para a IA
+    if USAR_RECUPERACAO_EMBEDDINGS and len(pares_ia):
+        metricas.iniciar_etapa('recuperacao', linhas_entrada=len(pares_ia))
+        cache_emb = CacheEmbeddings() if BACKEND_RECUPERACAO == BACKEND_OLLAMA else None
+        pares_ia, stats_rec = selecionar_candidatos(sobra_p, sobra_b, pares_ia, TOP_K_RECUPERACAO,
+                                                    BACKEND_RECUPERACAO, cache_emb)
+        if cache_emb is not None:
+            stats_rec.update(cache_hits=cache_emb.hits, cache_misses=cache_emb.misses)
+            cache_emb.fechar()
+        metricas.concluir_etapa(linhas_saida=len(pares_ia), **stats_rec)
+        logger.info(f"Recuperação ({stats_rec['backend']}, top {TOP_K_RECUPERACAO}): {stats_rec['pares_entrada']} -> "
+                    f"{stats_rec['pares_saida']} pares candidatos ({stats_rec['textos_vetorizados']} descrições vetorizadas).")
+        print(f"   -> Recuperação: {stats_rec['pares_entrada']} -> {stats_rec['pares_saida']} pares para a IA.")
+
+    # ETAPA 3: IA sobre o resíduo D+4/D+5, em paralelo e aplicada de forma determinística
+    logger.info(f"⚡ ETAPA 3: Adjudicação por IA ({len(pares_ia)} pares candidatos)...")
+    print(f"\n⚡ ETAPA 3: ADJUDICAÇÃO IA ({len(pares_ia)} pares, até {MAX_CONCORRENCIA_IA} em paralelo)...")
+    metricas.iniciar_etapa('ia', linhas_entrada=len(sobra_p) + len(sobra_b) - 2 * len(df_tol)
+                           - stats_agr['linhas_protheus'] - stats_agr['linhas_banco'])
+    cache_ia = obter_cache()
+    if cache_ia is not None:
+        cache_ia.zerar_contadores()
+    regras = DicionarioRegras(CAMINHO_REGRAS) if USAR_REGRAS_APRENDIDAS else None
+
+    df_ia, revisao_ia, stats_ia = adjudicar_pares_ia(
+        sobra_p, sobra_b, pares_ia, CONFIANCA_MINIMA, MAX_CONCORRENCIA_IA,
+        tamanho_lote=TAMANHO_LOTE_IA,
+        limiar_aceite=LIMIAR_ACEITE_LEXICO if USAR_FILTRO_LEXICO else None,
+        limiar_rejeicao=LIMIAR_REJEICAO_LEXICO if USAR_FILTRO_LEXICO else None,
+        ao_concluir=None if ao_progresso is None else lambda feitas, total: ao_progresso(
+            {'evento': 'consultas_ia', 'etapa': 'ia', 'consultas_concluidas': feitas, 'consultas_total': total}),
+        regras=regras,
+    )
+    logger.info(f"Agente IA: {cliente_ia.chamadas} chamadas ao modelo, {cliente_ia.recusadas_circuito} recusadas pelo circuit breaker.")
+    print(f"   -> {stats_ia['consultas']} consultas em {stats_ia['tempo_chamadas_s']}s ({stats_ia['consultas_por_s']} consultas/s).")
+
+    stats_regras = {'ativas': None, 'observadas': None, 'promovidas': None}
+    if regras is not None:
+        try:
+            stats_regras = dict(regras.salvar(), ativas=regras.ativas)
+        except TimeoutError as e:
+            # As regras são só atalho: a conciliação desta execução vale mesmo sem gravar as observações
+            logger.warning(f"Regras aprendidas não gravadas nesta execução: {e}")
+            stats_regras['ativas'] = regras.ativas
         else:
-            return "Valor Único: Não foi encontrado nenhum lançamento com este valor no outro extrato."
+            logger.info(f"Regras aprendidas: {stats_ia['regras_aceitos']} pares aceitos por regra; {stats_regras['observadas']} "
+                        f"padrões observados nesta execução, {stats_regras['promovidas']} novas regras ativas "
+                        f"({stats_regras['ativas']} ativas em {CAMINHO_REGRAS}).")
+
+    stats_cache = {'hits': None, 'misses': None}
+    if cache_ia is not None:
+        stats_cache = cache_ia.estatisticas()
+        logger.info(f"Cache IA: {stats_cache['hits']} hits / {stats_cache['misses']} misses ({stats_cache['entradas']} decisões armazenadas)")
+    metricas.registrar_ia(
+        chamadas_modelo=cliente_ia.chamadas, **percentis_ms(cliente_ia.latencias),
+        cache_hits=stats_cache['hits'], cache_misses=stats_cache['misses'],
+        recusadas_circuito=cliente_ia.recusadas_circuito, respostas_invalidas=cliente_ia.respostas_invalidas,
+        regras_ativas=stats_regras['ativas'], regras_promovidas=stats_regras['promovidas'],
+        **stats_ia,
+    )
 
+    livres_p = np.ones(len(sobra_p), dtype=bool)
+    livres_b = np.ones(len(sobra_b), dtype=bool)
+    livres_p[np.concatenate([df_tol['pos_p'].values, df_agr['pos_p'].values, df_ia['pos_p'].values])] = False
+    livres_b[np.concatenate([df_tol['pos_b'].values, df_agr['pos_b'].values, df_ia['pos_b'].values])] = False
+    sobra_p_final = sobra_p[livres_p].copy()
+    sobra_b_final = sobra_b[livres_b].copy()
+    revisao_p = np.zeros(len(sobra_p), dtype=bool)
+    revisao_b = np.zeros(len(sobra_b), dtype=bool)
+    revisao_p[revisao_ia['pos_p'].values] = True
+    revisao_b[revisao_ia['pos_b'].values] = True
+    metricas.concluir_etapa(linhas_saida=len(sobra_p_final) + len(sobra_b_final), conciliados=len(df_ia),
+                            pares_candidatos=len(pares_ia), revisao_humana=stats_ia['revisao_humana'])
+    
+    # Justificativas de Pendência
+    metricas.iniciar_etapa('pendencias', linhas_entrada=len(sobra_p_final) + len(sobra_b_final))
     if not sobra_p_final.empty:
-        sobra_p_final['Motivo da Pendência'] = sobra_p_final.apply(lambda row: justificar_pendencia(row, df_b), axis=1)
+        sobra_p_final['Motivo da Pendência'] = justificar_pendencias(sobra_p_final, df_b, revisao_p[livres_p],
+                                                                     revisao_agr_p[livres_p])
 
     if not sobra_b_final.empty:
-        sobra_b_final['Motivo da Pendência'] = sobra_b_final.apply(lambda row: justificar_pendencia(row, df_p), axis=1)
+        sobra_b_final['Motivo da Pendência'] = justificar_pendencias(sobra_b_final, df_p, revisao_b[livres_b],
+                                                                     revisao_agr_b[livres_b])
 
-    df_novos = pd.DataFrame(novos_matches)
+    metricas.concluir_etapa(linhas_saida=len(sobra_p_final) + len(sobra_b_final))
+
+    # Mantém a ordem do Protheus, como no relatório anterior
+    df_novos = pd.concat([df_tol, df_agr, df_ia], ignore_index=True)
+    df_novos = df_novos.sort_values('pos_p', kind='stable').reindex(columns=COLUNAS_MATCH).reset_index(drop=True)
     logger.info(f"Conciliados via Lógica/IA: {len(df_novos)}")
     print(f"   -> {len(df_novos)} conciliados via Lógica Avançada/IA.")
 
     # --- RELATÓRIO FINAL ---
-    caminho_saida = os.path.join(PASTA_OUTPUT, 'RELATORIO_ENTERPRISE_V2.xlsx')
+    os.makedirs(pasta_saida, exist_ok=True)
+    caminho_saida = os.path.join(pasta_saida, 'RELATORIO_ENTERPRISE_V2.xlsx')
+    abas = montar_abas(conciliados, df_novos, sobra_p_final, sobra_b_final)
+    caminho_base = os.path.splitext(caminho_saida)[0]
+    saidas_auxiliares = caminhos_auxiliares(caminho_base, abas.keys(), formatos_auxiliares)
+
     logger.info(f"Salvando relatório em: {caminho_saida}")
     print(f"\n💾 Salvando '{caminho_saida}'...")
     
-    with pd.ExcelWriter(caminho_saida, engine='xlsxwriter') as writer:
-        cols_conciliados = ['Data', 'Historico', 'Descricao', 'Valor_Real', 'Metodo', 'Justificativa_Auditoria']
-        conciliados_exatos_limpo = conciliados.reindex(columns=cols_conciliados)
-        
-        if not df_novos.empty:
-            conciliados_final = pd.concat([conciliados_exatos_limpo, df_novos])
-        else:
-            conciliados_final = conciliados_exatos_limpo
-            
-        conciliados_final.to_excel(writer, sheet_name='Conciliados', index=False)
-        sobra_p_final.to_excel(writer, sheet_name='Pendencia Protheus', index=False)
-        sobra_b_final.to_excel(writer, sheet_name='Pendencia Banco', index=False)
-        
-        workbook = writer.book
-        fmt_text = workbook.add_format({'text_wrap': True})
-        
-        ws_conc = writer.sheets['Conciliados']
-        ws_conc.set_column('F:F', 50, fmt_text)
-        
-        if 'Pendencia Protheus' in writer.sheets:
-            writer.sheets['Pendencia Protheus'].set_column('E:E', 60, fmt_text)
-        if 'Pendencia Banco' in writer.sheets:
-            writer.sheets['Pendencia Banco'].set_column('E:E', 60, fmt_text)
+    linhas_relatorio = sum(len(parte) for partes in abas.values() for parte in partes)
+    metricas.iniciar_etapa('relatorio', linhas_entrada=linhas_relatorio)
+    planilhas = escrever_abas(caminho_saida, abas)
+    if len(planilhas) > len(abas):
+        logger.warning(f"Abas acima do limite de linhas do Excel foram divididas: {planilhas}")
+    if formatos_auxiliares:
+        gravar_auxiliares(caminho_base, abas, formatos_auxiliares)
+        logger.info(f"Saídas auxiliares gravadas: {saidas_auxiliares}")
+    metricas.concluir_etapa(linhas_saida=linhas_relatorio, planilhas=len(planilhas),
+                            formatos_auxiliares=list(formatos_auxiliares))
+
+    # O livro só é atualizado depois que o relatório foi gravado
+    if livro is not None:
+        metricas.iniciar_etapa('livro_atualizacao', linhas_entrada=len(df_p) + len(df_b))
+        # Grupos entram como um par por item (o lançamento único aparece uma vez por item)
+        novos = [df_tol, df_agr, df_ia]
+        pares_p = np.concatenate([conciliados['Ref. Auditoria_Protheus'].values] + [refs_p[d['pos_p'].values] for d in novos])
+        pares_b = np.concatenate([conciliados['Ref. Auditoria_Banco'].values] + [refs_b[d['pos_b'].values] for d in novos])
+        metodos = np.concatenate([conciliados['Metodo'].values] + [d['Metodo'].values for d in novos])
+        livro.registrar_execucao(caminho_log_atual, df_p, "Protheus", pares_p, pares_b, metodos)
+        livro.registrar_execucao(caminho_log_atual, df_b, "Banco", pares_b, pares_p, metodos)
+        logger.info(f"Livro de conciliação atualizado: {livro.estatisticas()}")
+        metricas.concluir_etapa(linhas_saida=len(df_p) + len(df_b))
 
     logger.info("✅ Processo Enterprise V3 Concluído com Sucesso.")
     print("✅ Processo Enterprise V3 Concluído.")
+    metricas.salvar(arquivo_metricas)
+    logger.info(f"Métricas da execução: {arquivo_metricas}")
+
+    resumo = {
+        'conta': conta,
+        'linhas_protheus': linhas_p,
+        'linhas_banco': linhas_b,
+        'conciliados_exatos': len(conciliados),
+        'conciliados_tolerancia': len(df_tol),
+        'conciliados_agrupados': stats_agr['grupos'],
+        'linhas_agrupadas_protheus': stats_agr['linhas_protheus'],
+        'linhas_agrupadas_banco': stats_agr['linhas_banco'],
+        'conciliados_ia': len(df_ia),
+        'pendentes_protheus': len(sobra_p_final),
+        'pendentes_banco': len(sobra_b_final),
+        'revisao_humana': stats_ia['revisao_humana'] + stats_agr['linhas_revisao'],
+        'caminho_saida': caminho_saida,
+        'caminho_log': caminho_log_atual,
+        'caminho_metricas': arquivo_metricas,
+        'saidas_auxiliares': saidas_auxiliares,
+    }
+    return ResultadoConciliacao(resumo, metricas)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conciliador Enterprise (Protheus x Banco)")
+    parser.add_argument('--incremental', action='store_true', default=None,
+                        help=f"Processa só as linhas novas contra os itens em aberto do livro ({CAMINHO_LIVRO})")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"Processos para o match exato/tolerância (padrão: {WORKERS_MATCHING})")
+    parser.add_argument('--auxiliares', nargs='*', choices=['parquet', 'csv'], default=None,
+                        help="Também grava as abas em Parquet e/ou CSV ao lado do Excel")
+    args = parser.parse_args()
+
     start = time.time()
-    pipeline_enterprise()
+    pipeline_enterprise(incremental=args.incremental, workers=args.workers, formatos_auxiliares=args.auxiliares)
     print(f"⏱️ Tempo: {time.time() - start:.2f}s")
\ No newline at end of file
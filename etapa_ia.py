@@ -0,0 +1,223 @@
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from agente_seguro_v2 import consultar_agente_blindado, consultar_agente_lote
+from motor_matching import montar_matches
+from similaridade import pontuar_pares
+from regras_aprendidas import DicionarioRegras
+
+logger = logging.getLogger(__name__)
+
+METODO_IA = "Inteligência Artificial"
+METODO_LEXICO = "Similaridade Textual"
+METODO_REGRA = "Regra Aprendida"
+MOTIVO_REVISAO_HUMANA = "Revisão Humana: IA indisponível ou resposta inválida para o par candidato."
+
+
+def _consultar_seguro(consultar: Callable, historico, descricao) -> Optional[Dict]:
+    """Erros de uma chamada nunca derrubam a etapa: o par fica para revisão humana."""
+    try:
+        return consultar(historico, descricao)
+    except Exception as e:
+        logger.error(f"❌ Erro pontual na IA: {e}")
+        return None
+
+
+def _consultar_lote_seguro(consultar_lote: Callable, bloco: List[Tuple], tamanho_lote: int) -> List[Optional[Dict]]:
+    try:
+        return consultar_lote(bloco, tamanho_lote)
+    except Exception as e:
+        logger.error(f"❌ Erro pontual na IA (lote): {e}")
+        return [None] * len(bloco)
+
+
+def consultar_pares_concorrente(pares_texto: List[Tuple], max_concorrencia: int,
+                                consultar: Callable = consultar_agente_blindado,
+                                tamanho_lote: int = 1,
+                                consultar_lote: Callable = consultar_agente_lote,
+                                ao_concluir: Optional[Callable[[int, int], None]] = None) -> Dict[Tuple, Optional[Dict]]:
+    """
+    Envia os pares (Historico, Descricao) ao agente com no máximo `max_concorrencia`
+    requisições simultâneas. Com `tamanho_lote` > 1, cada requisição leva um lote de pares.
+    `ao_concluir(concluidos, total)` é chamado a cada requisição respondida (progresso).
+    """
+    if not pares_texto:
+        return {}
+    concluidos = 0
+    lock = threading.Lock()
+
+    def _avisar(quantidade: int):
+        nonlocal concluidos
+        if ao_concluir is None:
+            return
+        with lock:
+            concluidos += quantidade
+            ao_concluir(concluidos, len(pares_texto))
+
+    def _par(par):
+        resposta = _consultar_seguro(consultar, *par)
+        _avisar(1)
+        return resposta
+
+    def _lote(bloco):
+        respostas_bloco = _consultar_lote_seguro(consultar_lote, bloco, tamanho_lote)
+        _avisar(len(bloco))
+        return respostas_bloco
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concorrencia), thread_name_prefix='agente_ia') as pool:
+        if tamanho_lote > 1:
+            blocos = [pares_texto[i:i + tamanho_lote] for i in range(0, len(pares_texto), tamanho_lote)]
+            respostas = [r for bloco in pool.map(_lote, blocos) for r in bloco]
+        else:
+            respostas = list(pool.map(_par, pares_texto))
+    return dict(zip(pares_texto, respostas))
+
+
+def adjudicar_pares_ia(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, pares_ia: pd.DataFrame,
+                       confianca_minima: List[str], max_concorrencia: int = 4,
+                       consultar: Callable = consultar_agente_blindado,
+                       tamanho_lote: int = 1,
+                       limiar_aceite: Optional[float] = None,
+                       limiar_rejeicao: Optional[float] = None,
+                       ao_concluir: Optional[Callable[[int, int], None]] = None,
+                       regras: Optional[DicionarioRegras] = None) -> Tuple[pd.DataFrame, pd.DataFrame, Dict]:
+    """
+    Etapa de IA: recebe todos os pares candidatos (pos_p, pos_b) de uma vez,
+    consulta o agente em paralelo e só depois aplica as respostas.
+
+    A aplicação percorre os pares na ordem (pos_p, pos_b) com a mesma regra
+    um-para-um do loop sequencial, então o resultado não depende da ordem em
+    que as respostas chegam. Pares com o mesmo texto são consultados uma vez só.
+    Com `tamanho_lote` > 1, os pares vão ao modelo em prompts de múltiplos pares.
+
+    Pré-filtro léxico (quando os limiares são informados): todos os pares são
+    pontuados localmente; score >= limiar_aceite é aceito sem IA, score <
+    limiar_rejeicao é descartado sem IA, e só a faixa intermediária vai ao modelo.
+
+    Regras aprendidas (quando `regras` é informado): pares cobertos por uma
+    regra ativa são aceitos antes do filtro léxico e do modelo; as decisões do
+    modelo nesta execução (não as relidas do cache) são registradas em `regras`
+    (gravar com regras.salvar()).
+
+    Retorna o DataFrame de matches (layout de 'Conciliados' + pos_p/pos_b), os
+    pares sem decisão da IA com as duas linhas ainda em aberto (pos_p, pos_b),
+    para Revisão Humana, e as estatísticas ('revisao_humana' conta linhas).
+    """
+    inicio = time.perf_counter()
+    pos_p = pares_ia['pos_p'].values
+    pos_b = pares_ia['pos_b'].values
+    historicos = sobra_p['Historico'].values[pos_p]
+    descricoes = sobra_b['Descricao'].values[pos_b]
+
+    # Pré-filtro léxico: decide localmente os extremos e deixa para a IA só a faixa incerta
+    scores = np.zeros(len(pares_ia), dtype=np.float32)
+    aceite_lexico = np.zeros(len(pares_ia), dtype=bool)
+    rejeicao_lexico = np.zeros(len(pares_ia), dtype=bool)
+    if limiar_aceite is not None and limiar_rejeicao is not None and len(pares_ia):
+        scores = pontuar_pares(historicos, descricoes)
+        aceite_lexico = scores >= limiar_aceite
+        rejeicao_lexico = (scores < limiar_rejeicao) & ~aceite_lexico
+        logger.info(f"Pré-filtro léxico (aceite >= {limiar_aceite}, rejeição < {limiar_rejeicao}): "
+                    f"{int(aceite_lexico.sum())} aceitos, {int(rejeicao_lexico.sum())} rejeitados, "
+                    f"{int((~aceite_lexico & ~rejeicao_lexico).sum())} incertos -> IA.")
+
+    # Regras aprendidas: padrões que a IA já aprovou repetidas vezes não voltam ao modelo
+    ids_regra = regras.casar(historicos, descricoes) if regras is not None else np.full(len(pares_ia), None, dtype=object)
+    por_regra = np.array([r is not None for r in ids_regra], dtype=bool)
+    if por_regra.any():
+        aceite_lexico &= ~por_regra
+        rejeicao_lexico &= ~por_regra
+        logger.info(f"Regras aprendidas ({regras.ativas} ativas): {int(por_regra.sum())} pares decididos sem IA.")
+    incertos = ~aceite_lexico & ~rejeicao_lexico & ~por_regra
+
+    pares_texto = list(dict.fromkeys(zip(historicos[incertos], descricoes[incertos])))
+    logger.info(f"ETAPA IA: {len(pares_ia)} pares candidatos, {len(pares_texto)} consultas distintas "
+                f"(concorrência máx.: {max_concorrencia}, lote: {tamanho_lote})")
+    for historico, descricao in pares_texto:
+        logger.info(f"Acionando IA para: '{historico}' vs '{descricao}'")
+
+    inicio_chamadas = time.perf_counter()
+    respostas = consultar_pares_concorrente(pares_texto, max_concorrencia, consultar, tamanho_lote,
+                                            ao_concluir=ao_concluir)
+    tempo_chamadas = time.perf_counter() - inicio_chamadas
+    if regras is not None:
+        # Só decisões tomadas pelo modelo nesta execução: a mesma resposta relida do cache não é evidência nova
+        for (historico, descricao), res_ia in respostas.items():
+            if res_ia is None or res_ia.get('do_cache'):
+                continue
+            if not res_ia['match']:
+                regras.observar(historico, descricao, aprovado=False)
+            elif res_ia['confianca'].lower() in confianca_minima:
+                regras.observar(historico, descricao, aprovado=True)
+
+    # Aplicação determinística (ordem do Protheus, primeiro Banco aprovado)
+    usados_p, usados_b = set(), set()
+    aceitos_p, aceitos_b, metodos, justificativas = [], [], [], []
+    sem_decisao = []
+    rejeitados_ia = 0
+    for k, (p, b, historico, descricao) in enumerate(zip(pos_p.tolist(), pos_b.tolist(), historicos, descricoes)):
+        if p in usados_p or b in usados_b or rejeicao_lexico[k]:
+            continue
+        if por_regra[k]:
+            usados_p.add(p)
+            usados_b.add(b)
+            aceitos_p.append(p)
+            aceitos_b.append(b)
+            metodos.append(METODO_REGRA)
+            justificativas.append(f"[Regra {ids_regra[k]}] Padrão aprovado pela IA em execuções anteriores.")
+            continue
+        if aceite_lexico[k]:
+            usados_p.add(p)
+            usados_b.add(b)
+            aceitos_p.append(p)
+            aceitos_b.append(b)
+            metodos.append(METODO_LEXICO)
+            justificativas.append(f"[Similaridade: {scores[k]:.2f}] Descrições equivalentes após normalização.")
+            continue
+        res_ia = respostas[(historico, descricao)]
+        if res_ia is None:
+            sem_decisao.append((p, b))
+        elif res_ia['match'] and res_ia['confianca'].lower() in confianca_minima:
+            justificativa = f"[IA Conf: {res_ia['confianca']}] {res_ia['justificativa']}"
+            logger.info(f"IA MATCH CONFIRMADO: {justificativa}")
+            usados_p.add(p)
+            usados_b.add(b)
+            aceitos_p.append(p)
+            aceitos_b.append(b)
+            metodos.append(METODO_IA)
+            justificativas.append(justificativa)
+        else:
+            rejeitados_ia += 1
+            logger.info(f"IA rejeitou a conciliação: '{historico}' vs '{descricao}'")
+
+    df_ia = montar_matches(sobra_p, sobra_b, np.array(aceitos_p, dtype=np.int64), np.array(aceitos_b, dtype=np.int64),
+                           metodos, justificativas)
+
+    # Só os pares cujas duas pontas continuaram em aberto (a linha não foi conciliada com outro candidato)
+    sem_decisao = [(p, b) for p, b in sem_decisao if p not in usados_p and b not in usados_b]
+    revisao = pd.DataFrame(sem_decisao, columns=['pos_p', 'pos_b'], dtype=np.int64)
+
+    tempo_total = time.perf_counter() - inicio
+    estatisticas = {
+        'pares_candidatos': len(pares_ia),
+        'consultas': len(pares_texto),
+        'aprovados': len(df_ia),
+        'rejeitados_ia': rejeitados_ia,
+        'lexico_aceitos': int(aceite_lexico.sum()),
+        'lexico_rejeitados': int(rejeicao_lexico.sum()),
+        'lexico_incertos': int(incertos.sum()),
+        'regras_aceitos': int(por_regra.sum()),
+        'revisao_humana': revisao['pos_p'].nunique() + revisao['pos_b'].nunique(),  # Linhas, não pares
+        'tempo_chamadas_s': round(tempo_chamadas, 3),
+        'tempo_total_s': round(tempo_total, 3),
+        'consultas_por_s': round(len(pares_texto) / tempo_chamadas, 2) if tempo_chamadas > 0 else 0.0,
+    }
+    logger.info(f"ETAPA IA concluída: {estatisticas['consultas']} consultas em {estatisticas['tempo_chamadas_s']}s "
+                f"({estatisticas['consultas_por_s']} consultas/s), {estatisticas['aprovados']} aprovados, "
+                f"{estatisticas['revisao_humana']} linhas sem decisão (Revisão Humana).")
+    return df_ia, revisao, estatisticas
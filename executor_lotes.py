@@ -0,0 +1,155 @@
+"""
+Executor de lotes: concilia várias contas (arquivo ERP x extrato) em paralelo.
+
+Uso:
+    python executor_lotes.py manifesto.csv --workers 4
+
+Manifesto (CSV com ';' ou ',' ou JSON com uma lista de objetos), uma linha por conta:
+    conta;arquivo_protheus;arquivo_banco
+    itau_0001;erp/itau_0001.xlsx;bancos/itau_0001.ofx
+
+Caminhos relativos são resolvidos a partir da pasta do manifesto. Cada conta
+roda em um processo próprio, com log, relatório, intermediários e livro
+incremental separados; ao fim é gravado um resumo com tempos e taxas de
+conciliação por conta.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+
+import conciliador_enterprise_v2 as conciliador
+
+COLUNAS_MANIFESTO = ['conta', 'arquivo_protheus', 'arquivo_banco']
+COLUNAS_CONTAGEM = ['linhas_protheus', 'linhas_banco', 'conciliados_exatos', 'conciliados_tolerancia',
+                    'conciliados_agrupados', 'conciliados_ia', 'pendentes_protheus', 'pendentes_banco', 'revisao_humana']
+COLUNAS_RESUMO = (['conta', 'status', 'tempo_s', 'taxa_conciliacao_protheus', 'taxa_conciliacao_banco']
+                  + COLUNAS_CONTAGEM + ['caminho_saida', 'caminho_log', 'caminho_metricas', 'erro'])
+
+
+def _nome_seguro(conta: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', str(conta)).strip('_') or 'conta'
+
+
+def ler_manifesto(caminho: str) -> List[Dict[str, str]]:
+    """Lê o manifesto (CSV ou JSON) e resolve os caminhos relativos à pasta do manifesto."""
+    if caminho.lower().endswith('.json'):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            jobs = pd.DataFrame(json.load(f))
+    else:
+        jobs = pd.read_csv(caminho, sep=None, engine='python', dtype=str, encoding='utf-8-sig')
+    jobs.columns = [c.strip().lower() for c in jobs.columns]
+
+    faltantes = [c for c in COLUNAS_MANIFESTO if c not in jobs.columns]
+    if faltantes:
+        raise ValueError(f"Manifesto '{caminho}' inválido! Faltam colunas: {faltantes}")
+    contas = jobs['conta'].map(_nome_seguro)
+    if contas.duplicated().any():
+        raise ValueError(f"Manifesto '{caminho}' tem contas repetidas: {sorted(set(contas[contas.duplicated()]))}")
+
+    base = os.path.dirname(os.path.abspath(caminho))
+    resolver = lambda p: p if os.path.isabs(p) else os.path.join(base, p)
+    return [
+        {'conta': conta, 'arquivo_protheus': resolver(str(linha['arquivo_protheus']).strip()),
+         'arquivo_banco': resolver(str(linha['arquivo_banco']).strip())}
+        for conta, (_, linha) in zip(contas, jobs.iterrows())
+    ]
+
+
+def executar_job(job: Dict[str, str], incremental: bool = False, workers_matching: int = 1) -> Dict:
+    """Roda o pipeline de uma conta com pastas próprias. Nunca levanta: erros viram status no resumo."""
+    conta = job['conta']
+    inicio = time.perf_counter()
+    resumo = {'conta': conta, 'status': 'erro', 'erro': ''}
+    try:
+        resultado = conciliador.pipeline_enterprise(
+            incremental=incremental,
+            workers=workers_matching,
+            caminho_protheus=job['arquivo_protheus'],
+            caminho_banco=job['arquivo_banco'],
+            pasta_saida=os.path.join(conciliador.PASTA_OUTPUT, conta),
+            pasta_logs=os.path.join(conciliador.PASTA_LOGS, conta),
+            caminho_livro=os.path.join(os.path.dirname(conciliador.CAMINHO_LIVRO), f"livro_conciliacao_{conta}.sqlite"),
+            conta=conta,
+        )
+        if resultado is None:
+            resumo['erro'] = "Falha no carregamento (ver log da conta)."
+        else:
+            resumo.update(resultado.resumo)
+            resumo['status'] = 'ok'
+    except Exception as e:
+        resumo['erro'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    resumo['tempo_s'] = round(time.perf_counter() - inicio, 3)
+    return resumo
+
+
+def _taxas(resumo: Dict) -> Dict:
+    conciliados = sum(resumo.get(k, 0) for k in ['conciliados_exatos', 'conciliados_tolerancia', 'conciliados_ia'])
+    # Grupos N:1 / 1:N conciliam quantidades diferentes de linhas em cada lado
+    conciliados_p = conciliados + resumo.get('linhas_agrupadas_protheus', 0)
+    conciliados_b = conciliados + resumo.get('linhas_agrupadas_banco', 0)
+    linhas_p, linhas_b = resumo.get('linhas_protheus', 0), resumo.get('linhas_banco', 0)
+    return {
+        'taxa_conciliacao_protheus': round(conciliados_p / linhas_p, 4) if linhas_p else 0.0,
+        'taxa_conciliacao_banco': round(conciliados_b / linhas_b, 4) if linhas_b else 0.0,
+    }
+
+
+def executar_lote(jobs: List[Dict[str, str]], workers: int = 2, incremental: bool = False,
+                  workers_matching: int = 1) -> pd.DataFrame:
+    """
+    Distribui as contas em `workers` processos (spawn: cada conta começa com
+    logger, cliente IA e conexões próprios) e devolve o resumo na ordem do manifesto.
+    """
+    ordem = {job['conta']: i for i, job in enumerate(jobs)}
+    resumos = []
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx) as pool:
+        futuros = {pool.submit(executar_job, job, incremental, workers_matching): job['conta'] for job in jobs}
+        for futuro in as_completed(futuros):
+            resumo = futuro.result()
+            resumo.update(_taxas(resumo))
+            resumos.append(resumo)
+            print(f"   [{resumo['status'].upper()}] {resumo['conta']} em {resumo['tempo_s']}s")
+    resumos.sort(key=lambda r: ordem[r['conta']])
+    resumo = pd.DataFrame(resumos).reindex(columns=COLUNAS_RESUMO)
+    resumo[COLUNAS_CONTAGEM] = resumo[COLUNAS_CONTAGEM].astype('Int64')
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Executor de lotes do Conciliador Enterprise (várias contas)")
+    parser.add_argument('manifesto', help="CSV ou JSON com as colunas conta, arquivo_protheus, arquivo_banco")
+    parser.add_argument('--workers', type=int, default=2, help="Contas processadas em paralelo (padrão: 2)")
+    parser.add_argument('--incremental', action='store_true', help="Usa o livro incremental de cada conta")
+    parser.add_argument('--workers-matching', type=int, default=1,
+                        help="Processos de matching dentro de cada conta (padrão: 1)")
+    args = parser.parse_args(argv)
+
+    jobs = ler_manifesto(args.manifesto)
+    print(f"📦 Lote com {len(jobs)} contas, {args.workers} em paralelo...")
+    inicio = time.perf_counter()
+    resumo = executar_lote(jobs, args.workers, args.incremental, args.workers_matching)
+
+    os.makedirs(conciliador.PASTA_OUTPUT, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    caminho_resumo = os.path.join(conciliador.PASTA_OUTPUT, f"resumo_lote_{timestamp}.csv")
+    resumo.to_csv(caminho_resumo, index=False, sep=';')
+
+    ok = int((resumo['status'] == 'ok').sum())
+    print(f"\n✅ Lote concluído em {time.perf_counter() - inicio:.2f}s: {ok}/{len(resumo)} contas OK.")
+    print(f"📄 Resumo: {caminho_resumo}")
+    return 0 if ok == len(resumo) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,46 +1,203 @@
+"""
+Gerador de cenários de conciliação.
+
+Uso:
+    python gerar_cenarios.py                                  # cenário de demonstração (5 linhas)
+    python gerar_cenarios.py --linhas 100000 --formatos csv parquet \
+        --duplicatas 0.05 --faixa-ia 0.05 --sem-par 0.05 --ruido 0.1 --deslocamentos 0:0.6,1:0.2,2:0.1,3:0.1
+
+Os arquivos vão para data/input como sistema_protheus.<ext> e extrato_banco.<ext>.
+Com mais de um formato, o pipeline lê o modificado por último e avisa no log.
+"""
 import pandas as pd
+import numpy as np
 import os
+import argparse
 from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple
 
 # Configuração
 data_base = datetime(2025, 1, 10)
-os.makedirs('data/input', exist_ok=True)
-
-# --- 1. DADOS DO PROTHEUS ---
-dados_protheus = [
-    # Cenário 1: Match Perfeito
-    {'Data': data_base, 'Historico': 'PGTO FORNECEDOR ALPHA', 'Valor': 1500.00, 'Natureza': 'D'},
-    # Cenário 2: Tolerância Matemática (1 dia de dif)
-    {'Data': data_base, 'Historico': 'PGTO BOLETO SERVICOS', 'Valor': 345.50, 'Natureza': 'D'},
-    # Cenário 3: Match Perfeito Recebimento
-    {'Data': data_base + timedelta(days=2), 'Historico': 'RECEB. CLIENTE BETA', 'Valor': 5000.00, 'Natureza': 'C'},
-    # Cenário 4: Erro no Protheus
-    {'Data': data_base + timedelta(days=5), 'Historico': 'PGTO MANUTENCAO PENDENTE', 'Valor': 200.00, 'Natureza': 'D'},
-    
-    # 🔥 CENÁRIO 6: O TESTE DA IA (Mesmo valor, data 4 dias longe)
-    {'Data': data_base, 'Historico': 'CONSULTORIA DE TI SPECIAL', 'Valor': 1250.00, 'Natureza': 'D'},
-]
-
-# --- 2. DADOS DO BANCO ---
-dados_banco = [
-    # Match Perfeito
-    {'Data': data_base, 'Descricao': 'DOC ELET FORN ALPHA', 'Valor': -1500.00},
-    # Tolerância Matemática
-    {'Data': data_base + timedelta(days=1), 'Descricao': 'COBRANCA BANCARIA', 'Valor': -345.50},
-    # Match Perfeito Recebimento
-    {'Data': data_base + timedelta(days=2), 'Descricao': 'CREDITO TED CLIENTE BETA', 'Valor': 5000.00},
-    # Cenário 5: Tarifa Bancária
-    {'Data': data_base + timedelta(days=3), 'Descricao': 'TARIFA CESTA SERVICOS', 'Valor': -55.90},
-    
-    # 🔥 CENÁRIO 6: O TESTE DA IA (Descrição diferente, Data D+4)
-    # A matemática só pega até D+3. A IA pega até D+5.
-    {'Data': data_base + timedelta(days=4), 'Descricao': 'DEBITO PAGAMENTO SERVICO EXT', 'Valor': -1250.00},
-]
-
-df_protheus = pd.DataFrame(dados_protheus)
-df_banco = pd.DataFrame(dados_banco)
-
-print("Gerando arquivos de cenário...")
-df_protheus.to_excel('data/input/sistema_protheus.xlsx', index=False)
-df_banco.to_excel('data/input/extrato_banco.xlsx', index=False)
-print("✅ Arquivos atualizados com Cenário de IA!")
\ No newline at end of file
+PASTA_SAIDA = 'data/input'
+
+# Distribuição padrão do atraso de compensação no banco (dias: peso), dentro da tolerância
+DESLOCAMENTOS_PADRAO = {0: 0.6, 1: 0.2, 2: 0.1, 3: 0.1}
+FORMATOS = ['xlsx', 'csv', 'parquet']
+
+EMPRESAS = ['ALPHA', 'BETA', 'GAMA', 'DELTA', 'OMEGA', 'SIGMA', 'ZETA', 'KAPPA', 'TECH', 'LOG', 'AGRO', 'SERV']
+SUFIXOS = ['LTDA', 'SA', 'ME', 'EIRELI', 'COMERCIO', 'SERVICOS']
+HISTORICOS_P = ['PGTO FORNECEDOR', 'PGTO BOLETO', 'RECEB. CLIENTE', 'PGTO NF', 'TRANSF. ENTRE CONTAS']
+DESCRICOES_B = ['DOC ELET FORN', 'COBRANCA BANCARIA', 'CREDITO TED CLIENTE', 'PIX ENVIADO', 'TED ENVIADA']
+DESCRICOES_IA = ['DEBITO PAGAMENTO', 'LIQUIDACAO TITULO', 'PAGAMENTO DIVERSOS', 'DEB AUTOR']
+
+
+def cenario_demonstracao() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Os cenários feitos à mão, um por regra do funil."""
+    # --- 1. DADOS DO PROTHEUS ---
+    dados_protheus = [
+        # Cenário 1: Match Perfeito
+        {'Data': data_base, 'Historico': 'PGTO FORNECEDOR ALPHA', 'Valor': 1500.00, 'Natureza': 'D'},
+        # Cenário 2: Tolerância Matemática (1 dia de dif)
+        {'Data': data_base, 'Historico': 'PGTO BOLETO SERVICOS', 'Valor': 345.50, 'Natureza': 'D'},
+        # Cenário 3: Match Perfeito Recebimento
+        {'Data': data_base + timedelta(days=2), 'Historico': 'RECEB. CLIENTE BETA', 'Valor': 5000.00, 'Natureza': 'C'},
+        # Cenário 4: Erro no Protheus
+        {'Data': data_base + timedelta(days=5), 'Historico': 'PGTO MANUTENCAO PENDENTE', 'Valor': 200.00, 'Natureza': 'D'},
+
+        # 🔥 CENÁRIO 6: O TESTE DA IA (Mesmo valor, data 4 dias longe)
+        {'Data': data_base, 'Historico': 'CONSULTORIA DE TI SPECIAL', 'Valor': 1250.00, 'Natureza': 'D'},
+    ]
+
+    # --- 2. DADOS DO BANCO ---
+    dados_banco = [
+        # Match Perfeito
+        {'Data': data_base, 'Descricao': 'DOC ELET FORN ALPHA', 'Valor': -1500.00},
+        # Tolerância Matemática
+        {'Data': data_base + timedelta(days=1), 'Descricao': 'COBRANCA BANCARIA', 'Valor': -345.50},
+        # Match Perfeito Recebimento
+        {'Data': data_base + timedelta(days=2), 'Descricao': 'CREDITO TED CLIENTE BETA', 'Valor': 5000.00},
+        # Cenário 5: Tarifa Bancária
+        {'Data': data_base + timedelta(days=3), 'Descricao': 'TARIFA CESTA SERVICOS', 'Valor': -55.90},
+
+        # 🔥 CENÁRIO 6: O TESTE DA IA (Descrição diferente, Data D+4)
+        # A matemática só pega até D+3. A IA pega até D+5.
+        {'Data': data_base + timedelta(days=4), 'Descricao': 'DEBITO PAGAMENTO SERVICO EXT', 'Valor': -1250.00},
+    ]
+    return pd.DataFrame(dados_protheus), pd.DataFrame(dados_banco)
+
+
+def _ruido(textos: np.ndarray, taxa: float, rng: np.random.Generator) -> np.ndarray:
+    """Embaralha parte das descrições como os bancos fazem: corta, abrevia ou troca caracteres."""
+    textos = textos.copy()
+    alvo = np.flatnonzero(rng.random(len(textos)) < taxa)
+    tipos = rng.integers(0, 3, len(alvo))
+    for i, tipo in zip(alvo.tolist(), tipos.tolist()):
+        t = textos[i]
+        if tipo == 0:
+            textos[i] = t[:max(8, int(len(t) * 0.7))]
+        elif tipo == 1:
+            textos[i] = " ".join(p[:4] for p in t.split())
+        elif len(t) > 2:
+            k = int(rng.integers(0, len(t) - 1))
+            textos[i] = t[:k] + t[k + 1] + t[k] + t[k + 2:]
+    return textos
+
+
+def gerar_cenario_sintetico(n_linhas: int, taxa_duplicatas: float = 0.05,
+                            deslocamentos: Dict[int, float] = None, ruido_descricao: float = 0.1,
+                            fracao_faixa_ia: float = 0.05, fracao_sem_par: float = 0.05,
+                            dias_periodo: int = 30, seed: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Gera um par (Protheus, Banco) com `n_linhas` lançamentos no Protheus.
+
+    - taxa_duplicatas: fração de linhas que repetem valor e data de outra (folha, boletos recorrentes)
+    - deslocamentos: distribuição {dias: peso} do atraso de compensação no banco
+    - ruido_descricao: fração das descrições do banco cortadas/abreviadas/com erro de digitação
+    - fracao_faixa_ia: fração de pares com atraso de 4 a 5 dias e descrição diferente (vão para a IA)
+    - fracao_sem_par: fração de linhas sem contrapartida (dos dois lados, ex.: tarifas)
+    """
+    rng = np.random.default_rng(seed)
+    deslocamentos = deslocamentos or DESLOCAMENTOS_PADRAO
+
+    datas = np.datetime64(data_base.date()) + rng.integers(0, dias_periodo, n_linhas).astype('timedelta64[D]')
+    valores = np.round(rng.uniform(10, 50_000, n_linhas), 2)
+    duplicadas = np.flatnonzero(rng.random(n_linhas) < taxa_duplicatas)
+    if len(duplicadas):
+        # Cada duplicata copia valor e data de uma linha "modelo" (poucos modelos -> grupos grandes)
+        modelos = rng.choice(n_linhas, size=max(1, len(duplicadas) // 20))
+        origem = modelos[rng.integers(0, len(modelos), len(duplicadas))]
+        valores[duplicadas] = valores[origem]
+        datas[duplicadas] = datas[origem]
+    natureza = np.where(rng.random(n_linhas) < 0.7, 'D', 'C')
+
+    empresa = np.char.add(np.char.add(np.array(EMPRESAS)[rng.integers(0, len(EMPRESAS), n_linhas)], ' '),
+                          np.array(SUFIXOS)[rng.integers(0, len(SUFIXOS), n_linhas)])
+    tipo = rng.integers(0, len(HISTORICOS_P), n_linhas)
+    historico = np.char.add(np.char.add(np.array(HISTORICOS_P)[tipo], ' '), empresa).astype(object)
+
+    sorteio = rng.random(n_linhas)
+    sem_par = sorteio < fracao_sem_par
+    faixa_ia = (sorteio >= fracao_sem_par) & (sorteio < fracao_sem_par + fracao_faixa_ia)
+
+    dias, pesos = zip(*sorted(deslocamentos.items()))
+    pesos = np.array(pesos, dtype=float) / sum(pesos)
+    atraso = rng.choice(np.array(dias), size=n_linhas, p=pesos)
+    atraso[faixa_ia] = rng.integers(4, 6, int(faixa_ia.sum()))
+
+    descricao = np.char.add(np.char.add(np.array(DESCRICOES_B)[tipo], ' '), empresa).astype(object)
+    descricao[faixa_ia] = np.char.add(np.char.add(np.array(DESCRICOES_IA)[rng.integers(0, len(DESCRICOES_IA), int(faixa_ia.sum()))], ' '),
+                                      np.array(SUFIXOS)[rng.integers(0, len(SUFIXOS), int(faixa_ia.sum()))]).astype(object)
+    descricao = _ruido(descricao, ruido_descricao, rng)
+
+    df_protheus = pd.DataFrame({'Data': pd.to_datetime(datas), 'Historico': historico,
+                                'Valor': valores, 'Natureza': natureza})
+
+    com_par = ~sem_par
+    valor_banco = np.where(natureza == 'D', -valores, valores)
+    df_banco = pd.DataFrame({
+        'Data': pd.to_datetime(datas[com_par] + atraso[com_par].astype('timedelta64[D]')),
+        'Descricao': descricao[com_par],
+        'Valor': valor_banco[com_par],
+    })
+    # Lançamentos só do banco (tarifas, estornos)
+    n_extra = int(sem_par.sum())
+    extras = pd.DataFrame({
+        'Data': pd.to_datetime(np.datetime64(data_base.date()) + rng.integers(0, dias_periodo, n_extra).astype('timedelta64[D]')),
+        'Descricao': np.array(['TARIFA CESTA SERVICOS', 'IOF', 'ESTORNO TED'], dtype=object)[rng.integers(0, 3, n_extra)],
+        'Valor': -np.round(rng.uniform(1, 500, n_extra), 2),
+    })
+    df_banco = pd.concat([df_banco, extras], ignore_index=True)
+    df_banco = df_banco.sample(frac=1, random_state=seed).sort_values('Data', kind='stable').reset_index(drop=True)
+    return df_protheus, df_banco
+
+
+def salvar_cenario(df_protheus: pd.DataFrame, df_banco: pd.DataFrame, pasta: str = PASTA_SAIDA,
+                   formatos: Iterable[str] = ('xlsx',)) -> Dict[str, Tuple[str, str]]:
+    """Grava sistema_protheus.<ext> e extrato_banco.<ext> em cada formato pedido."""
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = {}
+    for formato in formatos:
+        if formato not in FORMATOS:
+            raise ValueError(f"Formato não suportado: '{formato}'. Suportados: {FORMATOS}")
+        caminho_p = os.path.join(pasta, f'sistema_protheus.{formato}')
+        caminho_b = os.path.join(pasta, f'extrato_banco.{formato}')
+        for df, caminho in [(df_protheus, caminho_p), (df_banco, caminho_b)]:
+            if formato == 'xlsx':
+                df.to_excel(caminho, index=False)
+            elif formato == 'csv':
+                df.to_csv(caminho, index=False)
+            else:
+                df.to_parquet(caminho, index=False)
+        caminhos[formato] = (caminho_p, caminho_b)
+    return caminhos
+
+
+def _ler_deslocamentos(texto: str) -> Dict[int, float]:
+    return {int(d): float(p) for d, p in (item.split(':') for item in texto.split(','))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera arquivos de entrada para o conciliador")
+    parser.add_argument('--linhas', type=int, default=None, help="Linhas no Protheus (sem isto: cenário de demonstração)")
+    parser.add_argument('--formatos', nargs='+', default=['xlsx'], choices=FORMATOS)
+    parser.add_argument('--duplicatas', type=float, default=0.05)
+    parser.add_argument('--deslocamentos', type=_ler_deslocamentos, default=DESLOCAMENTOS_PADRAO,
+                        help="Distribuição do atraso no banco, ex.: 0:0.6,1:0.2,2:0.1,3:0.1")
+    parser.add_argument('--ruido', type=float, default=0.1)
+    parser.add_argument('--faixa-ia', type=float, default=0.05)
+    parser.add_argument('--sem-par', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pasta', default=PASTA_SAIDA)
+    args = parser.parse_args()
+
+    print("Gerando arquivos de cenário...")
+    if args.linhas is None:
+        df_protheus, df_banco = cenario_demonstracao()
+    else:
+        df_protheus, df_banco = gerar_cenario_sintetico(args.linhas, args.duplicatas, args.deslocamentos, args.ruido,
+                                                        args.faixa_ia, args.sem_par, seed=args.seed)
+    salvar_cenario(df_protheus, df_banco, args.pasta, args.formatos)
+    if args.linhas is None:
+        print("✅ Arquivos atualizados com Cenário de IA!")
+    else:
+        print(f"✅ {len(df_protheus)} linhas Protheus / {len(df_banco)} linhas Banco em {args.pasta} ({', '.join(args.formatos)})")
@@ -0,0 +1,237 @@
+"""
+Jobs de conciliação em segundo plano para o app.py.
+
+Cada job roda em um processo próprio (spawn: logger, cliente IA e conexões
+isolados, como no executor de lotes) e tem uma pasta só sua em data/jobs/<id>/
+com entrada, saída, logs e intermediários, então vários analistas podem
+conciliar ao mesmo tempo sem sobrescrever os arquivos uns dos outros.
+
+O estado (status, progresso por etapa, resumo, erro) fica em um SQLite local
+(data/jobs.sqlite): a tela só consulta esse registro, e quem recarregar a
+página ou voltar depois reconecta ao job pelo id.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import traceback
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PASTA_JOBS = 'data/jobs'
+CAMINHO_REGISTRO = 'data/jobs.sqlite'
+MAX_JOBS_SIMULTANEOS = 2
+INTERVALO_PROGRESSO_S = 0.5  # Gravação mínima entre atualizações de progresso da IA
+
+STATUS_NA_FILA = 'na_fila'
+STATUS_EXECUTANDO = 'executando'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_ERRO = 'erro'
+STATUS_INTERROMPIDO = 'interrompido'
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO, STATUS_INTERROMPIDO)
+
+ABAS_RESULTADO = ['Conciliados', 'Pendencia Protheus', 'Pendencia Banco']
+
+
+def _conectar(caminho: str) -> sqlite3.Connection:
+    # Conexão curta por operação: o registro é lido e escrito por vários processos
+    conn = sqlite3.connect(caminho, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _atualizar(caminho: str, id_job: str, **campos):
+    colunas = ', '.join(f"{c} = ?" for c in campos)
+    valores = [json.dumps(v, ensure_ascii=False) if isinstance(v, dict) else v for v in campos.values()]
+    with _conectar(caminho) as conn:
+        conn.execute(f"UPDATE jobs SET {colunas} WHERE id = ?", valores + [id_job])
+    conn.close()
+
+
+class _ProgressoJob:
+    """Acumula os eventos do pipeline (etapas e consultas à IA) e grava no registro."""
+
+    def __init__(self, caminho_registro: str, id_job: str):
+        self.caminho_registro = caminho_registro
+        self.id_job = id_job
+        self.estado = {'etapa': None, 'etapas_concluidas': [], 'conciliados': 0,
+                       'consultas_concluidas': 0, 'consultas_total': 0}
+        self._gravado_em = 0.0
+
+    def __call__(self, evento: Dict):
+        tipo = evento['evento']
+        if tipo == 'inicio':
+            self.estado['etapa'] = evento['etapa']
+        elif tipo == 'fim':
+            self.estado['etapas_concluidas'].append(evento['etapa'])
+            self.estado['conciliados'] += evento.get('conciliados', 0)
+            if evento['etapa'] == 'carregamento':
+                self.estado['linhas_protheus'] = evento.get('linhas_protheus')
+                self.estado['linhas_banco'] = evento.get('linhas_banco')
+        elif tipo == 'consultas_ia':
+            self.estado['consultas_concluidas'] = evento['consultas_concluidas']
+            self.estado['consultas_total'] = evento['consultas_total']
+            # Respostas da IA chegam às centenas: grava no máximo a cada INTERVALO_PROGRESSO_S
+            terminou = evento['consultas_concluidas'] == evento['consultas_total']
+            if not terminou and time.monotonic() - self._gravado_em < INTERVALO_PROGRESSO_S:
+                return
+        self._gravado_em = time.monotonic()
+        _atualizar(self.caminho_registro, self.id_job, progresso=self.estado)
+
+
+def _executar_job(caminho_registro: str, id_job: str, pasta: str, caminho_protheus: str, caminho_banco: str):
+    """Corpo do processo do job: roda o pipeline na pasta do job e registra o desfecho."""
+    import conciliador_enterprise_v2 as conciliador
+
+    _atualizar(caminho_registro, id_job, status=STATUS_EXECUTANDO, iniciado_em=time.time(), pid=os.getpid())
+    progresso = _ProgressoJob(caminho_registro, id_job)
+    try:
+        resultado = conciliador.pipeline_enterprise(
+            caminho_protheus=caminho_protheus,
+            caminho_banco=caminho_banco,
+            pasta_saida=os.path.join(pasta, 'output'),
+            pasta_logs=os.path.join(pasta, 'logs'),
+            pasta_intermediaria=os.path.join(pasta, 'intermediario'),
+            ao_progresso=progresso,
+            formatos_auxiliares=['parquet'],  # A tela carrega as abas do Parquet, sem reler o Excel
+        )
+        if resultado is None:
+            _atualizar(caminho_registro, id_job, status=STATUS_ERRO, concluido_em=time.time(),
+                       erro="Falha no carregamento dos arquivos (ver log do job).")
+            return
+        _atualizar(caminho_registro, id_job, status=STATUS_CONCLUIDO, concluido_em=time.time(),
+                   resumo=resultado.resumo, progresso=progresso.estado)
+    except Exception as e:
+        traceback.print_exc()
+        _atualizar(caminho_registro, id_job, status=STATUS_ERRO, concluido_em=time.time(),
+                   erro=f"{type(e).__name__}: {e}")
+
+
+class GerenciadorJobs:
+    """
+    Fila de conciliações em segundo plano (até `max_simultaneos` processos).
+
+    Um gerenciador por processo do servidor (ver obter_gerenciador). Ao subir,
+    jobs deixados 'na_fila'/'executando' por um servidor anterior são marcados
+    como 'interrompido' (o processo que os executava não existe mais); por isso
+    o registro assume um único servidor por pasta de dados.
+    """
+
+    def __init__(self, caminho_registro: str = CAMINHO_REGISTRO, pasta_jobs: str = PASTA_JOBS,
+                 max_simultaneos: int = MAX_JOBS_SIMULTANEOS):
+        self.caminho_registro = caminho_registro
+        self.pasta_jobs = pasta_jobs
+        self.max_simultaneos = max_simultaneos
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(caminho_registro) or '.', exist_ok=True)
+        os.makedirs(pasta_jobs, exist_ok=True)
+        with _conectar(caminho_registro) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    pasta TEXT NOT NULL,
+                    descricao TEXT,
+                    pid INTEGER,
+                    criado_em REAL NOT NULL,
+                    iniciado_em REAL,
+                    concluido_em REAL,
+                    progresso TEXT NOT NULL DEFAULT '{}',
+                    resumo TEXT,
+                    erro TEXT
+                )
+            """)
+            conn.execute(
+                "UPDATE jobs SET status = ?, erro = ? WHERE status IN (?, ?)",
+                (STATUS_INTERROMPIDO, "Servidor reiniciado durante a execução.", STATUS_NA_FILA, STATUS_EXECUTANDO)
+            )
+        conn.close()
+
+    def _obter_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                ctx = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=max(1, self.max_simultaneos), mp_context=ctx)
+            return self._pool
+
+    def submeter(self, conteudo_protheus: bytes, conteudo_banco: bytes,
+                 nome_protheus: str = 'sistema_protheus.xlsx', nome_banco: str = 'extrato_banco.xlsx',
+                 descricao: str = '') -> str:
+        """Grava os arquivos na pasta de entrada do job, enfileira a execução e devolve o id."""
+        id_job = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        pasta = os.path.join(self.pasta_jobs, id_job)
+        pasta_entrada = os.path.join(pasta, 'input')
+        os.makedirs(pasta_entrada, exist_ok=True)
+        caminho_p = os.path.join(pasta_entrada, os.path.basename(nome_protheus))
+        caminho_b = os.path.join(pasta_entrada, os.path.basename(nome_banco))
+        with open(caminho_p, 'wb') as f:
+            f.write(conteudo_protheus)
+        with open(caminho_b, 'wb') as f:
+            f.write(conteudo_banco)
+
+        with _conectar(self.caminho_registro) as conn:
+            conn.execute("INSERT INTO jobs (id, status, pasta, descricao, criado_em) VALUES (?, ?, ?, ?, ?)",
+                         (id_job, STATUS_NA_FILA, pasta, descricao, time.time()))
+        conn.close()
+
+        futuro = self._obter_pool().submit(_executar_job, self.caminho_registro, id_job, pasta, caminho_p, caminho_b)
+        futuro.add_done_callback(lambda f: self._ao_terminar(id_job, f))
+        logger.info(f"Job {id_job} enfileirado ({descricao or 'sem descrição'}).")
+        return id_job
+
+    def _ao_terminar(self, id_job: str, futuro):
+        # O processo do job registra o próprio desfecho; aqui só sobra o caso de ele morrer antes
+        erro = futuro.exception()
+        if erro is not None and self.status(id_job)['status'] not in STATUS_FINAIS:
+            _atualizar(self.caminho_registro, id_job, status=STATUS_ERRO, concluido_em=time.time(),
+                       erro=f"Processo do job encerrado: {type(erro).__name__}: {erro}")
+
+    @staticmethod
+    def _linha_para_dict(linha: sqlite3.Row) -> Dict:
+        job = dict(linha)
+        job['progresso'] = json.loads(job['progresso'] or '{}')
+        job['resumo'] = json.loads(job['resumo']) if job['resumo'] else None
+        return job
+
+    def status(self, id_job: str) -> Optional[Dict]:
+        with _conectar(self.caminho_registro) as conn:
+            conn.row_factory = sqlite3.Row
+            linha = conn.execute("SELECT * FROM jobs WHERE id = ?", (id_job,)).fetchone()
+        conn.close()
+        return self._linha_para_dict(linha) if linha else None
+
+    def listar(self, limite: int = 20) -> List[Dict]:
+        """Jobs mais recentes primeiro."""
+        with _conectar(self.caminho_registro) as conn:
+            conn.row_factory = sqlite3.Row
+            linhas = conn.execute("SELECT * FROM jobs ORDER BY criado_em DESC LIMIT ?", (limite,)).fetchall()
+        conn.close()
+        return [self._linha_para_dict(l) for l in linhas]
+
+    def carregar_abas(self, id_job: str) -> Dict[str, pd.DataFrame]:
+        """Abas do relatório de um job concluído (saídas Parquet gravadas junto com o Excel)."""
+        caminhos = self.status(id_job)['resumo']['saidas_auxiliares']['parquet']
+        return {aba: pd.read_parquet(caminhos[aba]) for aba in ABAS_RESULTADO}
+
+
+_gerenciador: Optional[GerenciadorJobs] = None
+_lock_gerenciador = threading.Lock()
+
+
+def obter_gerenciador() -> GerenciadorJobs:
+    """Gerenciador compartilhado pelo processo do servidor (todas as sessões do Streamlit)."""
+    global _gerenciador
+    with _lock_gerenciador:
+        if _gerenciador is None:
+            _gerenciador = GerenciadorJobs()
+        return _gerenciador
@@ -0,0 +1,125 @@
+import sqlite3
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+
+from carregadores import SUFIXO_REF
+
+logger = logging.getLogger(__name__)
+
+COLUNA_TEXTO = {'Protheus': 'Historico', 'Banco': 'Descricao'}
+STATUS_ABERTO = 'aberto'
+STATUS_CONCILIADO = 'conciliado'
+
+
+def refs_estaveis(df: pd.DataFrame, origem: str) -> np.ndarray:
+    """
+    Ref. Auditoria a partir do conteúdo da linha (Data, valor, texto), e não da
+    posição no arquivo: o mesmo lançamento recebe a mesma ref em todas as
+    execuções. Lançamentos idênticos são diferenciados pela ordem de ocorrência.
+    """
+    texto = df[COLUNA_TEXTO[origem]].astype(str)
+    conteudo = pd.DataFrame({
+        'data': df['Data'].values.astype('datetime64[ns]').astype(np.int64),
+        'valor': df['Valor_Centavos'].values,
+        'texto': texto.values,
+    })
+    conteudo['ocorrencia'] = conteudo.groupby(['data', 'valor', 'texto']).cumcount().values
+    hashes = pd.util.hash_pandas_object(conteudo, index=False).values
+    sufixo = SUFIXO_REF[origem]
+    return np.array([f"{h:016x}{sufixo}" for h in hashes.tolist()], dtype=object)
+
+
+class LivroConciliacao:
+    """
+    Livro persistente (SQLite) da conciliação incremental.
+
+    Guarda cada lançamento já visto pela sua ref estável, com status 'aberto'
+    ou 'conciliado'. A cada execução só entram no matching as linhas novas do
+    arquivo e os itens ainda abertos, então o custo acompanha o delta do dia e
+    não o mês inteiro.
+    """
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS lancamentos (
+                ref TEXT PRIMARY KEY,
+                origem TEXT NOT NULL,
+                status TEXT NOT NULL,
+                data INTEGER NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                texto TEXT NOT NULL,
+                metodo TEXT,
+                ref_par TEXT,
+                execucao TEXT NOT NULL,
+                atualizado_em REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_origem_status ON lancamentos (origem, status)")
+        self._conn.commit()
+
+    def _refs(self, origem: str) -> pd.Index:
+        with self._lock:
+            linhas = self._conn.execute("SELECT ref FROM lancamentos WHERE origem = ?", (origem,)).fetchall()
+        return pd.Index([l[0] for l in linhas])
+
+    def abertos(self, origem: str) -> pd.DataFrame:
+        """Itens ainda em aberto, no layout do extrato saneado."""
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT data, texto, valor_centavos, ref FROM lancamentos WHERE origem = ? AND status = ? ORDER BY rowid",
+                (origem, STATUS_ABERTO)
+            ).fetchall()
+        df = pd.DataFrame(linhas, columns=['Data', COLUNA_TEXTO[origem], 'Valor_Centavos', 'Ref. Auditoria'])
+        df['Data'] = pd.to_datetime(df['Data'].astype(np.int64), unit='ns')
+        df['Valor_Centavos'] = df['Valor_Centavos'].astype(np.int64)
+        return df
+
+    def separar_delta(self, df: pd.DataFrame, origem: str) -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """
+        Troca a Ref. Auditoria pela ref estável, descarta as linhas já registradas
+        em execuções anteriores e junta as novas aos itens abertos do livro.
+        """
+        df = df.assign(**{'Ref. Auditoria': refs_estaveis(df, origem)})
+        novos = df[~df['Ref. Auditoria'].isin(self._refs(origem))]
+        abertos = self.abertos(origem)
+        colunas = ['Data', COLUNA_TEXTO[origem], 'Valor_Centavos', 'Ref. Auditoria']
+        trabalho = pd.concat([abertos, novos[colunas]], ignore_index=True)
+        stats = {'linhas_arquivo': len(df), 'novas': len(novos), 'abertas_anteriores': len(abertos)}
+        return trabalho, stats
+
+    def registrar_execucao(self, execucao: str, df: pd.DataFrame, origem: str,
+                           refs_conciliadas, refs_par, metodos):
+        """Grava o estado final das linhas processadas: conciliadas (com par e método) ou ainda abertas."""
+        par = pd.DataFrame({'ref_par': list(refs_par), 'metodo': list(metodos)}, index=pd.Index(list(refs_conciliadas)))
+        estado = df[['Ref. Auditoria', 'Data', COLUNA_TEXTO[origem], 'Valor_Centavos']].join(par, on='Ref. Auditoria')
+        status = np.where(estado['ref_par'].notna(), STATUS_CONCILIADO, STATUS_ABERTO)
+        agora = time.time()
+        registros = list(zip(
+            estado['Ref. Auditoria'].tolist(), [origem] * len(estado), status.tolist(),
+            estado['Data'].values.astype('datetime64[ns]').astype(np.int64).tolist(),
+            estado['Valor_Centavos'].astype(np.int64).tolist(), estado[COLUNA_TEXTO[origem]].astype(str).tolist(),
+            estado['metodo'].where(estado['metodo'].notna(), None).tolist(),
+            estado['ref_par'].where(estado['ref_par'].notna(), None).tolist(),
+            [execucao] * len(estado), [agora] * len(estado),
+        ))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lancamentos (ref, origem, status, data, valor_centavos, texto, metodo, ref_par, execucao, atualizado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", registros
+            )
+            self._conn.commit()
+
+    def estatisticas(self) -> Dict[str, int]:
+        with self._lock:
+            linhas = self._conn.execute("SELECT origem, status, COUNT(*) FROM lancamentos GROUP BY origem, status").fetchall()
+        return {f"{origem}_{status}": total for origem, status, total in linhas}
@@ -0,0 +1,152 @@
+"""
+Métricas estruturadas de uma execução do pipeline.
+
+Cada etapa registra tempo de parede, tempo de CPU, pico de memória (RSS) e as
+contagens de linhas que entraram e saíram; a etapa de IA acrescenta chamadas,
+latências (p50/p95), cache e rejeições. Tudo é gravado em JSON ao lado do log
+da execução (logs/log_execucao_..._metricas.json) e exibido no app.py.
+"""
+import os
+import json
+import time
+import logging
+import numpy as np
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource  # Indisponível no Windows
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def zerar_pico_memoria() -> bool:
+    """Zera o VmHWM do processo (Linux), para que o pico seguinte seja só da etapa."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def pico_memoria_mb() -> Optional[float]:
+    """Pico de RSS do processo em MB (None se a plataforma não informar)."""
+    # ru_maxrss sobrevive ao exec do processo filho no Linux; VmHWM é zerado junto com o espaço de memória
+    try:
+        with open('/proc/self/status') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def percentis_ms(latencias: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/máximo de uma lista de latências em segundos, em milissegundos."""
+    if not latencias:
+        return {'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+    p50, p95 = np.percentile(latencias, [50, 95])
+    return {'p50_ms': round(p50 * 1000, 1), 'p95_ms': round(p95 * 1000, 1), 'max_ms': round(max(latencias) * 1000, 1)}
+
+
+class MetricasExecucao:
+    """
+    Cronômetro por etapa. Uso:
+
+        metricas.iniciar_etapa('match_exato', linhas_entrada=len(df_p) + len(df_b))
+        ...
+        metricas.concluir_etapa(linhas_saida=len(conciliados))
+
+    O pico de memória é o do processo principal durante a etapa (no Linux o
+    VmHWM é zerado no início de cada etapa; nas demais plataformas é o pico
+    acumulado do processo). Workers do matching particionado não entram na conta.
+
+    `ao_atualizar`, se informado, recebe um dicionário a cada início
+    ({'evento': 'inicio', 'etapa', 'linhas_entrada'}) e fim de etapa (o registro
+    completo da etapa, com 'evento': 'fim'); é o que alimenta o progresso dos jobs.
+    """
+
+    def __init__(self, execucao: str, conta: Optional[str] = None,
+                 ao_atualizar: Optional[Callable[[Dict], None]] = None):
+        self.execucao = execucao
+        self.conta = conta
+        self.ao_atualizar = ao_atualizar
+        self.etapas: List[Dict] = []
+        self.ia: Dict = {}
+        self.status = 'em_andamento'
+        self._inicio_execucao = time.perf_counter()
+        self._cpu_execucao = time.process_time()
+        self._etapa_atual: Optional[Dict] = None
+        self._pico_por_etapa = zerar_pico_memoria()
+
+    def iniciar_etapa(self, nome: str, linhas_entrada: Optional[int] = None):
+        if self._etapa_atual is not None:
+            self.concluir_etapa()
+        if self._pico_por_etapa:
+            zerar_pico_memoria()
+        self._etapa_atual = {
+            'etapa': nome,
+            'linhas_entrada': linhas_entrada,
+            '_inicio': time.perf_counter(),
+            '_cpu': time.process_time(),
+        }
+        if self.ao_atualizar is not None:
+            self.ao_atualizar({'evento': 'inicio', 'etapa': nome, 'linhas_entrada': linhas_entrada})
+
+    def concluir_etapa(self, linhas_saida: Optional[int] = None, **extras):
+        etapa = self._etapa_atual
+        if etapa is None:
+            return
+        self._etapa_atual = None
+        tempo = time.perf_counter() - etapa.pop('_inicio')
+        cpu = time.process_time() - etapa.pop('_cpu')
+        pico = pico_memoria_mb()
+        etapa.update({
+            'linhas_saida': linhas_saida,
+            'tempo_s': round(tempo, 3),
+            'cpu_s': round(cpu, 3),
+            'memoria_pico_mb': round(pico, 1) if pico is not None else None,
+        })
+        etapa.update(extras)
+        self.etapas.append(etapa)
+        if self.ao_atualizar is not None:
+            self.ao_atualizar(dict(etapa, evento='fim'))
+        logger.info(f"[Métricas] {etapa['etapa']}: {etapa['tempo_s']}s (CPU {etapa['cpu_s']}s, "
+                    f"pico {etapa['memoria_pico_mb']} MB), linhas {etapa['linhas_entrada']} -> {linhas_saida}")
+
+    def registrar_ia(self, **valores):
+        self.ia.update(valores)
+
+    def resumo(self) -> Dict:
+        return {
+            'execucao': self.execucao,
+            'conta': self.conta,
+            'status': self.status,
+            'gerado_em': datetime.now().isoformat(timespec='seconds'),
+            'tempo_total_s': round(time.perf_counter() - self._inicio_execucao, 3),
+            'cpu_total_s': round(time.process_time() - self._cpu_execucao, 3),
+            'memoria_pico_por_etapa': self._pico_por_etapa,
+            'etapas': self.etapas,
+            'ia': self.ia,
+        }
+
+    def salvar(self, caminho: str, status: str = 'ok') -> Dict:
+        """Fecha a etapa em aberto e grava o JSON. Devolve o conteúdo gravado."""
+        self.concluir_etapa()
+        self.status = status
+        dados = self.resumo()
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False, indent=2)
+        return dados
+
+
+def caminho_metricas(caminho_log: str) -> str:
+    """logs/log_execucao_X.txt -> logs/log_execucao_X_metricas.json"""
+    return f"{os.path.splitext(caminho_log)[0]}_metricas.json"
@@ -0,0 +1,295 @@
+import math
+import time
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+from motor_matching import montar_matches
+from carregadores import formatar_refs
+
+logger = logging.getLogger(__name__)
+
+# --- CONSTANTES ---
+METODO_AGRUPADO_PROTHEUS = "Agrupamento N:1"  # Vários títulos do Protheus quitados por um lançamento do Banco
+METODO_AGRUPADO_BANCO = "Agrupamento 1:N"     # Um título do Protheus pago em vários lançamentos do Banco
+MOTIVO_REVISAO_AGRUPAMENTO = ("Revisão Humana: soma exata com um grupo de lançamentos do outro extrato, mas com "
+                              "combinações demais na janela para conciliar sem conferência.")
+MAX_CANDIDATOS_JANELA = 200  # Grupos de 3+ itens: acima disto, só os candidatos mais próximos da data do alvo entram
+ACASO_EXECUCAO = 1.0  # Máximo de grupos conciliados por pura coincidência esperados na execução (ver match_agrupado)
+LIMITE_ACASO_REVISAO = 0.1  # Máximo de grupos esperados por coincidência numa janela para o grupo ir à Revisão Humana
+FAIXA_DENSIDADE = 0.01  # Faixa (fração do alvo) em que se mede a densidade de somas ao redor do alvo
+CONTADORES_JANELA = ['janelas', 'janelas_estouradas', 'janelas_truncadas', 'janelas_ambiguas']
+
+
+def _dias(serie: pd.Series) -> np.ndarray:
+    return serie.values.astype('datetime64[D]').astype(np.int64)
+
+
+def _combinacoes(valores: np.ndarray, tamanho: int, limite: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Todas as combinações de `tamanho` índices crescentes de `valores` (ordenados,
+    positivos) com soma <= limite, como matriz (m, tamanho) + vetor de somas.
+
+    Cada nível estende as combinações do anterior só com índices posteriores ao
+    último e cujo valor ainda cabe no limite (um searchsorted por combinação):
+    somas que estouram o alvo nunca são geradas.
+    """
+    n = int(np.searchsorted(valores, limite, side='right'))
+    indices = np.arange(n, dtype=np.int64)[:, None]
+    somas = valores[:n].copy()
+    for _ in range(tamanho - 1):
+        inicio = indices[:, -1] + 1
+        fim = np.searchsorted(valores, limite - somas, side='right')
+        qtd = np.maximum(fim - inicio, 0)
+        total = int(qtd.sum())
+        origem = np.repeat(np.arange(len(indices)), qtd)
+        novos = np.repeat(inicio, qtd) + (np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(qtd) - qtd, qtd))
+        indices = np.column_stack([indices[origem], novos])
+        somas = somas[origem] + valores[novos]
+    return indices, somas
+
+
+def buscar_subconjunto(valores: np.ndarray, distancias: np.ndarray, alvo: int, tamanho: int,
+                       prazo: float, limite_acaso: float = LIMITE_ACASO_REVISAO
+                       ) -> Tuple[Optional[np.ndarray], int, float, bool, bool]:
+    """
+    Grupo de exatamente `tamanho` itens de `valores` cuja soma é `alvo`, em
+    centavos inteiros. `valores` é positivo e menor que o alvo.
+
+    Meet-in-the-middle: o grupo (índices crescentes, valores ordenados) é
+    dividido em metade esquerda (tamanho // 2 primeiros) e direita (restantes);
+    as somas de cada metade são enumeradas uma vez (ver _combinacoes) e casadas
+    por busca binária em alvo - soma_esquerda, exigindo que a esquerda termine
+    antes da direita começar (cada grupo aparece uma vez só).
+
+    Somas exatas também saem por coincidência quando há muitas combinações
+    perto do alvo (milhares de candidatos na janela, alvos altos). Por isso
+    conta-se quantos grupos somam dentro de ±FAIXA_DENSIDADE do alvo; dividido
+    pela largura da faixa, é o número esperado de grupos que acertariam o
+    centavo por acaso, devolvido com o grupo. Acima de `limite_acaso` a busca
+    volta vazia marcada como ambígua: a soma exata ali não é evidência de nada.
+
+    Quando mais de um grupo soma exatamente o alvo, vence o de menor soma de
+    dias até o alvo; se o empate persistir, não há como escolher e a busca
+    também volta ambígua.
+
+    Retorna (índices do grupo ou None, soma de dias do grupo, grupos esperados
+    por acaso, se o prazo (perf_counter) estourou, se a busca foi ambígua).
+    """
+    ordem = np.argsort(valores, kind='stable')
+    valores = valores[ordem]
+    # Poda: nem os maiores alcançam o alvo, ou os menores já passam
+    if len(valores) < tamanho or valores[-tamanho:].sum() < alvo or valores[:tamanho].sum() > alvo:
+        return None, 0, 0.0, False, False
+    if time.perf_counter() > prazo:
+        return None, 0, 0.0, True, False
+
+    tam_esq, tam_dir = tamanho // 2, tamanho - tamanho // 2
+    esq, somas_esq = _combinacoes(valores, tam_esq, alvo)
+    dir_, somas_dir = (esq, somas_esq) if tam_dir == tam_esq else _combinacoes(valores, tam_dir, alvo)
+    if not len(esq) or not len(dir_):
+        return None, 0, 0.0, False, False
+
+    ordem_dir = np.argsort(somas_dir, kind='stable')
+    somas_dir_ord = somas_dir[ordem_dir]
+    # Cada grupo aparece C(tamanho, tam_esq) vezes entre os pares (esquerda, direita) sem a restrição de ordem
+    banda = max(int(alvo * FAIXA_DENSIDADE), 1)
+    na_banda = (np.searchsorted(somas_dir_ord, alvo + banda - somas_esq, side='right')
+                - np.searchsorted(somas_dir_ord, alvo - banda - somas_esq, side='left')).sum()
+    acaso = float(na_banda / math.comb(tamanho, tam_esq) / (2 * banda + 1))
+    if acaso > limite_acaso:
+        return None, 0, acaso, False, True
+    lo = np.searchsorted(somas_dir_ord, alvo - somas_esq, side='left')
+    hi = np.searchsorted(somas_dir_ord, alvo - somas_esq, side='right')
+    qtd = hi - lo
+    total = int(qtd.sum())
+    if total == 0:
+        return None, 0, acaso, False, False
+    i_esq = np.repeat(np.arange(len(esq)), qtd)
+    i_dir = ordem_dir[np.repeat(lo, qtd) + (np.arange(total) - np.repeat(np.cumsum(qtd) - qtd, qtd))]
+    validos = esq[i_esq, -1] < dir_[i_dir, 0]
+    if not validos.any():
+        return None, 0, acaso, False, False
+    grupos = np.column_stack([esq[i_esq[validos]], dir_[i_dir[validos]]])
+    custo = distancias[ordem][grupos].sum(axis=1)
+    melhor = int(np.argmin(custo))
+    if (custo == custo[melhor]).sum() > 1:
+        return None, 0, acaso, False, True
+    return ordem[grupos[melhor]], int(custo[melhor]), acaso, False, False
+
+
+def _preparar_direcao(valor_alvo: np.ndarray, dia_alvo: np.ndarray, livres_alvo: np.ndarray,
+                      valor_item: np.ndarray, dia_item: np.ndarray, livres_item: np.ndarray,
+                      janela_dias: int) -> Dict:
+    """Alvos de um lado e itens do outro, com a janela de datas de cada alvo pré-calculada."""
+    ordem_item = np.argsort(dia_item, kind='stable')
+    dia_item_ord = dia_item[ordem_item]
+    lo = np.searchsorted(dia_item_ord, dia_alvo - janela_dias, side='left')
+    hi = np.searchsorted(dia_item_ord, dia_alvo + janela_dias, side='right')
+    n = len(valor_alvo)
+    return {'valor_alvo': valor_alvo, 'dia_alvo': dia_alvo, 'livres_alvo': livres_alvo,
+            'valor_item': valor_item, 'dia_item': dia_item, 'livres_item': livres_item,
+            'ordem_item': ordem_item, 'lo': lo, 'hi': hi, 'grupos': [],
+            'buscada': np.zeros(n, dtype=bool), 'truncada': np.zeros(n, dtype=bool),
+            'ambigua': np.zeros(n, dtype=bool), 'estourada': np.zeros(n, dtype=bool),
+            'gasto_s': np.zeros(n, dtype=np.float64)}
+
+
+def _candidatos(direcao: Dict, alvos: np.ndarray, tamanho: int, orcamento_s: float,
+                limite_acaso: float) -> List[Tuple[int, int, np.ndarray, float]]:
+    """
+    Para cada alvo de `alvos`, o grupo de `tamanho` itens livres do outro lado,
+    do mesmo sinal e dentro da janela, que soma o valor do alvo (ver
+    buscar_subconjunto), como (soma de dias, alvo, itens, acaso). O orçamento de cada
+    janela vale para todos os tamanhos: a que estoura não é mais buscada.
+    """
+    valor_item, livres_item = direcao['valor_item'], direcao['livres_item']
+    candidatos = []
+    for a in alvos.tolist():
+        alvo = int(direcao['valor_alvo'][a])
+        janela = direcao['ordem_item'][direcao['lo'][a]:direcao['hi'][a]]
+        # Poda por sinal e por valor: só itens livres, do mesmo sinal e menores que o alvo em módulo
+        valores = valor_item[janela] * np.sign(alvo)
+        janela = janela[livres_item[janela] & (valores > 0) & (valores < abs(alvo))]
+        if len(janela) < tamanho:
+            continue
+        distancias = np.abs(direcao['dia_item'][janela] - direcao['dia_alvo'][a])
+        if tamanho > 2 and len(janela) > MAX_CANDIDATOS_JANELA:
+            direcao['truncada'][a] = True
+            proximos = np.sort(np.argsort(distancias, kind='stable')[:MAX_CANDIDATOS_JANELA])
+            janela, distancias = janela[proximos], distancias[proximos]
+
+        direcao['buscada'][a] = True
+        inicio = time.perf_counter()
+        grupo, custo, acaso, estourou, ambigua = buscar_subconjunto(np.abs(valor_item[janela]), distancias, abs(alvo),
+                                                                    tamanho, inicio + orcamento_s - direcao['gasto_s'][a],
+                                                                    limite_acaso)
+        direcao['gasto_s'][a] += time.perf_counter() - inicio
+        direcao['estourada'][a] |= estourou
+        direcao['ambigua'][a] |= ambigua
+        if grupo is not None:
+            candidatos.append((custo, a, np.sort(janela[grupo]), acaso))
+    return candidatos
+
+
+def match_agrupado(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, janela_dias: int, max_itens: int,
+                   orcamento_s: float, acaso_execucao: float = ACASO_EXECUCAO,
+                   limite_revisao: float = LIMITE_ACASO_REVISAO) -> Tuple[pd.DataFrame, pd.DataFrame, Dict]:
+    """
+    Pagamentos divididos ou agregados: um lançamento de um lado casado com um
+    grupo de 2 a `max_itens` lançamentos do outro cuja soma, em centavos, é
+    exatamente igual, todos a até `janela_dias` dias dele.
+
+    Cada linha do Banco procura um grupo de títulos do Protheus
+    (METODO_AGRUPADO_PROTHEUS, ex.: um débito que quita várias notas) e cada
+    linha do Protheus procura um grupo de lançamentos do Banco
+    (METODO_AGRUPADO_BANCO, ex.: parcelas). A busca vai por tamanho de grupo,
+    do menor para o maior (somas exatas de poucos itens raramente são
+    coincidência); dentro de um tamanho, os grupos de menor soma de dias até o
+    alvo ficam com os itens e os alvos que perderam algum item buscam de novo
+    entre os que restaram. A busca de cada janela tem `orcamento_s` segundos
+    no total; janelas que estouram ficam sem grupo e são contadas nas
+    estatísticas, assim como as janelas ambíguas (ver buscar_subconjunto).
+
+    Cada busca (alvo x tamanho) pode achar um grupo por coincidência, e são
+    milhares de buscas: para que a execução inteira concilie no máximo
+    `acaso_execucao` grupos falsos esperados, um grupo só é conciliado se a
+    sua janela tem até acaso_execucao / buscas grupos esperados por acaso. Os
+    de janelas mais densas (até `limite_revisao`) não são conciliados: seus
+    itens e o alvo ficam pendentes, para Revisão Humana, e não entram em
+    outro grupo.
+
+    Retorna os matches no layout de 'Conciliados' + pos_p/pos_b (uma linha por
+    item do grupo, com o valor do item), os grupos para revisão (pos_p, pos_b,
+    uma linha por item) e as estatísticas da etapa.
+    """
+    colunas_vazias = montar_matches(sobra_p, sobra_b, np.empty(0, np.int64), np.empty(0, np.int64), [], [])
+    revisao_vazia = pd.DataFrame({'pos_p': np.empty(0, np.int64), 'pos_b': np.empty(0, np.int64)})
+    stats = dict({chave: 0 for chave in CONTADORES_JANELA}, tempo_max_janela_ms=0.0, grupos=0,
+                 linhas_protheus=0, linhas_banco=0, grupos_revisao=0, linhas_revisao=0)
+    if max_itens < 2 or sobra_p.empty or sobra_b.empty:
+        return colunas_vazias, revisao_vazia, stats
+
+    valor_p, valor_b = sobra_p['Valor_Centavos'].values.astype(np.int64), sobra_b['Valor_Centavos'].values.astype(np.int64)
+    dia_p, dia_b = _dias(sobra_p['Data']), _dias(sobra_b['Data'])
+    livres_p = np.ones(len(sobra_p), dtype=bool)
+    livres_b = np.ones(len(sobra_b), dtype=bool)
+
+    direcoes = [_preparar_direcao(valor_b, dia_b, livres_b, valor_p, dia_p, livres_p, janela_dias),
+                _preparar_direcao(valor_p, dia_p, livres_p, valor_b, dia_b, livres_b, janela_dias)]
+    buscas = sum(int(((d['valor_alvo'] != 0) & (d['hi'] - d['lo'] >= 2)).sum()) for d in direcoes) * (max_itens - 1)
+    limite_acaso = acaso_execucao / max(buscas, 1)
+    for tamanho in range(2, max_itens + 1):
+        pendentes = [np.flatnonzero(d['livres_alvo'] & (d['valor_alvo'] != 0) & (d['hi'] - d['lo'] >= tamanho))
+                     for d in direcoes]
+        while any(len(p) for p in pendentes):
+            candidatos = []
+            for i, (direcao, alvos) in enumerate(zip(direcoes, pendentes)):
+                alvos = alvos[direcao['livres_alvo'][alvos] & ~direcao['estourada'][alvos]]
+                candidatos.extend((custo, i, a, itens, acaso) for custo, a, itens, acaso
+                                  in _candidatos(direcao, alvos, tamanho, orcamento_s, limite_revisao))
+            # Os grupos mais próximos do alvo ficam com os itens; quem perdeu algum item busca de novo
+            candidatos.sort(key=lambda c: (c[0], c[1], c[2]))
+            pendentes = [[], []]
+            for custo, i, a, itens, acaso in candidatos:
+                direcao = direcoes[i]
+                if not direcao['livres_alvo'][a]:
+                    continue
+                if direcao['livres_item'][itens].all():
+                    direcao['livres_alvo'][a] = False
+                    direcao['livres_item'][itens] = False
+                    direcao['grupos'].append((a, itens, acaso <= limite_acaso))
+                else:
+                    pendentes[i].append(a)
+            pendentes = [np.array(p, dtype=np.int64) for p in pendentes]
+
+    for direcao in direcoes:
+        direcao['grupos'].sort(key=lambda g: g[0])
+    grupos_n1 = [(a, itens) for a, itens, conciliar in direcoes[0]['grupos'] if conciliar]
+    grupos_1n = [(a, itens) for a, itens, conciliar in direcoes[1]['grupos'] if conciliar]
+    # Grupos de janelas densas: (pos_p, pos_b) de cada item, do alvo de cada direção
+    revisao = [(itens, np.full(len(itens), a)) for a, itens, conciliar in direcoes[0]['grupos'] if not conciliar]
+    revisao += [(np.full(len(itens), a), itens) for a, itens, conciliar in direcoes[1]['grupos'] if not conciliar]
+    stats['janelas'] = sum(int(d['buscada'].sum()) for d in direcoes)
+    stats['janelas_truncadas'] = sum(int(d['truncada'].sum()) for d in direcoes)
+    stats['janelas_ambiguas'] = sum(int(d['ambigua'].sum()) for d in direcoes)
+    stats['janelas_estouradas'] = sum(int(d['estourada'].sum()) for d in direcoes)
+    stats['tempo_max_janela_ms'] = round(max(float(d['gasto_s'].max(initial=0.0)) for d in direcoes) * 1000, 1)
+    if revisao:
+        revisao = pd.DataFrame({'pos_p': np.concatenate([p for p, _ in revisao]).astype(np.int64),
+                                'pos_b': np.concatenate([b for _, b in revisao]).astype(np.int64)})
+        stats['grupos_revisao'] = len(direcoes[0]['grupos']) + len(direcoes[1]['grupos']) - len(grupos_n1) - len(grupos_1n)
+        stats['linhas_revisao'] = revisao['pos_p'].nunique() + revisao['pos_b'].nunique()
+    else:
+        revisao = revisao_vazia
+
+    refs_p, refs_b = sobra_p['Ref. Auditoria'].values, sobra_b['Ref. Auditoria'].values
+    pos_p, pos_b, metodos, justificativas = [], [], [], []
+    for numero, (alvo, itens) in enumerate(grupos_n1, start=1):
+        dias = int(np.abs(dia_p[itens] - dia_b[alvo]).max())
+        pos_p.extend(itens.tolist())
+        pos_b.extend([alvo] * len(itens))
+        metodos.extend([METODO_AGRUPADO_PROTHEUS] * len(itens))
+        justificativas.extend([f"Grupo {numero}: {len(itens)} títulos do Protheus somam o lançamento "
+                               f"{formatar_refs(refs_b[[alvo]], 'Banco')[0]} do Banco (até {dias} dias de diferença)."] * len(itens))
+    for numero, (alvo, itens) in enumerate(grupos_1n, start=len(grupos_n1) + 1):
+        dias = int(np.abs(dia_b[itens] - dia_p[alvo]).max())
+        pos_p.extend([alvo] * len(itens))
+        pos_b.extend(itens.tolist())
+        metodos.extend([METODO_AGRUPADO_BANCO] * len(itens))
+        justificativas.extend([f"Grupo {numero}: título {formatar_refs(refs_p[[alvo]], 'Protheus')[0]} do Protheus pago em {len(itens)} "
+                               f"lançamentos do Banco (até {dias} dias de diferença)."] * len(itens))
+
+    stats['grupos'] = len(grupos_n1) + len(grupos_1n)
+    if not pos_p:
+        return colunas_vazias, revisao, stats
+
+    pos_p, pos_b = np.array(pos_p, dtype=np.int64), np.array(pos_b, dtype=np.int64)
+    stats['linhas_protheus'] = len(np.unique(pos_p))
+    stats['linhas_banco'] = len(np.unique(pos_b))
+    df_agrupado = montar_matches(sobra_p, sobra_b, pos_p, pos_b, metodos, justificativas)
+    # Cada linha leva o valor do seu item: a soma da aba continua batendo com os extratos
+    item_banco = np.array(metodos) == METODO_AGRUPADO_BANCO
+    df_agrupado['Valor_Centavos'] = np.where(item_banco, valor_b[pos_b], valor_p[pos_p])
+    return df_agrupado, revisao, stats
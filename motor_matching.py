@@ -0,0 +1,367 @@
+import heapq
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+# --- CONSTANTES ---
+DIA_NS = 86_400_000_000_000  # 1 dia em nanossegundos (resolução do datetime64[ns])
+
+MODO_GULOSO = 'guloso'
+MODO_OTIMO = 'otimo'
+MODOS_ATRIBUICAO = [MODO_GULOSO, MODO_OTIMO]
+
+COLUNAS_MATCH = ['Data_Protheus', 'Historico', 'Data_Banco', 'Descricao', 'Valor_Centavos', 'Metodo', 'Justificativa_Auditoria']
+
+
+def _datas_ns(serie: pd.Series) -> np.ndarray:
+    return serie.values.astype('datetime64[ns]').astype(np.int64)
+
+
+def gerar_pares_candidatos(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, janela_dias: int) -> pd.DataFrame:
+    """
+    Gera todos os pares (Protheus, Banco) com o mesmo valor e distância de
+    até `janela_dias` dias, sem iterar linha a linha.
+
+    O Banco é ordenado em blocos (valor, Data) e cada linha do Protheus
+    localiza sua janela por busca binária (searchsorted). O resultado vem
+    ordenado por (pos_p, pos_b), ou seja, na mesma ordem em que o loop antigo
+    visitava os candidatos.
+    """
+    vazio = pd.DataFrame({'pos_p': np.empty(0, np.int64), 'pos_b': np.empty(0, np.int64), 'dias': np.empty(0, np.int64)})
+    if sobra_p.empty or sobra_b.empty:
+        return vazio
+
+    n_p = len(sobra_p)
+    valores = pd.concat([sobra_p['Valor_Centavos'], sobra_b['Valor_Centavos']], ignore_index=True)
+    codigos, _ = pd.factorize(valores)
+    grupo_p = codigos[:n_p].astype(np.int64)
+    grupo_b = codigos[n_p:].astype(np.int64)
+
+    data_p = _datas_ns(sobra_p['Data'])
+    data_b = _datas_ns(sobra_b['Data'])
+    dia_p = data_p // DIA_NS
+    dia_b = data_b // DIA_NS
+
+    # Chave composta: grupo de valor * M + dia (com folga de 1 dia para o arredondamento do .days)
+    folga = janela_dias + 1
+    dia_min = min(dia_p.min(), dia_b.min())
+    span = max(dia_p.max(), dia_b.max()) - dia_min
+    m = span + 2 * folga + 1
+    chave_p = grupo_p * m + (dia_p - dia_min + folga)
+    chave_b = grupo_b * m + (dia_b - dia_min + folga)
+
+    # Ordenação estável: empates preservam a ordem original do Banco
+    ordem_b = np.argsort(chave_b, kind='stable')
+    chave_b_ord = chave_b[ordem_b]
+
+    lo = np.searchsorted(chave_b_ord, chave_p - folga, side='left')
+    hi = np.searchsorted(chave_b_ord, chave_p + folga, side='right')
+    qtd = hi - lo
+    total = int(qtd.sum())
+    if total == 0:
+        return vazio
+
+    pos_p = np.repeat(np.arange(n_p, dtype=np.int64), qtd)
+    deslocamento = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(qtd) - qtd, qtd)
+    pos_b = ordem_b[np.repeat(lo, qtd) + deslocamento]
+
+    # Mesma regra do Timedelta.days (arredonda para baixo) usada no loop original
+    dias = np.abs((data_p[pos_p] - data_b[pos_b]) // DIA_NS)
+    dentro = dias <= janela_dias
+    pos_p, pos_b, dias = pos_p[dentro], pos_b[dentro], dias[dentro]
+
+    ordem = np.lexsort((pos_b, pos_p))
+    return pd.DataFrame({'pos_p': pos_p[ordem], 'pos_b': pos_b[ordem], 'dias': dias[ordem]})
+
+
+def resolver_primeiro_match(pos_p: np.ndarray, pos_b: np.ndarray) -> np.ndarray:
+    """
+    Aplica a regra "primeiro candidato livre" (um-para-um) sobre pares já
+    ordenados por (pos_p, pos_b). Retorna a máscara dos pares aceitos.
+
+    Pares em que o Protheus e o Banco só aparecem uma vez são aceitos em lote;
+    apenas os grupos disputados passam pelo laço sequencial.
+    """
+    aceitos = np.zeros(len(pos_p), dtype=bool)
+    if len(pos_p) == 0:
+        return aceitos
+
+    n_por_p = np.bincount(pos_p)
+    n_por_b = np.bincount(pos_b)
+    unicos = (n_por_p[pos_p] == 1) & (n_por_b[pos_b] == 1)
+    aceitos[unicos] = True
+
+    disputados = np.flatnonzero(~unicos)
+    p_usados = set()
+    b_usados = set()
+    for i, p, b in zip(disputados.tolist(), pos_p[disputados].tolist(), pos_b[disputados].tolist()):
+        if p in p_usados or b in b_usados:
+            continue
+        aceitos[i] = True
+        p_usados.add(p)
+        b_usados.add(b)
+
+    return aceitos
+
+
+def _caminho_admissivel(grafo: list, potencial: list, origem: int, destino: int) -> Optional[List[Tuple[int, int]]]:
+    """Busca em profundidade por um caminho só com arestas de custo reduzido zero e capacidade livre."""
+    visitados = {origem}
+    pilha = [(origem, 0)]
+    caminho = []
+    while pilha:
+        u, k = pilha[-1]
+        if u == destino:
+            return caminho
+        arestas = grafo[u]
+        while k < len(arestas):
+            v, cap, custo, _ = arestas[k]
+            if cap > 0 and v not in visitados and custo + potencial[u] - potencial[v] == 0:
+                break
+            k += 1
+        if k == len(arestas):
+            pilha.pop()
+            if caminho:
+                caminho.pop()
+            continue
+        pilha[-1] = (u, k + 1)
+        visitados.add(arestas[k][0])
+        caminho.append((u, k))
+        pilha.append((arestas[k][0], 0))
+    return None
+
+
+def _fluxo_custo_minimo(dias_p: np.ndarray, qtd_p: np.ndarray, dias_b: np.ndarray, qtd_b: np.ndarray,
+                        tolerancia_dias: int) -> List[Tuple[int, int, int]]:
+    """
+    Fluxo máximo de custo mínimo entre "baldes" de dias (Protheus -> Banco),
+    com custo |dias| e arestas apenas dentro da tolerância.
+
+    Como um grupo de valor tem poucos dias distintos por lado (~um mês),
+    o grafo fica pequeno mesmo quando o grupo tem milhares de linhas.
+    Retorna a lista (balde_p, balde_b, quantidade).
+    """
+    n_p, n_b = len(dias_p), len(dias_b)
+    origem, destino = n_p + n_b, n_p + n_b + 1
+    grafo = [[] for _ in range(n_p + n_b + 2)]  # aresta: [para, capacidade, custo, índice_da_reversa]
+
+    def adicionar(u, v, cap, custo):
+        grafo[u].append([v, cap, custo, len(grafo[v])])
+        grafo[v].append([u, 0, -custo, len(grafo[u]) - 1])
+
+    for i in range(n_p):
+        adicionar(origem, i, int(qtd_p[i]), 0)
+    for j in range(n_b):
+        adicionar(n_p + j, destino, int(qtd_b[j]), 0)
+    lo = np.searchsorted(dias_b, dias_p - tolerancia_dias, side='left')
+    hi = np.searchsorted(dias_b, dias_p + tolerancia_dias, side='right')
+    for i in range(n_p):
+        for j in range(lo[i], hi[i]):
+            adicionar(i, n_p + j, int(min(qtd_p[i], qtd_b[j])), int(abs(dias_p[i] - dias_b[j])))
+
+    # Primal-dual: Dijkstra com potenciais define as distâncias; depois satura os caminhos mínimos
+    potencial = [0] * len(grafo)
+    while True:
+        dist = [None] * len(grafo)
+        anterior = [None] * len(grafo)
+        dist[origem] = 0
+        fila = [(0, origem)]
+        while fila:
+            d, u = heapq.heappop(fila)
+            if d > dist[u]:
+                continue
+            for k, (v, cap, custo, _) in enumerate(grafo[u]):
+                if cap <= 0:
+                    continue
+                nd = d + custo + potencial[u] - potencial[v]
+                if dist[v] is None or nd < dist[v]:
+                    dist[v] = nd
+                    anterior[v] = (u, k)
+                    heapq.heappush(fila, (nd, v))
+        if dist[destino] is None:
+            break
+        for v, d in enumerate(dist):
+            if d is not None:
+                potencial[v] += d
+
+        # Satura todos os caminhos de custo reduzido zero antes do próximo Dijkstra
+        while True:
+            caminho = _caminho_admissivel(grafo, potencial, origem, destino)
+            if caminho is None:
+                break
+            gargalo = min(grafo[u][k][1] for u, k in caminho)
+            for u, k in caminho:
+                aresta = grafo[u][k]
+                aresta[1] -= gargalo
+                grafo[aresta[0]][aresta[3]][1] += gargalo
+
+    fluxos = []
+    for i in range(n_p):
+        for v, _, custo, rev in grafo[i]:
+            if n_p <= v < n_p + n_b and custo >= 0 and grafo[v][rev][1] > 0:
+                fluxos.append((i, v - n_p, grafo[v][rev][1]))
+    return fluxos
+
+
+def _mais_proximo(unicos: pd.DataFrame, outro_lado: pd.DataFrame, tolerancia_dias: int) -> pd.DataFrame:
+    """Grupos com uma única linha de um lado: o ótimo é o candidato mais próximo (empate: o primeiro)."""
+    cand = outro_lado.merge(unicos[['grupo', 'dia', 'pos']], on='grupo', suffixes=('', '_unico'))
+    cand['dias'] = (cand['dia'] - cand['dia_unico']).abs()
+    cand = cand[cand['dias'] <= tolerancia_dias]
+    return cand.sort_values(['grupo', 'dias', 'pos'], kind='stable').drop_duplicates('grupo')
+
+
+def resolver_atribuicao_otima(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, tolerancia_dias: int) -> pd.DataFrame:
+    """
+    Alternativa opt-in ao "primeiro candidato livre": resolve cada grupo de
+    valor com a atribuição ótima (máximo de pares e, entre essas soluções,
+    menor soma de dias de diferença).
+
+    Linhas do mesmo grupo e do mesmo dia são intercambiáveis, então o problema
+    é resolvido sobre baldes (grupo, dia) e depois expandido para as linhas na
+    ordem original: o custo cresce com o tamanho do grupo, não com o produto
+    Protheus x Banco. Devolve os pares aceitos (pos_p, pos_b, dias) ordenados por pos_p.
+    """
+    colunas = ['pos_p', 'pos_b', 'dias']
+    if sobra_p.empty or sobra_b.empty:
+        return pd.DataFrame({c: np.empty(0, np.int64) for c in colunas})
+
+    n_p = len(sobra_p)
+    codigos = pd.factorize(pd.concat([sobra_p['Valor_Centavos'], sobra_b['Valor_Centavos']], ignore_index=True))[0]
+    lado_p = pd.DataFrame({'grupo': codigos[:n_p], 'dia': _datas_ns(sobra_p['Data']) // DIA_NS, 'pos': np.arange(n_p)})
+    lado_b = pd.DataFrame({'grupo': codigos[n_p:], 'dia': _datas_ns(sobra_b['Data']) // DIA_NS, 'pos': np.arange(len(sobra_b))})
+
+    qtd_p = lado_p['grupo'].value_counts()
+    qtd_b = lado_b['grupo'].value_counts()
+    lado_p['n_p'] = lado_p['grupo'].map(qtd_p)
+    lado_p['n_b'] = lado_p['grupo'].map(qtd_b).fillna(0).astype(np.int64)
+    lado_b['n_p'] = lado_b['grupo'].map(qtd_p).fillna(0).astype(np.int64)
+    lado_b['n_b'] = lado_b['grupo'].map(qtd_b)
+    lado_p = lado_p[lado_p['n_b'] > 0]
+    lado_b = lado_b[lado_b['n_p'] > 0]
+
+    resultados = []
+
+    # 1) Um único Protheus no grupo -> Banco mais próximo
+    r = _mais_proximo(lado_p[lado_p['n_p'] == 1], lado_b[lado_b['n_p'] == 1], tolerancia_dias)
+    resultados.append(pd.DataFrame({'pos_p': r['pos_unico'].values, 'pos_b': r['pos'].values, 'dias': r['dias'].values}))
+
+    # 2) Um único Banco (e vários Protheus) -> Protheus mais próximo
+    r = _mais_proximo(lado_b[(lado_b['n_b'] == 1) & (lado_b['n_p'] > 1)], lado_p[(lado_p['n_b'] == 1) & (lado_p['n_p'] > 1)], tolerancia_dias)
+    resultados.append(pd.DataFrame({'pos_p': r['pos'].values, 'pos_b': r['pos_unico'].values, 'dias': r['dias'].values}))
+
+    # 3) Grupos disputados dos dois lados -> fluxo de custo mínimo sobre baldes de dias
+    disp_p = lado_p[(lado_p['n_p'] > 1) & (lado_p['n_b'] > 1)].sort_values(['grupo', 'dia', 'pos'])
+    disp_b = lado_b[(lado_b['n_p'] > 1) & (lado_b['n_b'] > 1)].sort_values(['grupo', 'dia', 'pos'])
+    indices_b = disp_b.groupby('grupo').indices
+    dia_p_arr, pos_p_arr = disp_p['dia'].values, disp_p['pos'].values
+    dia_b_arr, pos_b_arr = disp_b['dia'].values, disp_b['pos'].values
+
+    for grupo, idx_p in disp_p.groupby('grupo').indices.items():
+        idx_b = indices_b[grupo]
+        dias_p, ini_p, cont_p = np.unique(dia_p_arr[idx_p], return_index=True, return_counts=True)
+        dias_b, ini_b, cont_b = np.unique(dia_b_arr[idx_b], return_index=True, return_counts=True)
+        usados_p = np.zeros(len(dias_p), dtype=np.int64)
+        usados_b = np.zeros(len(dias_b), dtype=np.int64)
+        ps, bs, ds = [], [], []
+        for i, j, qtd in _fluxo_custo_minimo(dias_p, cont_p, dias_b, cont_b, tolerancia_dias):
+            a = ini_p[i] + usados_p[i]
+            b = ini_b[j] + usados_b[j]
+            ps.append(pos_p_arr[idx_p[a:a + qtd]])
+            bs.append(pos_b_arr[idx_b[b:b + qtd]])
+            ds.append(np.full(qtd, abs(dias_p[i] - dias_b[j]), dtype=np.int64))
+            usados_p[i] += qtd
+            usados_b[j] += qtd
+        if ps:
+            resultados.append(pd.DataFrame({'pos_p': np.concatenate(ps), 'pos_b': np.concatenate(bs), 'dias': np.concatenate(ds)}))
+
+    aceitos = pd.concat(resultados, ignore_index=True).astype(np.int64)
+    return aceitos.sort_values('pos_p', kind='stable').reset_index(drop=True)
+
+
+def montar_matches(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, pos_p: np.ndarray, pos_b: np.ndarray,
+                   metodo, justificativas) -> pd.DataFrame:
+    """Materializa os pares aceitos no layout da aba 'Conciliados' (metodo: texto único ou um por par)."""
+    linhas_p = sobra_p.iloc[pos_p]
+    linhas_b = sobra_b.iloc[pos_b]
+    return pd.DataFrame({
+        'Data_Protheus': linhas_p['Data'].values,
+        'Historico': linhas_p['Historico'].values,
+        'Data_Banco': linhas_b['Data'].values,
+        'Descricao': linhas_b['Descricao'].values,
+        'Valor_Centavos': linhas_p['Valor_Centavos'].values,
+        'Metodo': metodo,
+        'Justificativa_Auditoria': justificativas,
+        'pos_p': pos_p,
+        'pos_b': pos_b,
+    })
+
+
+def match_exato(df_p: pd.DataFrame, df_b: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Match exato por (Data, Valor_Centavos), estritamente um-para-um.
+
+    Lançamentos repetidos na mesma chave são pareados pela ordem de ocorrência
+    (cumcount): o k-ésimo Protheus com a chave casa com o k-ésimo Banco. Assim
+    k lançamentos iguais dos dois lados geram k conciliados, e não k², e as
+    sobras de um grupo desbalanceado seguem para as próximas etapas.
+
+    Retorna (conciliados, sobra_p, sobra_b).
+    """
+    chave = ['Data', 'Valor_Centavos']
+    df_p = df_p.assign(_ocorrencia=df_p.groupby(chave).cumcount())
+    df_b = df_b.assign(_ocorrencia=df_b.groupby(chave).cumcount())
+    match = pd.merge(
+        df_p, df_b,
+        on=chave + ['_ocorrencia'],
+        how='outer', indicator=True, suffixes=('_Protheus', '_Banco')
+    ).drop(columns='_ocorrencia')
+
+    # O merge outer passa refs inteiras para float (NaN do lado ausente): volta ao tipo de entrada
+    tipos_ref = {'Ref. Auditoria_Protheus': df_p['Ref. Auditoria'].dtype, 'Ref. Auditoria_Banco': df_b['Ref. Auditoria'].dtype}
+    conciliados = match[match['_merge'] == 'both'].astype(tipos_ref)
+    conciliados['Metodo'] = 'Exato'
+    conciliados['Justificativa_Auditoria'] = 'Valores e Datas coincidem perfeitamente.'
+
+    sobra_p = match[match['_merge'] == 'left_only'][['Data', 'Historico', 'Valor_Centavos', 'Ref. Auditoria_Protheus']].astype(
+        {'Ref. Auditoria_Protheus': tipos_ref['Ref. Auditoria_Protheus']}).rename(columns={'Ref. Auditoria_Protheus': 'Ref. Auditoria'})
+    sobra_b = match[match['_merge'] == 'right_only'][['Data', 'Descricao', 'Valor_Centavos', 'Ref. Auditoria_Banco']].astype(
+        {'Ref. Auditoria_Banco': tipos_ref['Ref. Auditoria_Banco']}).rename(columns={'Ref. Auditoria_Banco': 'Ref. Auditoria'})
+    return conciliados, sobra_p, sobra_b
+
+
+def match_tolerancia(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame,
+                     tolerancia_dias: int, janela_ia_dias: int,
+                     modo: str = MODO_GULOSO) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Resolve em lote todos os matches "Tolerancia Data" (|dias| <= tolerancia_dias).
+
+    modo:
+        - 'guloso': primeiro candidato livre, na ordem do Protheus (regra histórica)
+        - 'otimo':  atribuição de custo mínimo por grupo de valor
+
+    Retorna:
+        - DataFrame com os matches de tolerância (layout de 'Conciliados' + pos_p/pos_b)
+        - DataFrame de pares residuais (pos_p, pos_b, dias) entre tolerancia_dias e
+          janela_ia_dias, já sem as linhas conciliadas, para a etapa de IA.
+    """
+    if modo not in MODOS_ATRIBUICAO:
+        raise ValueError(f"Modo de atribuição inválido ('{modo}'). Permitidos: {MODOS_ATRIBUICAO}")
+
+    if modo == MODO_OTIMO:
+        tol = resolver_atribuicao_otima(sobra_p, sobra_b, tolerancia_dias)
+    else:
+        tol = gerar_pares_candidatos(sobra_p, sobra_b, tolerancia_dias)
+        tol = tol[resolver_primeiro_match(tol['pos_p'].values, tol['pos_b'].values)]
+
+    justificativas = [f"Valor igual, compensado com {d} dias de diferença." for d in tol['dias'].tolist()]
+    df_tol = montar_matches(sobra_p, sobra_b, tol['pos_p'].values, tol['pos_b'].values, "Tolerancia Data", justificativas)
+
+    # Resíduo para a IA: pares na faixa (tolerancia_dias, janela_ia_dias] entre as linhas que sobraram
+    livres_p = np.setdiff1d(np.arange(len(sobra_p)), tol['pos_p'].values)
+    livres_b = np.setdiff1d(np.arange(len(sobra_b)), tol['pos_b'].values)
+    residuo = gerar_pares_candidatos(sobra_p.iloc[livres_p], sobra_b.iloc[livres_b], janela_ia_dias)
+    residuo = residuo[residuo['dias'] > tolerancia_dias]
+    residuo = residuo.assign(pos_p=livres_p[residuo['pos_p'].values], pos_b=livres_b[residuo['pos_b'].values])
+
+    return df_tol, residuo.reset_index(drop=True)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from motor_matching import match_exato, match_tolerancia, MODO_GULOSO
+
+CHAVE_EXATA = ['Data', 'Valor_Centavos']
+
+
+def fatiar_por_valor(df: pd.DataFrame, n_fatias: int) -> List[pd.DataFrame]:
+    """
+    Divide o extrato por hash do valor. Todos os matchers só pareiam linhas com
+    o mesmo valor, então cada fatia pode ser conciliada sem olhar as outras
+    (e a janela de datas nunca cruza fatias).
+    """
+    fatia = pd.util.hash_array(df['Valor_Centavos'].values) % np.uint64(n_fatias)
+    return [df[fatia == i] for i in range(n_fatias)]
+
+
+def _conciliar_fatia(args) -> Tuple:
+    df_p, df_b, tolerancia_dias, janela_ia_dias, modo = args
+    conciliados, sobra_p, sobra_b = match_exato(df_p, df_b)
+    df_tol, pares_ia = match_tolerancia(sobra_p, sobra_b, tolerancia_dias, janela_ia_dias, modo)
+    return conciliados, sobra_p, sobra_b, df_tol, pares_ia
+
+
+def _juntar_sobras(sobras: List[pd.DataFrame]) -> Tuple[pd.DataFrame, List[np.ndarray]]:
+    """
+    Junta as sobras das fatias na ordem do merge único (Data, Valor_Centavos;
+    empates na ordem de ocorrência, que vivem na mesma fatia) e devolve, para
+    cada fatia, a posição global de cada linha local.
+    """
+    juntas = pd.concat(sobras, ignore_index=True)
+    ordem = np.lexsort((juntas['Valor_Centavos'].values, juntas['Data'].values))
+    posicao_global = np.empty(len(juntas), dtype=np.int64)
+    posicao_global[ordem] = np.arange(len(juntas))
+    limites = np.cumsum([0] + [len(s) for s in sobras])
+    return juntas.iloc[ordem], [posicao_global[limites[i]:limites[i + 1]] for i in range(len(sobras))]
+
+
+def conciliar_particionado(df_p: pd.DataFrame, df_b: pd.DataFrame, tolerancia_dias: int, janela_ia_dias: int,
+                           modo: str = MODO_GULOSO, workers: int = 2) -> Tuple:
+    """
+    Etapas 1 e 2 (match exato + tolerância) em `workers` processos, uma fatia de
+    valores por tarefa. O resultado é idêntico ao da execução em um processo:
+    as sobras são reordenadas como no merge único e as posições (pos_p, pos_b)
+    de tolerância e do resíduo da IA são traduzidas para essa ordem.
+
+    Retorna (conciliados, sobra_p, sobra_b, df_tol, pares_ia).
+    """
+    fatias_p = fatiar_por_valor(df_p, workers)
+    fatias_b = fatiar_por_valor(df_b, workers)
+    tarefas = [(fp, fb, tolerancia_dias, janela_ia_dias, modo) for fp, fb in zip(fatias_p, fatias_b)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        resultados = list(pool.map(_conciliar_fatia, tarefas))
+
+    conciliados = pd.concat([r[0] for r in resultados])
+    ordem = np.lexsort((conciliados['Valor_Centavos'].values, conciliados['Data'].values))
+    conciliados = conciliados.iloc[ordem].reset_index(drop=True)
+
+    sobra_p, global_p = _juntar_sobras([r[1] for r in resultados])
+    sobra_b, global_b = _juntar_sobras([r[2] for r in resultados])
+
+    def _traduzir(df: pd.DataFrame, i: int) -> pd.DataFrame:
+        return df.assign(pos_p=global_p[i][df['pos_p'].values], pos_b=global_b[i][df['pos_b'].values])
+
+    df_tol = pd.concat([_traduzir(r[3], i) for i, r in enumerate(resultados)], ignore_index=True)
+    df_tol = df_tol.sort_values('pos_p', kind='stable').reset_index(drop=True)
+    pares_ia = pd.concat([_traduzir(r[4], i) for i, r in enumerate(resultados)], ignore_index=True)
+    pares_ia = pares_ia.sort_values(['pos_p', 'pos_b'], kind='stable').reset_index(drop=True)
+    return conciliados, sobra_p, sobra_b, df_tol, pares_ia
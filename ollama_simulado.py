@@ -0,0 +1,190 @@
+"""
+Servidor Ollama simulado para testes de carga do agente, sem modelo real.
+
+Implementa GET /api/tags, POST /api/generate (prompts de um par e de lote) e
+POST /api/embed (vetores do hashing de similaridade.py) com
+latência, taxa de erro HTTP e taxa de JSON malformado configuráveis. A decisão
+é determinística (pares que compartilham alguma palavra dão match), e o sorteio
+de falhas usa uma seed, então a mesma carga sempre produz o mesmo resultado.
+
+Uso:
+    python ollama_simulado.py --porta 11435 --latencia 0.2 --taxa-erro 0.02 --taxa-json-invalido 0.05
+    OLLAMA_URL=http://127.0.0.1:11435 python conciliador_enterprise_v2.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from utils import normalizar_texto
+from similaridade import vetorizar_descricoes
+
+MODELO_PADRAO = "llama3.2"
+MODELO_EMBEDDING_PADRAO = "nomic-embed-text"
+
+_RE_PAR = re.compile(r'^\s*A:\s*(.*)$\s*^\s*B:\s*(.*)$', re.MULTILINE)
+_RE_ITEM_LOTE = re.compile(r'^\s*(\d+)\) A: (.*) \| B: (.*)$', re.MULTILINE)
+
+
+def decidir(texto_a: str, texto_b: str) -> Dict:
+    """Regra fixa do modelo simulado: alguma palavra (3+ letras) em comum -> match de alta confiança."""
+    palavras_a = {p for p in normalizar_texto(texto_a).split() if len(p) >= 3}
+    palavras_b = {p for p in normalizar_texto(texto_b).split() if len(p) >= 3}
+    comuns = sorted(palavras_a & palavras_b)
+    if comuns:
+        return {'match': True, 'confianca': 'alta', 'justificativa': f"Termos em comum: {', '.join(comuns)}."}
+    return {'match': False, 'confianca': 'baixa', 'justificativa': "Descrições sem relação aparente."}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_Servidor'
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status: int, corpo: str):
+        dados = corpo.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/api/tags':
+            self._responder(404, json.dumps({'error': 'not found'}))
+            return
+        simulado = self.server.simulado
+        self._responder(200, json.dumps({'models': [{'name': f"{m}:latest"}
+                                                    for m in (simulado.modelo, simulado.modelo_embedding)]}))
+
+    def do_POST(self):
+        rota = self.path.rstrip('/')
+        if rota not in ('/api/generate', '/api/embed'):
+            self._responder(404, json.dumps({'error': 'not found'}))
+            return
+        simulado = self.server.simulado
+        corpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if rota == '/api/embed':
+            textos = corpo['input'] if isinstance(corpo['input'], list) else [corpo['input']]
+            time.sleep(simulado.latencia_requisicao)
+            if simulado.sortear_falha() == 'erro':
+                self._responder(500, json.dumps({'error': 'erro simulado do modelo'}))
+                return
+            self._responder(200, json.dumps({'model': corpo['model'], 'embeddings': vetorizar_descricoes(textos).tolist()}))
+            return
+        prompt = corpo['prompt']
+        itens = _RE_ITEM_LOTE.findall(prompt)
+        time.sleep(simulado.latencia_requisicao + simulado.latencia_par * max(1, len(itens)))
+
+        falha = simulado.sortear_falha()
+        if falha == 'erro':
+            self._responder(500, json.dumps({'error': 'erro simulado do modelo'}))
+            return
+        if itens:
+            resposta = json.dumps({'resultados': [dict(decidir(a, b), id=int(i)) for i, a, b in itens]})
+        else:
+            par = _RE_PAR.search(prompt)
+            resposta = json.dumps(decidir(*par.groups()) if par else {'match': False, 'confianca': 'baixa',
+                                                                      'justificativa': 'Prompt não reconhecido.'})
+        if falha == 'json_invalido':
+            resposta = resposta[:len(resposta) // 2]
+        self._responder(200, json.dumps({'model': simulado.modelo, 'response': resposta, 'done': True}))
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    simulado: 'ServidorOllamaSimulado'
+
+
+class ServidorOllamaSimulado:
+    """
+    Sobe o servidor em uma thread. Uso típico:
+
+        with ServidorOllamaSimulado(latencia_requisicao=0.05, taxa_erro=0.02) as servidor:
+            agente_seguro_v2.configurar_url_ollama(servidor.url_base)
+            ...
+    """
+
+    def __init__(self, porta: int = 0, latencia_requisicao: float = 0.0, latencia_par: float = 0.0,
+                 taxa_erro: float = 0.0, taxa_json_invalido: float = 0.0, seed: Optional[int] = 0,
+                 modelo: str = MODELO_PADRAO, modelo_embedding: str = MODELO_EMBEDDING_PADRAO,
+                 host: str = '127.0.0.1'):
+        self.latencia_requisicao = latencia_requisicao
+        self.latencia_par = latencia_par
+        self.taxa_erro = taxa_erro
+        self.taxa_json_invalido = taxa_json_invalido
+        self.modelo = modelo
+        self.modelo_embedding = modelo_embedding
+        self.requisicoes = 0
+        self.erros = 0
+        self.json_invalidos = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._servidor = _Servidor((host, porta), _Handler)
+        self._servidor.simulado = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url_base(self) -> str:
+        host, porta = self._servidor.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def sortear_falha(self) -> Optional[str]:
+        with self._lock:
+            self.requisicoes += 1
+            sorteio = self._rng.random()
+            if sorteio < self.taxa_erro:
+                self.erros += 1
+                return 'erro'
+            if sorteio < self.taxa_erro + self.taxa_json_invalido:
+                self.json_invalidos += 1
+                return 'json_invalido'
+        return None
+
+    def iniciar(self) -> 'ServidorOllamaSimulado':
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True, name='ollama_simulado')
+        self._thread.start()
+        return self
+
+    def servir(self):
+        """Atende na thread atual até Ctrl+C (uso pela linha de comando)."""
+        try:
+            self._servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._servidor.server_close()
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado (/api/tags, /api/generate e /api/embed)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=11435)
+    parser.add_argument('--latencia', type=float, default=0.05, help="Segundos por requisição")
+    parser.add_argument('--latencia-par', type=float, default=0.01, help="Segundos adicionais por par do prompt")
+    parser.add_argument('--taxa-erro', type=float, default=0.0, help="Fração de respostas HTTP 500")
+    parser.add_argument('--taxa-json-invalido', type=float, default=0.0, help="Fração de respostas com JSON truncado")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    servidor = ServidorOllamaSimulado(args.porta, args.latencia, args.latencia_par, args.taxa_erro,
+                                      args.taxa_json_invalido, args.seed, host=args.host)
+    print(f"🤖 Ollama simulado em {servidor.url_base} (Ctrl+C para parar)")
+    servidor.servir()
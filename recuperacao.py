@@ -0,0 +1,186 @@
+"""
+Recuperação de candidatos por embeddings para a etapa de IA.
+
+Em grupos de mesmo valor com muitos lançamentos na janela D+4/D+5, cada
+lançamento do Protheus vira par com todos os do Banco e as consultas ao modelo
+crescem com o produto dos tamanhos dos grupos. Aqui cada descrição distinta é
+vetorizada uma vez por execução e, para cada lançamento do Protheus, só as
+TOP_K descrições do Banco mais próximas (cosseno) na sua janela seguem para o
+modelo generativo: as consultas crescem de forma linear.
+
+Backends:
+    - 'hashing': vetorizador local de similaridade.py (offline, sem cache).
+    - 'ollama': endpoint /api/embed do Ollama local (mesma política do
+      agente_seguro_v2: só localhost, só MODELO_EMBEDDING_PERMITIDO, entradas
+      sanitizadas). Os vetores ficam em cache SQLite por descrição; se o
+      modelo não responder, a execução volta para o hashing.
+"""
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import agente_seguro_v2
+from similaridade import vetorizar_descricoes, TAMANHO_BLOCO
+from utils import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+BACKEND_HASHING = 'hashing'
+BACKEND_OLLAMA = 'ollama'
+BACKENDS = (BACKEND_HASHING, BACKEND_OLLAMA)
+TOP_K_PADRAO = 3
+CAMINHO_CACHE_EMBEDDINGS = 'data/cache_embeddings.sqlite'
+
+
+class CacheEmbeddings:
+    """
+    Cache persistente (SQLite) dos vetores do modelo de embeddings, um por
+    descrição normalizada. Como no cache de decisões, a chave é um hash
+    (modelo + texto): o texto do extrato não fica gravado em disco.
+    """
+
+    def __init__(self, caminho: str = CAMINHO_CACHE_EMBEDDINGS):
+        self.caminho = caminho
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (chave TEXT PRIMARY KEY, vetor BLOB NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def gerar_chave(modelo: str, texto: str) -> str:
+        return hashlib.sha256(f"{modelo}\x00{texto}".encode('utf-8')).hexdigest()
+
+    def obter_varios(self, modelo: str, textos: Sequence[str]) -> Dict[str, np.ndarray]:
+        chaves = {self.gerar_chave(modelo, t): t for t in textos}
+        encontrados = {}
+        with self._lock:
+            lista = list(chaves)
+            for inicio in range(0, len(lista), 500):
+                bloco = lista[inicio:inicio + 500]
+                linhas = self._conn.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({','.join('?' * len(bloco))})", bloco
+                ).fetchall()
+                encontrados.update({chaves[c]: np.frombuffer(v, dtype=np.float32) for c, v in linhas})
+            self.hits += len(encontrados)
+            self.misses += len(chaves) - len(encontrados)
+        return encontrados
+
+    def salvar_varios(self, modelo: str, vetores: Dict[str, np.ndarray]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (chave, vetor) VALUES (?, ?)",
+                [(self.gerar_chave(modelo, t), np.asarray(v, dtype=np.float32).tobytes()) for t, v in vetores.items()])
+            self._conn.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _normalizar_l2(matriz: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    np.divide(matriz, normas, out=matriz, where=normas > 0)
+    return matriz
+
+
+def _embeddings_ollama(textos: List[str], cache: Optional[CacheEmbeddings]) -> Optional[np.ndarray]:
+    # Textos vazios não vão ao modelo (sanitizar_entrada os recusa): ficam com vetor nulo
+    modelo = agente_seguro_v2.MODELO_EMBEDDING_PERMITIDO
+    validos = [t for t in textos if t]
+    conhecidos = cache.obter_varios(modelo, validos) if cache is not None else {}
+    faltantes = [t for t in validos if t not in conhecidos]
+    if faltantes:
+        gerados = agente_seguro_v2.gerar_embeddings(faltantes)
+        if gerados is None:
+            return None
+        novos = dict(zip(faltantes, _normalizar_l2(np.asarray(gerados, dtype=np.float32))))
+        if cache is not None:
+            cache.salvar_varios(modelo, novos)
+        conhecidos.update(novos)
+    if not conhecidos:
+        return None
+    dimensoes = len(next(iter(conhecidos.values())))
+    if any(len(v) != dimensoes for v in conhecidos.values()):
+        logger.warning("Vetores de embedding com dimensões diferentes (modelo trocado?).")
+        return None
+    matriz = np.zeros((len(textos), dimensoes), dtype=np.float32)
+    for i, texto in enumerate(textos):
+        if texto:
+            matriz[i] = conhecidos[texto]
+    return matriz
+
+
+def vetorizar_textos(textos: List[str], backend: str = BACKEND_HASHING,
+                     cache: Optional[CacheEmbeddings] = None) -> Tuple[np.ndarray, str]:
+    """
+    Vetores L2-normalizados (float32) das descrições já normalizadas e o backend
+    efetivamente usado (o Ollama cai para 'hashing' se não responder).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de embeddings desconhecido: '{backend}' (use {BACKENDS})")
+    if backend == BACKEND_OLLAMA:
+        vetores = _embeddings_ollama(textos, cache)
+        if vetores is not None:
+            return vetores, BACKEND_OLLAMA
+        logger.warning(f"Embeddings do Ollama ('{agente_seguro_v2.MODELO_EMBEDDING_PERMITIDO}') indisponíveis: "
+                       f"usando o vetorizador local (hashing).")
+    return vetorizar_descricoes(textos), BACKEND_HASHING
+
+
+def selecionar_candidatos(sobra_p: pd.DataFrame, sobra_b: pd.DataFrame, pares_ia: pd.DataFrame,
+                          top_k: int = TOP_K_PADRAO, backend: str = BACKEND_HASHING,
+                          cache: Optional[CacheEmbeddings] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Mantém, para cada lançamento do Protheus, só os pares cuja descrição do
+    Banco está entre as `top_k` descrições distintas mais similares ao seu
+    histórico (entre os candidatos da sua janela em `pares_ia`). Pares com a
+    mesma descrição de uma já escolhida continuam todos: não custam consulta
+    extra ao modelo (a etapa de IA consulta cada par de textos uma vez) e
+    mantêm a atribuição um-para-um com opções quando há duplicatas.
+
+    Retorna os pares filtrados (mesma ordem de `pares_ia`) e as estatísticas.
+    """
+    stats = {'pares_entrada': len(pares_ia), 'pares_saida': len(pares_ia), 'textos_vetorizados': 0,
+             'backend': backend, 'top_k': top_k}
+    if not len(pares_ia) or top_k <= 0:
+        return pares_ia, stats
+
+    pos_p = pares_ia['pos_p'].values
+    pos_b = pares_ia['pos_b'].values
+    n = len(pos_p)
+    textos = np.concatenate([sobra_p['Historico'].values[pos_p], sobra_b['Descricao'].values[pos_b]])
+    unicos, idx = np.unique(textos.astype(object).astype(str), return_inverse=True)
+    normalizados, idx_norm = np.unique(np.array([normalizar_texto(t) for t in unicos], dtype=object).astype(str),
+                                       return_inverse=True)
+    idx = idx_norm[idx]
+    idx_h, idx_d = idx[:n], idx[n:]
+
+    vetores, stats['backend'] = vetorizar_textos(normalizados.tolist(), backend, cache)
+    stats['textos_vetorizados'] = len(normalizados)
+    scores = np.empty(n, dtype=np.float32)
+    for inicio in range(0, n, TAMANHO_BLOCO):
+        fim = inicio + TAMANHO_BLOCO
+        scores[inicio:fim] = np.einsum('ij,ij->i', vetores[idx_h[inicio:fim]], vetores[idx_d[inicio:fim]])
+
+    # Vizinhos mais próximos por lançamento do Protheus: ordena (pos_p, -score, descrição) e
+    # numera as descrições distintas dentro de cada pos_p (empates: ordem das descrições)
+    ordem = np.lexsort((idx_d, -scores, pos_p))
+    p_ord, d_ord = pos_p[ordem], idx_d[ordem]
+    inicio_grupo = np.r_[True, p_ord[1:] != p_ord[:-1]]
+    nova_descricao = inicio_grupo | np.r_[True, d_ord[1:] != d_ord[:-1]]
+    acumulado = np.cumsum(nova_descricao)
+    posto = acumulado - np.maximum.accumulate(np.where(inicio_grupo, acumulado, 0))
+    manter = np.zeros(n, dtype=bool)
+    manter[ordem[posto < top_k]] = True
+
+    filtrados = pares_ia[manter].reset_index(drop=True)
+    stats['pares_saida'] = len(filtrados)
+    return filtrados, stats
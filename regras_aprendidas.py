@@ -0,0 +1,223 @@
+"""
+Regras aprendidas a partir das aprovações da IA.
+
+Todo mês o modelo aprova de novo os mesmos tipos de par (o histórico do
+fornecedor no Protheus contra a descrição abreviada do banco). Cada decisão de
+alta confiança é normalizada em um padrão de tokens (conjunto de tokens do
+histórico x conjunto de tokens da descrição, sem números, que mudam a cada
+título) e contada; com MIN_APROVACOES_REGRA aprovações e nenhuma rejeição o
+padrão vira regra ativa e passa a ser decidido localmente ("Regra Aprendida"),
+sem chegar ao modelo.
+
+As regras ficam em um JSON legível (CAMINHO_REGRAS), para revisão: mudar
+"status" para "revogada" (à mão ou com `python regras_aprendidas.py revogar
+<id>`) desliga a regra de vez, mesmo que o modelo continue aprovando o padrão.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, Iterator, Sequence
+
+from utils import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+CAMINHO_REGRAS = 'data/regras_aprendidas.json'
+MIN_APROVACOES_REGRA = 3
+TIMEOUT_TRAVA_SEGUNDOS = 60     # Espera máxima pela trava do arquivo de regras (outra conta/job gravando)
+TRAVA_ABANDONADA_SEGUNDOS = 30  # Gravar leva milissegundos: trava mais velha que isso é de processo que morreu
+
+STATUS_CANDIDATA = 'candidata'
+STATUS_ATIVA = 'ativa'
+STATUS_REVOGADA = 'revogada'
+
+
+def padrao_tokens(texto) -> str:
+    """Tokens normalizados, sem repetição, em ordem alfabética; fora números e tokens de 1 caractere."""
+    tokens = {t for t in normalizar_texto(texto).split() if len(t) > 1 and not any(c.isdigit() for c in t)}
+    return ' '.join(sorted(tokens))
+
+
+def id_regra(padrao_historico: str, padrao_descricao: str) -> str:
+    return hashlib.sha1(f"{padrao_historico}|{padrao_descricao}".encode('utf-8')).hexdigest()[:12]
+
+
+@contextmanager
+def travar_arquivo(caminho: str, timeout: float = TIMEOUT_TRAVA_SEGUNDOS) -> Iterator[None]:
+    """
+    Trava entre processos para o ciclo ler-somar-gravar do arquivo de regras:
+    '<caminho>.lock' criado com O_EXCL (funciona igual em Windows e Linux).
+    Quem não consegue criar espera; uma trava com mais de
+    TRAVA_ABANDONADA_SEGUNDOS é de um processo que morreu e é removida.
+    """
+    trava = f"{caminho}.lock"
+    os.makedirs(os.path.dirname(trava) or '.', exist_ok=True)
+    limite = time.monotonic() + timeout
+    while True:
+        try:
+            descritor = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(trava) > TRAVA_ABANDONADA_SEGUNDOS:
+                    logger.warning(f"Removendo trava abandonada: {trava}")
+                    os.remove(trava)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > limite:
+                raise TimeoutError(f"Arquivo de regras travado por outro processo há mais de {timeout:.0f}s: {trava}")
+            time.sleep(0.05)
+    try:
+        os.write(descritor, str(os.getpid()).encode('ascii'))
+        os.close(descritor)
+        yield
+    finally:
+        try:
+            os.remove(trava)
+        except FileNotFoundError:
+            pass
+
+
+class DicionarioRegras:
+    """
+    Regras aprendidas de um arquivo: casa pares contra as regras ativas e
+    acumula as decisões da IA da execução para gravar no fim (salvar).
+
+    O matcher compilado é um dicionário (padrão do histórico, padrão da
+    descrição) -> id da regra; cada texto distinto é normalizado uma vez.
+    """
+
+    def __init__(self, caminho: str = CAMINHO_REGRAS, min_aprovacoes: int = MIN_APROVACOES_REGRA):
+        self.caminho = caminho
+        self.min_aprovacoes = min_aprovacoes
+        self.regras: Dict[str, Dict] = self._ler()
+        self._observacoes: Dict[str, Dict] = {}
+        self._compilar()
+
+    def _ler(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.caminho):
+            return {}
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            return {regra['id']: regra for regra in json.load(f)['regras']}
+
+    def _compilar(self):
+        self._matcher = {(r['padrao_historico'], r['padrao_descricao']): r['id']
+                         for r in self.regras.values() if r['status'] == STATUS_ATIVA}
+
+    @property
+    def ativas(self) -> int:
+        return len(self._matcher)
+
+    def casar(self, historicos: Sequence, descricoes: Sequence) -> np.ndarray:
+        """Id da regra ativa que cobre cada par (historicos[i], descricoes[i]), ou None."""
+        ids = np.full(len(historicos), None, dtype=object)
+        if not self._matcher or not len(historicos):
+            return ids
+        unicos_h, idx_h = np.unique(np.asarray(historicos, dtype=object).astype(str), return_inverse=True)
+        unicos_d, idx_d = np.unique(np.asarray(descricoes, dtype=object).astype(str), return_inverse=True)
+        padroes_h = [padrao_tokens(t) for t in unicos_h]
+        padroes_d = [padrao_tokens(t) for t in unicos_d]
+        for i, (h, d) in enumerate(zip(idx_h.tolist(), idx_d.tolist())):
+            ids[i] = self._matcher.get((padroes_h[h], padroes_d[d]))
+        return ids
+
+    def observar(self, historico: str, descricao: str, aprovado: bool):
+        """Registra uma decisão da IA (aprovação de alta confiança ou rejeição) para o padrão do par."""
+        padrao_h, padrao_d = padrao_tokens(historico), padrao_tokens(descricao)
+        if not padrao_h or not padrao_d:
+            return
+        chave = id_regra(padrao_h, padrao_d)
+        obs = self._observacoes.setdefault(chave, {
+            'padrao_historico': padrao_h, 'padrao_descricao': padrao_d,
+            'aprovacoes': 0, 'rejeicoes': 0, 'exemplo': [str(historico), str(descricao)],
+        })
+        obs['aprovacoes' if aprovado else 'rejeicoes'] += 1
+
+    def salvar(self) -> Dict[str, int]:
+        """
+        Soma as decisões da execução ao arquivo (relido agora, para não perder
+        o que outra execução gravou nesse meio-tempo) e promove os padrões que
+        atingiram o mínimo. Grava em arquivo temporário + os.replace, tudo sob
+        travar_arquivo: contas e jobs em paralelo não perdem contagens.
+        """
+        if not self._observacoes:
+            return {'observadas': 0, 'promovidas': 0}
+        with travar_arquivo(self.caminho):
+            promovidas = self._somar_observacoes()
+        resultado = {'observadas': len(self._observacoes), 'promovidas': promovidas}
+        self._observacoes = {}
+        self._compilar()
+        return resultado
+
+    def _somar_observacoes(self) -> int:
+        self.regras = self._ler()
+        agora = time.strftime('%Y-%m-%d %H:%M:%S')
+        promovidas = 0
+        for chave, obs in self._observacoes.items():
+            regra = self.regras.setdefault(chave, {
+                'id': chave, 'status': STATUS_CANDIDATA,
+                'padrao_historico': obs['padrao_historico'], 'padrao_descricao': obs['padrao_descricao'],
+                'aprovacoes': 0, 'rejeicoes': 0, 'exemplo': obs['exemplo'], 'criada_em': agora,
+            })
+            regra['aprovacoes'] += obs['aprovacoes']
+            regra['rejeicoes'] += obs['rejeicoes']
+            regra['atualizada_em'] = agora
+            # Pares cobertos por regra ativa não chegam ao modelo: uma regra ativa só sai do atalho por revogar()
+            if (regra['status'] == STATUS_CANDIDATA and not regra['rejeicoes']
+                    and regra['aprovacoes'] >= self.min_aprovacoes):
+                regra['status'] = STATUS_ATIVA
+                promovidas += 1
+                logger.info(f"Regra aprendida {chave} ativada: '{regra['padrao_historico']}' <-> "
+                            f"'{regra['padrao_descricao']}' ({regra['aprovacoes']} aprovações).")
+        self._gravar()
+        return promovidas
+
+    def _gravar(self):
+        os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump({'regras': sorted(self.regras.values(), key=lambda r: r['id'])}, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, self.caminho)
+
+    def revogar(self, chave: str) -> bool:
+        """Desliga a regra de vez (o padrão não volta a ser promovido)."""
+        with travar_arquivo(self.caminho):
+            self.regras = self._ler()
+            if chave not in self.regras:
+                return False
+            self.regras[chave]['status'] = STATUS_REVOGADA
+            self.regras[chave]['atualizada_em'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            self._gravar()
+        self._compilar()
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Revisão das regras aprendidas das aprovações da IA")
+    parser.add_argument('--arquivo', default=CAMINHO_REGRAS)
+    sub = parser.add_subparsers(dest='comando', required=True)
+    listar = sub.add_parser('listar', help="Lista as regras (ativas primeiro)")
+    listar.add_argument('--status', choices=[STATUS_ATIVA, STATUS_CANDIDATA, STATUS_REVOGADA], default=None)
+    revogar = sub.add_parser('revogar', help="Revoga regras pelo id")
+    revogar.add_argument('ids', nargs='+')
+    args = parser.parse_args()
+
+    dicionario = DicionarioRegras(args.arquivo)
+    if args.comando == 'listar':
+        ordem = {STATUS_ATIVA: 0, STATUS_CANDIDATA: 1, STATUS_REVOGADA: 2}
+        for r in sorted(dicionario.regras.values(), key=lambda r: (ordem[r['status']], -r['aprovacoes'])):
+            if args.status is None or r['status'] == args.status:
+                print(f"{r['id']}  {r['status']:<9} +{r['aprovacoes']}/-{r['rejeicoes']}  "
+                      f"'{r['padrao_historico']}' <-> '{r['padrao_descricao']}'")
+    else:
+        falhas = [i for i in args.ids if not dicionario.revogar(i)]
+        for i in falhas:
+            print(f"Regra não encontrada: {i}")
+        sys.exit(1 if falhas else 0)
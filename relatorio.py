@@ -0,0 +1,169 @@
+"""
+Gravação do relatório final em streaming.
+
+Cada aba chega como uma lista de partes (DataFrames em centavos, na ordem em
+que devem aparecer) e é escrita em blocos: nada de pd.concat das partes nem de
+cópia do relatório inteiro em reais. O Excel usa o modo constant_memory do
+xlsxwriter (cada linha vai para o disco assim que é escrita) e abas acima do
+limite de linhas do Excel continuam em 'Aba (2)', 'Aba (3)'... As mesmas abas
+podem ser gravadas em Parquet/CSV para sistemas downstream.
+"""
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from typing import Dict, Iterator, List, Optional
+
+from utils import centavos_para_reais
+
+LIMITE_LINHAS_EXCEL = 1_048_576  # Linhas por planilha no formato .xlsx (incluindo o cabeçalho)
+LINHAS_POR_BLOCO = 50_000
+FORMATO_DATA_HORA = 'yyyy-mm-dd hh:mm:ss'  # Mesmo formato que o pandas usava no to_excel
+FORMATOS_AUXILIARES = ('parquet', 'csv')
+
+
+def colunas_aba(partes: List[pd.DataFrame]) -> List[str]:
+    """União ordenada das colunas das partes (a mesma ordem que pd.concat produziria)."""
+    return list(dict.fromkeys(c for parte in partes for c in parte.columns))
+
+
+def _nome_saida(coluna: str) -> str:
+    return 'Valor_Real' if coluna == 'Valor_Centavos' else coluna
+
+
+def _tipos_aba(partes: List[pd.DataFrame], colunas: List[str]) -> Dict[str, np.dtype]:
+    # Tipo de cada coluna nas partes que a possuem (colunas ausentes numa parte viram nulos desse tipo)
+    tipos = {}
+    for coluna in colunas:
+        presentes = [p[coluna].dtype for p in partes if coluna in p.columns and len(p)]
+        tipos[coluna] = presentes[0] if presentes and all(t == presentes[0] for t in presentes) else np.dtype(object)
+    return tipos
+
+
+def blocos_aba(partes: List[pd.DataFrame], linhas_por_bloco: int = LINHAS_POR_BLOCO) -> Iterator[pd.DataFrame]:
+    """
+    Percorre as partes em blocos já alinhados às colunas da aba e convertidos
+    para reais. Só um bloco por vez existe em memória além das próprias partes.
+    """
+    colunas = colunas_aba(partes)
+    tipos = _tipos_aba(partes, colunas)
+    for parte in partes:
+        for inicio in range(0, len(parte), linhas_por_bloco):
+            bloco = parte.iloc[inicio:inicio + linhas_por_bloco].reindex(columns=colunas)
+            for coluna in colunas:
+                if coluna not in parte.columns and tipos[coluna].kind in 'Mfc':
+                    bloco[coluna] = bloco[coluna].astype(tipos[coluna])
+            yield centavos_para_reais(bloco)
+
+
+def juntar_aba(partes: List[pd.DataFrame]) -> pd.DataFrame:
+    """A aba inteira em um DataFrame (em reais), para quem precisa dela em memória (tela, testes)."""
+    blocos = list(blocos_aba(partes))
+    if not blocos:
+        return pd.DataFrame(columns=[_nome_saida(c) for c in colunas_aba(partes)])
+    return pd.concat(blocos, ignore_index=True)
+
+
+def _valores_python(bloco: pd.DataFrame) -> List[list]:
+    # Colunas como listas Python; nulos (NaN/NaT/None) viram None, que o xlsxwriter deixa em branco
+    return [bloco[c].astype(object).where(bloco[c].notna(), None).tolist() for c in bloco.columns]
+
+
+def escrever_excel(caminho: str, abas: Dict[str, List[pd.DataFrame]], larguras: Optional[Dict[str, int]] = None,
+                   max_linhas_aba: int = LIMITE_LINHAS_EXCEL) -> Dict[str, int]:
+    """
+    Grava as abas em um .xlsx em modo constant_memory. `larguras` define largura
+    (com quebra de texto) por nome de coluna. Textos nunca são interpretados como
+    fórmula ou link. Devolve as linhas de dados gravadas em cada planilha.
+    """
+    larguras = larguras or {}
+    linhas_por_planilha = max_linhas_aba - 1
+    opcoes = {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False,
+              'strings_to_numbers': False}
+    planilhas = {}
+    with xlsxwriter.Workbook(caminho, opcoes) as workbook:
+        fmt_cabecalho = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        fmt_data_hora = workbook.add_format({'num_format': FORMATO_DATA_HORA})
+        fmt_texto = workbook.add_format({'text_wrap': True})
+
+        for nome_aba, partes in abas.items():
+            colunas = colunas_aba(partes)
+            tipos = _tipos_aba(partes, colunas)
+            worksheet, linha, sequencia = None, 0, 0
+
+            def nova_planilha():
+                nonlocal worksheet, linha, sequencia
+                if worksheet is not None:
+                    planilhas[worksheet.name] = linha - 1
+                sequencia += 1
+                nome = nome_aba if sequencia == 1 else f"{nome_aba} ({sequencia})"
+                worksheet = workbook.add_worksheet(nome)
+                # Formato por coluna: as células sem formato próprio (datas) herdam o da coluna
+                for i, coluna in enumerate(colunas):
+                    if coluna in larguras:
+                        worksheet.set_column(i, i, larguras[coluna], fmt_texto)
+                    elif tipos[coluna].kind == 'M':
+                        worksheet.set_column(i, i, None, fmt_data_hora)
+                worksheet.write_row(0, 0, [_nome_saida(c) for c in colunas], fmt_cabecalho)
+                linha = 1
+
+            nova_planilha()
+            for bloco in blocos_aba(partes):
+                for valores in zip(*_valores_python(bloco)):
+                    if linha > linhas_por_planilha:
+                        nova_planilha()
+                    worksheet.write_row(linha, 0, valores)
+                    linha += 1
+            planilhas[worksheet.name] = linha - 1
+    return planilhas
+
+
+def _schema_parquet(tipos: Dict[str, np.dtype]):
+    import pyarrow as pa
+    campos = []
+    for coluna, tipo in tipos.items():
+        if tipo.kind == 'M':
+            campos.append(pa.field(coluna, pa.timestamp('ns')))
+        elif tipo.kind == 'O':
+            campos.append(pa.field(coluna, pa.string()))
+        else:
+            campos.append(pa.field(coluna, pa.from_numpy_dtype(tipo)))
+    return pa.schema(campos)
+
+
+def escrever_parquet(caminho: str, partes: List[pd.DataFrame]):
+    """Uma aba em Parquet, um row group por bloco (mesmas colunas da aba do Excel)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    colunas = colunas_aba(partes)
+    tipos = {_nome_saida(c): (np.dtype(np.float64) if c == 'Valor_Centavos' else t)
+             for c, t in _tipos_aba(partes, colunas).items()}
+    schema = _schema_parquet(tipos)
+    with pq.ParquetWriter(caminho, schema) as writer:
+        for bloco in blocos_aba(partes):
+            writer.write_table(pa.Table.from_pandas(bloco, schema=schema, preserve_index=False))
+
+
+def escrever_csv(caminho: str, partes: List[pd.DataFrame]):
+    """Uma aba em CSV (';'), escrita bloco a bloco."""
+    with open(caminho, 'w', encoding='utf-8', newline='') as f:
+        pd.DataFrame(columns=[_nome_saida(c) for c in colunas_aba(partes)]).to_csv(f, sep=';', index=False)
+        for bloco in blocos_aba(partes):
+            bloco.to_csv(f, sep=';', index=False, header=False)
+
+
+def caminhos_auxiliares(caminho_base: str, nomes_abas, formatos) -> Dict[str, Dict[str, str]]:
+    """{formato: {aba: '<caminho_base>_<aba>.<formato>'}} para os formatos auxiliares pedidos."""
+    for formato in formatos:
+        if formato not in FORMATOS_AUXILIARES:
+            raise ValueError(f"Formato auxiliar desconhecido: '{formato}' (use {FORMATOS_AUXILIARES})")
+    return {formato: {aba: f"{caminho_base}_{aba.lower().replace(' ', '_')}.{formato}" for aba in nomes_abas}
+            for formato in formatos}
+
+
+def gravar_auxiliares(caminho_base: str, abas: Dict[str, List[pd.DataFrame]], formatos) -> Dict[str, Dict[str, str]]:
+    """Grava cada aba em cada formato auxiliar ('parquet', 'csv') ao lado do Excel. Devolve os caminhos."""
+    saidas = caminhos_auxiliares(caminho_base, abas.keys(), formatos)
+    for formato, caminhos in saidas.items():
+        for nome_aba, caminho in caminhos.items():
+            (escrever_parquet if formato == 'parquet' else escrever_csv)(caminho, abas[nome_aba])
+    return saidas
@@ -0,0 +1,55 @@
+import zlib
+import numpy as np
+from typing import Sequence
+
+from utils import normalizar_texto
+
+# --- CONFIGURAÇÃO ---
+DIMENSOES = 1024       # Tamanho do vetor (hashing trick)
+N_GRAMA = 3            # n-gramas de caracteres
+TAMANHO_BLOCO = 100_000  # Pares pontuados por bloco (limita memória)
+
+
+def _features(texto_normalizado: str) -> list:
+    """Tokens inteiros + n-gramas de caracteres de cada token (com bordas)."""
+    feats = []
+    for token in texto_normalizado.split():
+        feats.append(f"w:{token}")
+        marcado = f" {token} "
+        feats.extend(marcado[i:i + N_GRAMA] for i in range(len(marcado) - N_GRAMA + 1))
+    return feats
+
+
+def vetorizar_descricoes(textos: Sequence) -> np.ndarray:
+    """
+    Converte descrições em vetores L2-normalizados (float32, len(textos) x DIMENSOES).
+    Usa crc32 (e não hash()) para que os vetores sejam iguais entre execuções.
+    """
+    linhas, colunas = [], []
+    for i, texto in enumerate(textos):
+        for f in _features(normalizar_texto(texto)):
+            linhas.append(i)
+            colunas.append(zlib.crc32(f.encode('utf-8')) % DIMENSOES)
+
+    matriz = np.zeros((len(textos), DIMENSOES), dtype=np.float32)
+    np.add.at(matriz, (np.array(linhas, dtype=np.int64), np.array(colunas, dtype=np.int64)), 1.0)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    np.divide(matriz, normas, out=matriz, where=normas > 0)
+    return matriz
+
+
+def pontuar_pares(textos_a: Sequence, textos_b: Sequence) -> np.ndarray:
+    """
+    Similaridade de cosseno (0..1) entre textos_a[i] e textos_b[i], para todos os pares.
+    Cada descrição distinta é vetorizada uma única vez.
+    """
+    unicos_a, idx_a = np.unique(np.asarray(textos_a, dtype=object).astype(str), return_inverse=True)
+    unicos_b, idx_b = np.unique(np.asarray(textos_b, dtype=object).astype(str), return_inverse=True)
+    vet_a = vetorizar_descricoes(unicos_a)
+    vet_b = vetorizar_descricoes(unicos_b)
+
+    scores = np.empty(len(idx_a), dtype=np.float32)
+    for inicio in range(0, len(idx_a), TAMANHO_BLOCO):
+        fim = inicio + TAMANHO_BLOCO
+        scores[inicio:fim] = np.einsum('ij,ij->i', vet_a[idx_a[inicio:fim]], vet_b[idx_b[inicio:fim]])
+    return np.clip(scores, 0.0, 1.0)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos ficam na raiz do repositório, sem pacote
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import agente_seguro_v2
+from ollama_simulado import ServidorOllamaSimulado
+
+
+@pytest.fixture
+def ollama_simulado():
+    """Servidor Ollama simulado com o agente apontado para ele (sem cache em disco); desfeito ao final."""
+    url_anterior, cache_anterior = agente_seguro_v2.URL_BASE_OLLAMA, agente_seguro_v2.USAR_CACHE
+    with ServidorOllamaSimulado() as servidor:
+        agente_seguro_v2.configurar_url_ollama(servidor.url_base)
+        agente_seguro_v2.USAR_CACHE = False
+        yield servidor
+    agente_seguro_v2.configurar_url_ollama(url_anterior)
+    agente_seguro_v2.USAR_CACHE = cache_anterior
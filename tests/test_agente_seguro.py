@@ -0,0 +1,25 @@
+import agente_seguro_v2
+from agente_seguro_v2 import CacheDecisoesIA, ler_cache, gravar_cache, MODELO_EMBEDDING_PERMITIDO
+from ollama_simulado import ServidorOllamaSimulado
+
+
+def test_cache_marca_a_origem(tmp_path):
+    cache = CacheDecisoesIA(str(tmp_path / 'cache.sqlite'))
+    dados = {'match': True, 'confianca': 'alta', 'justificativa': 'Mesmo fornecedor.'}
+    gravar_cache(cache, 'chave', dados)
+    assert ler_cache(cache, 'chave') == dict(dados, do_cache=True)
+    # A marca não vai para o arquivo
+    assert cache.obter('chave') == dados
+    assert ler_cache(cache, 'outra') is None
+
+
+def test_embeddings_sem_o_modelo_de_embeddings(ollama_simulado):
+    cliente = agente_seguro_v2.obter_cliente()
+    assert len(cliente.gerar_embeddings(['PIX ALFA', 'PIX BETA'])) == 2
+
+    with ServidorOllamaSimulado(modelo_embedding='outro-modelo') as servidor:
+        agente_seguro_v2.configurar_url_ollama(servidor.url_base)
+        assert not cliente.modelo_disponivel(MODELO_EMBEDDING_PERMITIDO)
+        assert cliente.gerar_embeddings(['PIX ALFA']) is None
+        # Só falta o modelo de embeddings: o circuito segue fechado para as decisões
+        assert not cliente.circuito_aberto and cliente.modelo_disponivel()
@@ -0,0 +1,49 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from benchmarks import _extratos_brutos, _saneamento_por_linha, _saneamento_colunar, _carga_texto
+from carregadores import sanear_bloco, ler_intermediario, cabecalho_xlsx, ler_cabecalho_xlsx, SCHEMAS_INTERMEDIARIOS
+from motor_matching import match_exato
+
+
+def test_saneamento_igual_a_implementacao_por_linha():
+    bruto_p, bruto_b = _extratos_brutos(2_000)
+    antigo, novo = _saneamento_por_linha(bruto_p, bruto_b), _saneamento_colunar(bruto_p, bruto_b)
+    assert list(antigo) == list(novo)
+    for nome_aba in antigo:
+        pd.testing.assert_frame_equal(antigo[nome_aba].reset_index(drop=True), novo[nome_aba].reset_index(drop=True))
+
+
+def test_layout_compacto_casa_igual_ao_de_textos(tmp_path):
+    bruto_p, bruto_b = _extratos_brutos(2_000)
+    caminhos = {}
+    for origem, bruto in [('Protheus', bruto_p), ('Banco', bruto_b)]:
+        caminhos[origem] = str(tmp_path / f"{origem}.parquet")
+        saneado, _, _ = sanear_bloco(bruto, origem)
+        pq.write_table(pa.Table.from_pandas(saneado, schema=SCHEMAS_INTERMEDIARIOS[origem], preserve_index=False),
+                       caminhos[origem])
+    resultados = []
+    for carregar in (_carga_texto, ler_intermediario):
+        conciliados, sobra_p, sobra_b = match_exato(carregar(caminhos['Protheus'], 'Protheus'),
+                                                    carregar(caminhos['Banco'], 'Banco'))
+        resultados.append((len(conciliados), len(sobra_p), len(sobra_b), sobra_p['Historico'].astype(str).tolist()))
+    assert resultados[0] == resultados[1]
+
+
+def test_cabecalho_xlsx(tmp_path):
+    caminho = str(tmp_path / 'extrato_banco.xlsx')
+    with xlsxwriter.Workbook(caminho) as workbook:
+        planilha = workbook.add_worksheet()
+        planilha.write_row(0, 0, ['Data', 'Descrição', 'Valor'])
+        for linha in range(1, 51):
+            planilha.write_row(linha, 0, [45_000 + linha, f"PIX ENVIADO DOC {linha:08d}", -12.5 * linha])
+    with open(caminho, 'rb') as f:
+        conteudo = f.read()
+    esperado = list(pd.read_excel(io.BytesIO(conteudo), nrows=0).columns)
+    assert list(cabecalho_xlsx(conteudo)) == list(ler_cabecalho_xlsx(caminho)) == esperado
+    # Segunda leitura vem do cache por hash, com o mesmo resultado
+    assert list(cabecalho_xlsx(conteudo)) == esperado
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from etapa_ia import adjudicar_pares_ia
+from regras_aprendidas import DicionarioRegras
+
+APROVADO = {'match': True, 'confianca': 'alta', 'justificativa': 'Mesmo fornecedor.'}
+
+
+def _sobras():
+    sobra_p = pd.DataFrame({'Data': pd.to_datetime(['2025-01-01'] * 2), 'Historico': ['PAGTO NF ALFA', 'PAGTO NF BETA'],
+                            'Valor_Centavos': [-10_000, -10_000], 'Ref. Auditoria': [0, 1]})
+    sobra_b = pd.DataFrame({'Data': pd.to_datetime(['2025-01-05'] * 2), 'Descricao': ['PIX ALFA', 'PIX GAMA'],
+                            'Valor_Centavos': [-10_000, -10_000], 'Ref. Auditoria': [0, 1]})
+    pares = pd.DataFrame({'pos_p': [0, 0, 1, 1], 'pos_b': [0, 1, 0, 1]})
+    return sobra_p, sobra_b, pares
+
+
+def test_revisao_conta_linhas_ainda_abertas():
+    sobra_p, sobra_b, pares = _sobras()
+
+    def consultar(historico, descricao):
+        # Só ALFA x ALFA tem decisão; os outros três pares ficam sem resposta do modelo
+        return APROVADO if 'ALFA' in historico and 'ALFA' in descricao else None
+
+    df_ia, revisao, stats = adjudicar_pares_ia(sobra_p, sobra_b, pares, ['alta'], 1, consultar=consultar)
+    assert df_ia[['pos_p', 'pos_b']].values.tolist() == [[0, 0]]
+    # Os pares que envolvem linhas conciliadas saem da revisão; sobra BETA x GAMA (duas linhas)
+    assert revisao.values.tolist() == [[1, 1]]
+    assert stats['revisao_humana'] == 2
+
+
+def test_regras_ignoram_respostas_do_cache(tmp_path):
+    sobra_p, sobra_b, pares = _sobras()
+    for do_cache, observadas in [(True, 0), (False, 1)]:
+        regras = DicionarioRegras(str(tmp_path / f"regras_{do_cache}.json"))
+        resposta = dict(APROVADO, do_cache=True) if do_cache else APROVADO
+        adjudicar_pares_ia(sobra_p, sobra_b, pares.iloc[:1], ['alta'], 1, consultar=lambda h, d: resposta, regras=regras)
+        assert regras.salvar()['observadas'] == observadas
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from benchmarks import _sobras_agrupadas
+from motor_agrupamento import buscar_subconjunto, match_agrupado, METODO_AGRUPADO_PROTHEUS
+
+PRAZO = float('inf')
+
+
+def _grupos_certos(df_agr) -> int:
+    """Grupos conciliados em que todas as linhas ligam itens do mesmo grupo plantado."""
+    linha_certa = (df_agr['Historico'] == df_agr['Descricao']) & (df_agr['Historico'] != 'AVULSO')
+    lado_alvo = np.where(df_agr['Metodo'] == METODO_AGRUPADO_PROTHEUS, 'b', 'p')
+    alvo = np.char.add(lado_alvo.astype(str), np.where(lado_alvo == 'b', df_agr['pos_b'], df_agr['pos_p']).astype(str))
+    return int(linha_certa.groupby(alvo).all().sum())
+
+
+def test_subconjunto_exato():
+    valores = np.array([600, 100, 400, 250], dtype=np.int64)
+    grupo, custo, _, estourou, ambigua = buscar_subconjunto(valores, np.array([0, 1, 2, 3]), 650, 2, PRAZO)
+    assert sorted(grupo.tolist()) == [2, 3]
+    assert custo == 5 and not estourou and not ambigua
+
+
+def test_subconjunto_empate_por_data():
+    valores = np.array([100, 200, 150, 150], dtype=np.int64)
+    # Dois grupos somam 300: vence o mais próximo do alvo; com a mesma distância, ninguém (sem o limite de densidade)
+    grupo, _, _, _, ambigua = buscar_subconjunto(valores, np.array([0, 0, 2, 2]), 300, 2, PRAZO, limite_acaso=np.inf)
+    assert sorted(grupo.tolist()) == [0, 1] and not ambigua
+    grupo, _, _, _, ambigua = buscar_subconjunto(valores, np.array([1, 1, 1, 1]), 300, 2, PRAZO, limite_acaso=np.inf)
+    assert grupo is None and ambigua
+
+
+def test_subconjunto_janela_densa():
+    valores = np.array([600, 100, 400, 250], dtype=np.int64)
+    grupo, _, acaso, _, ambigua = buscar_subconjunto(valores, np.zeros(4, np.int64), 650, 2, PRAZO, limite_acaso=0.0)
+    assert grupo is None and ambigua and acaso > 0
+
+
+@pytest.mark.parametrize('n_grupos, n_avulsos, recall_minimo', [(100, 0, 0.6), (100, 200, 0.1)])
+def test_grupos_plantados(n_grupos, n_avulsos, recall_minimo):
+    sobra_p, sobra_b = _sobras_agrupadas(n_grupos, n_avulsos)
+    df_agr, _, stats = match_agrupado(sobra_p, sobra_b, 3, 4, 0.05)
+    certos = _grupos_certos(df_agr)
+    assert certos >= recall_minimo * n_grupos
+    assert certos == stats['grupos']
+
+
+def test_janelas_densas_vao_para_revisao():
+    sobra_p, sobra_b = _sobras_agrupadas(300, 600)
+    df_agr, revisao, stats = match_agrupado(sobra_p, sobra_b, 3, 4, 0.05)
+    assert _grupos_certos(df_agr) >= 0.95 * stats['grupos']
+    assert stats['grupos_revisao'] > stats['grupos']
+    # Linhas em revisão não foram conciliadas
+    assert not np.isin(revisao['pos_p'], df_agr['pos_p']).any()
+    assert not np.isin(revisao['pos_b'], df_agr['pos_b']).any()
+
+
+def test_grupo_soma_o_alvo():
+    sobra_p, sobra_b = _sobras_agrupadas(100, 200)
+    df_agr, _, _ = match_agrupado(sobra_p, sobra_b, 3, 4, 0.05)
+    n1 = df_agr[df_agr['Metodo'] == METODO_AGRUPADO_PROTHEUS]
+    somas = n1.groupby('pos_b')['Valor_Centavos'].sum()
+    assert (somas.values == sobra_b['Valor_Centavos'].values[somas.index]).all()
+    # Nenhuma linha entra em dois grupos
+    assert df_agr[df_agr['Metodo'] == METODO_AGRUPADO_PROTHEUS]['pos_p'].is_unique
+    assert df_agr[df_agr['Metodo'] != METODO_AGRUPADO_PROTHEUS]['pos_b'].is_unique
@@ -0,0 +1,18 @@
+import numpy as np
+
+from benchmarks import _extratos_duplicados
+from motor_matching import match_exato
+
+
+def test_match_exato_um_para_um_com_duplicatas():
+    df_p, df_b = _extratos_duplicados(2_000, 20)
+    qtd_p = df_p.groupby(['Data', 'Valor_Centavos']).size()
+    qtd_b = df_b.groupby(['Data', 'Valor_Centavos']).size()
+    qtd_p, qtd_b = qtd_p.align(qtd_b, fill_value=0)
+
+    conciliados, sobra_p, sobra_b = match_exato(df_p, df_b)
+    # O máximo um-para-um possível em cada chave (Data, valor), e nenhuma linha usada duas vezes
+    assert len(conciliados) == int(np.minimum(qtd_p, qtd_b).sum())
+    assert conciliados['Ref. Auditoria_Protheus'].is_unique and conciliados['Ref. Auditoria_Banco'].is_unique
+    assert len(conciliados) + len(sobra_p) == len(df_p)
+    assert len(conciliados) + len(sobra_b) == len(df_b)
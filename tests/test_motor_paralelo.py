@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks import _extratos_sinteticos, _conciliar_serial
+from motor_matching import MODO_GULOSO
+from motor_paralelo import conciliar_particionado
+
+
+def test_particionado_igual_ao_serial():
+    df_p, df_b = _extratos_sinteticos(5_000)
+    base = _conciliar_serial(df_p, df_b, 3, 5, MODO_GULOSO)
+    res = conciliar_particionado(df_p, df_b, 3, 5, MODO_GULOSO, 2)
+    for coluna in ['Ref. Auditoria_Protheus', 'Ref. Auditoria_Banco']:
+        assert np.array_equal(base[0][coluna].values, res[0][coluna].values)
+    assert np.array_equal(base[1]['Ref. Auditoria'].values, res[1]['Ref. Auditoria'].values)
+    assert np.array_equal(base[2]['Ref. Auditoria'].values, res[2]['Ref. Auditoria'].values)
+    pd.testing.assert_frame_equal(base[3], res[3])
+    pd.testing.assert_frame_equal(base[4], res[4])
@@ -0,0 +1,28 @@
+import pytest
+
+from benchmarks import _sobras_faixa_ia
+from conciliador_enterprise_v2 import TOLERANCIA_DIAS, JANELA_IA_DIAS
+from etapa_ia import adjudicar_pares_ia
+from motor_matching import match_tolerancia
+from ollama_simulado import decidir
+from recuperacao import selecionar_candidatos, BACKEND_HASHING, BACKEND_OLLAMA
+
+
+def _consultar(historico, descricao):
+    # Modelo simulado exigente: o fornecedor inteiro tem que aparecer abreviado na descrição
+    nome = historico.split()[3:5]
+    return decidir(historico, descricao) if f"{nome[0]} {nome[1][:4]}" in descricao else \
+        {'match': False, 'confianca': 'baixa', 'justificativa': 'Fornecedor diferente.'}
+
+
+@pytest.mark.parametrize('backend', [BACKEND_HASHING, BACKEND_OLLAMA])
+def test_top_k_mantem_os_pares_certos(backend, ollama_simulado):
+    sobra_p, sobra_b = _sobras_faixa_ia(20, 10)
+    _, pares_ia = match_tolerancia(sobra_p, sobra_b, TOLERANCIA_DIAS, JANELA_IA_DIAS)
+    pares, stats = selecionar_candidatos(sobra_p, sobra_b, pares_ia, 3, backend)
+    assert stats['backend'] == backend
+    assert len(pares) < len(pares_ia)
+
+    df_ia, _, _ = adjudicar_pares_ia(sobra_p, sobra_b, pares, ['alta'], 4, consultar=_consultar)
+    assert len(df_ia) == len(sobra_p)
+    assert (df_ia['pos_p'].values == df_ia['pos_b'].values).all()
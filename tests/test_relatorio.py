@@ -0,0 +1,26 @@
+import pandas as pd
+
+from benchmarks import _abas_sinteticas, _relatorio_pandas
+from conciliador_enterprise_v2 import LARGURAS_RELATORIO
+from relatorio import escrever_excel, juntar_aba
+
+
+def test_streaming_igual_ao_to_excel(tmp_path):
+    abas = _abas_sinteticas(2_000)
+    _relatorio_pandas(str(tmp_path / 'anterior.xlsx'), abas)
+    escrever_excel(str(tmp_path / 'streaming.xlsx'), abas, LARGURAS_RELATORIO)
+    anterior = pd.read_excel(tmp_path / 'anterior.xlsx', sheet_name=None)
+    streaming = pd.read_excel(tmp_path / 'streaming.xlsx', sheet_name=None)
+    assert list(anterior) == list(streaming)
+    for nome_aba in anterior:
+        pd.testing.assert_frame_equal(anterior[nome_aba], streaming[nome_aba])
+
+
+def test_aba_acima_do_limite_e_dividida(tmp_path):
+    abas = _abas_sinteticas(2_000)
+    total = len(juntar_aba(abas['Conciliados']))
+    caminho = str(tmp_path / 'dividido.xlsx')
+    planilhas = escrever_excel(caminho, {'Conciliados': abas['Conciliados']}, max_linhas_aba=401)
+    assert list(planilhas) == ['Conciliados', 'Conciliados (2)', 'Conciliados (3)']
+    relidas = pd.read_excel(caminho, sheet_name=None)
+    assert [len(df) for df in relidas.values()] == [400, 400, total - 800]
@@ -1,4 +1,7 @@
+import re
 import unicodedata
+import numpy as np
+import pandas as pd
 
 def normalizar_coluna(text, capitalize: bool = False) -> str:
     """Remove acentos, espaços extras e padroniza para minúsculo."""
@@ -15,4 +18,21 @@ def normalizar_coluna(text, capitalize: bool = False) -> str:
     if capitalize:
         return text.strip().capitalize()
     
-    return text.lower().strip()
\ No newline at end of file
+    return text.lower().strip()
+
+def normalizar_texto(text) -> str:
+    """Normaliza descrições para comparação: sem acentos, minúsculo, só letras e números."""
+    base = normalizar_coluna(text)
+    return " ".join(re.sub(r'[^a-z0-9]+', ' ', base).split())
+
+def para_centavos(valores) -> np.ndarray:
+    """Reais (float) -> centavos int64, com o mesmo arredondamento de .round(2)."""
+    return np.rint(np.asarray(valores, dtype=np.float64) * 100).astype(np.int64)
+
+def centavos_para_reais(df: pd.DataFrame, coluna: str = 'Valor_Centavos') -> pd.DataFrame:
+    """Troca a coluna de centavos por 'Valor_Real' (float) na mesma posição. Usar só na saída."""
+    if coluna not in df.columns:
+        return df
+    df = df.copy()
+    df[coluna] = df[coluna].astype(np.float64) / 100
+    return df.rename(columns={coluna: 'Valor_Real'})